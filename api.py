@@ -1,16 +1,25 @@
-from typing import Optional
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from scraper.mercadolibre import (
-    scrape_listing,
-    scrape_listing_from_url,
-    save_results_to_json,
+from scraper.mercadolibre import iter_scrape_listing, iter_scrape_listing_from_url, save_results_to_json
+from scraper.mercadolibre_async import (
+    aclose_client,
+    iter_scrape_listing_async,
+    iter_scrape_listing_from_url_async,
+    scrape_listing_async,
+    scrape_listing_from_url_async,
 )
-from main import run_analysis
-from main import _mongo_upsert_items, mongo_get_items
+from main import SENTIMENT_TIMEOUT, get_sentiment_result, prepare_sentiment, run_analysis, shutdown_sentiment_pool
+from scraper.singleflight import flight_key, search_flight, search_flight_async
+from main import _mongo_upsert_items, mongo_get_items, mongo_known_products, ensure_mongo_indexes, keyword_analysis
+from jobs import DONE, FAILED, JobProgress, get_job_queue
 
 
 app = FastAPI()
@@ -24,12 +33,90 @@ app.add_middleware(
 )
 
 
+def _run_scrape_job(params: Dict, progress: JobProgress) -> Dict:
+    """
+    Ejecuta un trabajo "search" o "from_url": scrape con avance por página e
+    ítem, guardado en Mongo/JSON y análisis opcional.
+    """
+    max_pages = params.get("max_pages") or 5
+    opts = dict(
+        max_pages=max_pages,
+        per_page_delay=params.get("per_page_delay") or 1.5,
+        detail_delay=params.get("detail_delay") or 1.0,
+        min_items=15,
+        on_page=progress.page,
+        known=mongo_known_products if params.get("incremental") else None,
+    )
+    if params.get("url"):
+        source = params["url"]
+        scrape = iter_scrape_listing_from_url
+        out_path = "data/listado.json"
+    else:
+        source = params.get("keyword") or ""
+        scrape = iter_scrape_listing
+        out_path = f"data/{source.replace(' ', '_')}.json"
+
+    def _run() -> List[Dict]:
+        items: List[Dict] = []
+        for item in scrape(source, **opts):
+            items.append(item)
+            progress.item()
+        try:
+            _mongo_upsert_items(items, source)
+        except Exception:
+            pass
+        return items
+
+    items = search_flight.do(flight_key(source, max_pages, 15, bool(params.get("incremental"))), _run)
+    if progress.items < len(items):
+        # Resultado compartido con otro trabajo en vuelo
+        progress.item(len(items) - progress.items)
+    if params.get("persist"):
+        save_results_to_json(items, source, out_path)
+    out: Dict = {"keyword": source, "count": len(items), "items": items}
+    if params.get("analysis"):
+        out["analysis"] = run_analysis(items, None, True)
+    return out
+
+
+jobs = get_job_queue()
+jobs.register("search", _run_scrape_job)
+jobs.register("from_url", _run_scrape_job)
+
+
+@app.on_event("startup")
+async def _startup():
+    try:
+        await run_in_threadpool(ensure_mongo_indexes)
+    except Exception:
+        pass
+    await run_in_threadpool(jobs.start)
+    # Carga el modelo de sentimiento en segundo plano sin retrasar el arranque
+    asyncio.get_running_loop().run_in_executor(None, prepare_sentiment)
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await run_in_threadpool(jobs.stop)
+    shutdown_sentiment_pool()
+    await aclose_client()
+
+
 class SearchBody(BaseModel):
     keyword: str
     max_pages: Optional[int] = 5
     per_page_delay: Optional[float] = 1.5
     detail_delay: Optional[float] = 1.0
     persist: Optional[bool] = False
+    # Recrawl incremental: reutiliza el detalle guardado de productos sin cambios
+    incremental: Optional[bool] = False
+
+
+class CachedSearchBody(SearchBody):
+    mode: Optional[str] = "exact"
+    fields: Optional[List[str]] = None
+    skip: Optional[int] = 0
+    limit: Optional[int] = 0
 
 
 class UrlBody(BaseModel):
@@ -38,68 +125,111 @@ class UrlBody(BaseModel):
     per_page_delay: Optional[float] = 1.5
     detail_delay: Optional[float] = 1.0
     persist: Optional[bool] = False
+    # Recrawl incremental: reutiliza el detalle guardado de productos sin cambios
+    incremental: Optional[bool] = False
 
 
-@app.post("/search")
-def search(body: SearchBody):
-    items = scrape_listing(
-        keyword=body.keyword,
-        max_pages=body.max_pages or 5,
-        per_page_delay=body.per_page_delay or 1.5,
-        detail_delay=body.detail_delay or 1.0,
-        min_items=15,
-    )
+def _split_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
+
+async def _scrape_shared(target: str, is_url: bool, max_pages: int, per_page_delay: float, detail_delay: float, min_items: int = 15, incremental: bool = False) -> List[Dict]:
+    """
+    Scrape + guardado en Mongo compartido entre peticiones idénticas concurrentes
+    (misma palabra clave o URL, max_pages, min_items e incremental).
+    """
+    known = mongo_known_products if incremental else None
+
+    async def _run() -> List[Dict]:
+        if is_url:
+            items = await scrape_listing_from_url_async(url=target, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, known=known)
+        else:
+            items = await scrape_listing_async(keyword=target, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, known=known)
+        try:
+            await run_in_threadpool(_mongo_upsert_items, items, target)
+        except Exception:
+            pass
+        return items
+
+    return await search_flight_async.do(flight_key(target, max_pages, min_items, incremental), _run)
+
+
+def _encode_event(fmt: str, event: str, data) -> bytes:
+    """
+    Serializa un evento como línea NDJSON ({"event", "data"}) o como bloque SSE.
+    """
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def _stream_response(fmt: str, events: AsyncIterator[bytes]) -> StreamingResponse:
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    # Sin caché ni buffering en proxies (nginx) para que cada ítem llegue al enviarse
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events, media_type=media_type, headers=headers)
+
+
+async def _stream_items(fmt: str, keyword: str, source: AsyncIterator[Dict], persist: bool, out_path: str, with_analysis: bool) -> AsyncIterator[bytes]:
+    """
+    Emite un evento "item" por producto en cuanto se enriquece y, al terminar,
+    guarda en Mongo/JSON y emite un evento "summary" (con el análisis si se pide).
+    """
+    items: List[Dict] = []
+    async for item in source:
+        items.append(item)
+        yield _encode_event(fmt, "item", item)
     try:
-        _mongo_upsert_items(items, body.keyword)
+        await run_in_threadpool(_mongo_upsert_items, items, keyword)
     except Exception:
         pass
+    summary: Dict = {"keyword": keyword, "count": len(items)}
+    if with_analysis:
+        summary["analysis"] = await run_in_threadpool(run_analysis, items, SENTIMENT_TIMEOUT, True)
+    if persist:
+        await run_in_threadpool(save_results_to_json, items, keyword, out_path)
+    yield _encode_event(fmt, "summary", summary)
+    pending_id = ((summary.get("analysis") or {}).get("sentiment") or {}).get("pending")
+    if pending_id:
+        # El sentimiento llega como evento aparte cuando el pool termina
+        sentiment = await run_in_threadpool(get_sentiment_result, pending_id, None)
+        if sentiment is not None:
+            yield _encode_event(fmt, "sentiment", sentiment)
+
+
+@app.post("/search")
+async def search(body: SearchBody):
+    items = await _scrape_shared(body.keyword, False, body.max_pages or 5, body.per_page_delay or 1.5, body.detail_delay or 1.0, incremental=bool(body.incremental))
     out = {
         "keyword": body.keyword,
         "count": len(items),
         "items": items,
     }
     if body.persist:
-        save_results_to_json(items, body.keyword, f"data/{body.keyword.replace(' ', '_')}.json")
+        await run_in_threadpool(save_results_to_json, items, body.keyword, f"data/{body.keyword.replace(' ', '_')}.json")
     return out
 
 
 @app.post("/from-url")
-def from_url(body: UrlBody):
-    items = scrape_listing_from_url(
-        url=body.url,
-        max_pages=body.max_pages or 5,
-        per_page_delay=body.per_page_delay or 1.5,
-        detail_delay=body.detail_delay or 1.0,
-        min_items=15,
-    )
-    try:
-        _mongo_upsert_items(items, body.url)
-    except Exception:
-        pass
+async def from_url(body: UrlBody):
+    items = await _scrape_shared(body.url, True, body.max_pages or 5, body.per_page_delay or 1.5, body.detail_delay or 1.0, incremental=bool(body.incremental))
     out = {
         "keyword": body.url,
         "count": len(items),
         "items": items,
     }
     if body.persist:
-        save_results_to_json(items, body.url, f"data/listado.json")
+        await run_in_threadpool(save_results_to_json, items, body.url, f"data/listado.json")
     return out
 
 
 @app.post("/search_with_analysis")
-def search_with_analysis(body: SearchBody):
-    items = scrape_listing(
-        keyword=body.keyword,
-        max_pages=body.max_pages or 5,
-        per_page_delay=body.per_page_delay or 1.5,
-        detail_delay=body.detail_delay or 1.0,
-        min_items=15,
-    )
-    try:
-        _mongo_upsert_items(items, body.keyword)
-    except Exception:
-        pass
-    analysis = run_analysis(items)
+async def search_with_analysis(body: SearchBody):
+    items = await _scrape_shared(body.keyword, False, body.max_pages or 5, body.per_page_delay or 1.5, body.detail_delay or 1.0, incremental=bool(body.incremental))
+    analysis = await run_in_threadpool(run_analysis, items, SENTIMENT_TIMEOUT, True)
     out = {
         "keyword": body.keyword,
         "count": len(items),
@@ -107,24 +237,14 @@ def search_with_analysis(body: SearchBody):
         "analysis": analysis,
     }
     if body.persist:
-        save_results_to_json(items, body.keyword, f"data/{body.keyword.replace(' ', '_')}.json")
+        await run_in_threadpool(save_results_to_json, items, body.keyword, f"data/{body.keyword.replace(' ', '_')}.json")
     return out
 
 
 @app.post("/from-url_with_analysis")
-def from_url_with_analysis(body: UrlBody):
-    items = scrape_listing_from_url(
-        url=body.url,
-        max_pages=body.max_pages or 5,
-        per_page_delay=body.per_page_delay or 1.5,
-        detail_delay=body.detail_delay or 1.0,
-        min_items=15,
-    )
-    try:
-        _mongo_upsert_items(items, body.url)
-    except Exception:
-        pass
-    analysis = run_analysis(items)
+async def from_url_with_analysis(body: UrlBody):
+    items = await _scrape_shared(body.url, True, body.max_pages or 5, body.per_page_delay or 1.5, body.detail_delay or 1.0, incremental=bool(body.incremental))
+    analysis = await run_in_threadpool(run_analysis, items, SENTIMENT_TIMEOUT, True)
     out = {
         "keyword": body.url,
         "count": len(items),
@@ -132,53 +252,163 @@ def from_url_with_analysis(body: UrlBody):
         "analysis": analysis,
     }
     if body.persist:
-        save_results_to_json(items, body.url, f"data/listado.json")
+        await run_in_threadpool(save_results_to_json, items, body.url, f"data/listado.json")
     return out
 
 
+@app.post("/search/stream")
+async def search_stream(body: SearchBody, format: str = "ndjson"):
+    source = iter_scrape_listing_async(
+        keyword=body.keyword,
+        max_pages=body.max_pages or 5,
+        per_page_delay=body.per_page_delay or 1.5,
+        detail_delay=body.detail_delay or 1.0,
+        min_items=15,
+        known=mongo_known_products if body.incremental else None,
+    )
+    path = f"data/{body.keyword.replace(' ', '_')}.json"
+    return _stream_response(format, _stream_items(format, body.keyword, source, bool(body.persist), path, False))
+
+
+@app.post("/from-url/stream")
+async def from_url_stream(body: UrlBody, format: str = "ndjson"):
+    source = iter_scrape_listing_from_url_async(
+        url=body.url,
+        max_pages=body.max_pages or 5,
+        per_page_delay=body.per_page_delay or 1.5,
+        detail_delay=body.detail_delay or 1.0,
+        min_items=15,
+        known=mongo_known_products if body.incremental else None,
+    )
+    return _stream_response(format, _stream_items(format, body.url, source, bool(body.persist), "data/listado.json", False))
+
+
+@app.post("/search_with_analysis/stream")
+async def search_with_analysis_stream(body: SearchBody, format: str = "ndjson"):
+    source = iter_scrape_listing_async(
+        keyword=body.keyword,
+        max_pages=body.max_pages or 5,
+        per_page_delay=body.per_page_delay or 1.5,
+        detail_delay=body.detail_delay or 1.0,
+        min_items=15,
+        known=mongo_known_products if body.incremental else None,
+    )
+    path = f"data/{body.keyword.replace(' ', '_')}.json"
+    return _stream_response(format, _stream_items(format, body.keyword, source, bool(body.persist), path, True))
+
+
+@app.post("/from-url_with_analysis/stream")
+async def from_url_with_analysis_stream(body: UrlBody, format: str = "ndjson"):
+    source = iter_scrape_listing_from_url_async(
+        url=body.url,
+        max_pages=body.max_pages or 5,
+        per_page_delay=body.per_page_delay or 1.5,
+        detail_delay=body.detail_delay or 1.0,
+        min_items=15,
+        known=mongo_known_products if body.incremental else None,
+    )
+    return _stream_response(format, _stream_items(format, body.url, source, bool(body.persist), "data/listado.json", True))
+
+
+@app.post("/jobs/search", status_code=202)
+async def submit_search_job(body: SearchBody, analysis: bool = True):
+    params = {
+        "keyword": body.keyword,
+        "max_pages": body.max_pages or 5,
+        "per_page_delay": body.per_page_delay or 1.5,
+        "detail_delay": body.detail_delay or 1.0,
+        "persist": bool(body.persist),
+        "analysis": analysis,
+        "incremental": bool(body.incremental),
+    }
+    return await run_in_threadpool(jobs.submit, "search", params)
+
+
+@app.post("/jobs/from-url", status_code=202)
+async def submit_from_url_job(body: UrlBody, analysis: bool = True):
+    params = {
+        "url": body.url,
+        "max_pages": body.max_pages or 5,
+        "per_page_delay": body.per_page_delay or 1.5,
+        "detail_delay": body.detail_delay or 1.0,
+        "persist": bool(body.persist),
+        "analysis": analysis,
+        "incremental": bool(body.incremental),
+    }
+    return await run_in_threadpool(jobs.submit, "from_url", params)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await run_in_threadpool(jobs.get, job_id, True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job["status"] not in (DONE, FAILED):
+        # Aún en cola o en ejecución: el cliente debe seguir consultando
+        return JSONResponse(status_code=202, content={"id": job_id, "status": job["status"], "progress": job["progress"]})
+    return job
+
+
+@app.get("/sentiment/{pending_id}")
+async def get_sentiment(pending_id: str, wait: float = 0):
+    res = await run_in_threadpool(get_sentiment_result, pending_id, min(max(wait, 0.0), 30.0))
+    if res is None:
+        raise HTTPException(status_code=404, detail="Sentimiento no encontrado o expirado")
+    if res.get("status") == "pending":
+        return JSONResponse(status_code=202, content=res)
+    return res
+
+
 @app.get("/data/{keyword}")
-def get_data(keyword: str):
+async def get_data(keyword: str, mode: str = "exact", fields: Optional[str] = None, skip: int = 0, limit: int = 0):
     try:
-        items = mongo_get_items(keyword)
+        items = await run_in_threadpool(mongo_get_items, keyword, mode, _split_fields(fields), skip, limit)
     except Exception:
         items = []
-    return {"keyword": keyword, "count": len(items), "items": items}
+    return {"keyword": keyword, "count": len(items), "skip": skip, "limit": limit, "items": items}
+
+
+@app.get("/stats/{keyword}")
+async def get_stats(keyword: str):
+    try:
+        analysis = await run_in_threadpool(keyword_analysis, keyword)
+    except Exception:
+        analysis = None
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Sin datos para la palabra clave")
+    return {"keyword": keyword, "analysis": analysis}
 
 
 @app.post("/search_cached_with_analysis")
-def search_cached_with_analysis(body: SearchBody):
+async def search_cached_with_analysis(body: CachedSearchBody):
     try:
-        cached = mongo_get_items(body.keyword)
+        cached = await run_in_threadpool(mongo_get_items, body.keyword, body.mode or "exact", body.fields, body.skip or 0, body.limit or 0)
     except Exception:
         cached = []
-    items = cached if cached else scrape_listing(
-        keyword=body.keyword,
-        max_pages=body.max_pages or 5,
-        per_page_delay=body.per_page_delay or 1.5,
-        detail_delay=body.detail_delay or 1.0,
-        min_items=15,
-    )
-    if not cached:
+    items = cached if cached else await _scrape_shared(body.keyword, False, body.max_pages or 5, body.per_page_delay or 1.5, body.detail_delay or 1.0, incremental=bool(body.incremental))
+    analysis = None
+    if cached and (body.mode or "exact") == "exact" and not body.fields and not body.skip and not body.limit:
+        # Todos los productos de la palabra clave: agregaciones precalculadas
         try:
-            _mongo_upsert_items(items, body.keyword)
+            analysis = await run_in_threadpool(keyword_analysis, body.keyword, True)
         except Exception:
-            pass
-    analysis = run_analysis(items)
+            analysis = None
+    if analysis is None:
+        analysis = await run_in_threadpool(run_analysis, items, SENTIMENT_TIMEOUT, True)
     return {"keyword": body.keyword, "count": len(items), "items": items, "analysis": analysis}
 
 
 @app.get("/save/{keyword}")
-def save_keyword(keyword: str):
-    items = scrape_listing(
-        keyword=keyword,
-        max_pages=1,
-        per_page_delay=1.5,
-        detail_delay=1.0,
-    )
-    try:
-        _mongo_upsert_items(items, keyword)
-    except Exception:
-        pass
+async def save_keyword(keyword: str):
+    items = await _scrape_shared(keyword, False, 1, 1.5, 1.0)
     path = f"data/{keyword.replace(' ', '_')}.json"
-    save_results_to_json(items, keyword, path)
+    await run_in_threadpool(save_results_to_json, items, keyword, path)
     return {"keyword": keyword, "count": len(items), "path": path}
\ No newline at end of file
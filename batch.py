@@ -0,0 +1,185 @@
+"""
+Scrape por lotes de muchas palabras clave (o URLs de listado).
+
+Todas las palabras se reparten en un solo pool de hilos (SCRAPER_BATCH_WORKERS)
+y comparten los límites global y por host de scraper.ratelimit, en lugar de
+lanzar un proceso por palabra. Los productos se entregan a los destinos
+(MongoDB, backend Java) en bloques de BATCH_CHUNK a medida que se scrapean.
+El avance se anota en un checkpoint JSON lines: al relanzar el lote con el
+mismo checkpoint se saltan las palabras ya terminadas; una palabra que quedó
+a medias se vuelve a scrapear (los upserts son idempotentes).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from scraper.cache import normalize_url
+from scraper.mercadolibre import KnownLookup, iter_scrape_listing, iter_scrape_listing_from_url, send_results_to_java
+
+
+BATCH_WORKERS = int(os.environ.get("SCRAPER_BATCH_WORKERS", "4"))
+BATCH_CHUNK = int(os.environ.get("SCRAPER_BATCH_CHUNK", "100"))
+# Checkpoints de los lotes lanzados como trabajo en segundo plano
+BATCH_DIR = os.environ.get("SCRAPER_BATCH_DIR", os.path.join("data", "batches"))
+
+# Destino de un bloque de productos: fn(items, palabra_clave); lanza excepción si falla
+Sink = Callable[[List[Dict], str], Any]
+
+
+def _is_url(target: str) -> bool:
+    return target.lower().startswith(("http://", "https://"))
+
+
+def _norm(target: str) -> str:
+    target = (target or "").strip()
+    if _is_url(target):
+        return normalize_url(target)
+    return " ".join(target.lower().split())
+
+
+def read_keywords(path: str) -> List[str]:
+    """
+    Una palabra clave o URL por línea; se ignoran líneas vacías y comentarios (#).
+    """
+    out: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                out.append(line)
+    return out
+
+
+def java_sink(java_url: str, token: Optional[str] = None) -> Sink:
+    def _send(items: List[Dict], keyword: str) -> None:
+        if not send_results_to_java(items, keyword, java_url, token):
+            raise RuntimeError(f"El backend Java rechazó el bloque de '{keyword}'")
+    return _send
+
+
+class Checkpoint:
+    """
+    Avance del lote: una línea JSON por palabra terminada (done/failed). Cada
+    línea se sincroniza a disco al escribirse para sobrevivir a una caída.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def completed(self) -> Set[str]:
+        done: Set[str] = set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Última línea truncada por una interrupción
+                        continue
+                    key = _norm(rec.get("keyword") or "")
+                    if rec.get("status") == "done":
+                        done.add(key)
+                    else:
+                        done.discard(key)
+        except OSError:
+            pass
+        return done
+
+    def record(self, keyword: str, status: str, count: int, error: Optional[str] = None) -> None:
+        line = json.dumps({"keyword": keyword, "status": status, "count": count, "error": error, "ts": time.time()}, ensure_ascii=False)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _scrape_one(target: str, opts: Dict[str, Any], sinks: List[Sink], chunk_size: int, on_items: Optional[Callable[[int], None]]) -> int:
+    it = iter_scrape_listing_from_url(target, **opts) if _is_url(target) else iter_scrape_listing(target, **opts)
+    count = 0
+    chunk: List[Dict] = []
+
+    def _flush() -> None:
+        for sink in sinks:
+            sink(chunk, target)
+        if on_items is not None:
+            on_items(len(chunk))
+
+    for item in it:
+        chunk.append(item)
+        count += 1
+        if len(chunk) >= chunk_size:
+            _flush()
+            chunk = []
+    if chunk:
+        _flush()
+    return count
+
+
+def run_batch(
+    keywords: Iterable[str],
+    sinks: List[Sink],
+    max_pages: int = 5,
+    per_page_delay: float = 1.5,
+    detail_delay: float = 1.0,
+    min_items: int = 15,
+    workers: int = BATCH_WORKERS,
+    chunk_size: int = BATCH_CHUNK,
+    checkpoint: Optional[Checkpoint] = None,
+    on_items: Optional[Callable[[int], None]] = None,
+    known: Optional[KnownLookup] = None,
+) -> Dict[str, Any]:
+    """
+    Scrapea todas las palabras (deduplicadas) con `workers` en paralelo y
+    devuelve el resumen {"total", "skipped", "done", "failed", "items", "errors"}.
+    Con `known` el scrape es incremental (ver scrape_listing).
+    """
+    done = checkpoint.completed() if checkpoint else set()
+    seen: Set[str] = set()
+    pending: List[str] = []
+    skipped = 0
+    for kw in keywords:
+        key = _norm(kw)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        if key in done:
+            skipped += 1
+            continue
+        pending.append(kw.strip())
+
+    summary: Dict[str, Any] = {"total": len(seen), "skipped": skipped, "done": 0, "failed": 0, "items": 0, "errors": {}}
+    if not pending:
+        return summary
+    opts = dict(max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, known=known)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending))), thread_name_prefix="batch")
+    try:
+        futures = {pool.submit(_scrape_one, kw, opts, sinks, max(1, chunk_size), on_items): kw for kw in pending}
+        for fut in as_completed(futures):
+            kw = futures[fut]
+            try:
+                count = fut.result()
+            except Exception as e:
+                logging.warning("Lote: falló '%s': %s", kw, e)
+                summary["failed"] += 1
+                summary["errors"][kw] = str(e)
+                if checkpoint:
+                    checkpoint.record(kw, "failed", 0, str(e))
+                continue
+            logging.info("Lote: '%s' terminado con %s productos", kw, count)
+            summary["done"] += 1
+            summary["items"] += count
+            if checkpoint:
+                checkpoint.record(kw, "done", count)
+    finally:
+        # En una interrupción no se esperan las palabras que quedaban en cola
+        pool.shutdown(wait=True, cancel_futures=True)
+    return summary
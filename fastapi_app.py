@@ -1,17 +1,36 @@
 import os
 import logging
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
-from scraper.mercadolibre import scrape_listing, scrape_listing_from_url, send_results_to_java
+from batch import BATCH_DIR, Checkpoint, java_sink, run_batch
+from jobs import DONE, FAILED, JobProgress, get_job_queue
+from scraper.singleflight import flight_key, search_flight, search_flight_async
+from scraper.strategies import get_strategy_stats
+from scraper.mercadolibre import iter_scrape_listing, iter_scrape_listing_from_url, send_results_to_java
+from scraper.mercadolibre_async import aclose_client, scrape_listing_async, scrape_listing_from_url_async
 
 logging.basicConfig(level=logging.DEBUG)
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def _startup():
+    await run_in_threadpool(jobs.start)
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await run_in_threadpool(jobs.stop)
+    await aclose_client()
+    await run_in_threadpool(get_strategy_stats().save)
+
+
 class ProcessRequest(BaseModel):
     keyword: Optional[str] = None
     url: Optional[str] = None
@@ -20,24 +39,94 @@ class ProcessRequest(BaseModel):
     detail_delay: float = 1.0
 
 
+class BatchRequest(BaseModel):
+    keywords: List[str]
+    max_pages: int = 5
+    per_page_delay: float = 1.5
+    detail_delay: float = 1.0
+
+
 def _java_cfg():
     return os.environ.get("JAVA_API_URL", "http://localhost:8080"), os.environ.get("PYTHON_SERVICE_TOKEN")
 
 
+def _run_process_job(params: dict, progress: JobProgress) -> dict:
+    opts = dict(max_pages=params["max_pages"], per_page_delay=params["per_page_delay"], detail_delay=params["detail_delay"], on_page=progress.page)
+    source = params.get("url") or params.get("keyword") or ""
+
+    def _run() -> dict:
+        it = iter_scrape_listing_from_url(source, **opts) if params.get("url") else iter_scrape_listing(source, **opts)
+        items = []
+        for item in it:
+            items.append(item)
+            progress.item()
+        java_url, token = _java_cfg()
+        ok = send_results_to_java(items, source, java_url, token)
+        logging.info("process job ok=%s count=%s", ok, len(items))
+        return {"ok": ok, "count": len(items)}
+
+    return search_flight.do("process|" + flight_key(source, params["max_pages"], 15), _run)
+
+
+def _run_batch_job(params: dict, progress: JobProgress) -> dict:
+    # El checkpoint va ligado al trabajo: si se reencola tras un reinicio, retoma donde quedó
+    checkpoint = Checkpoint(os.path.join(BATCH_DIR, progress.job_id + ".jsonl"))
+    return run_batch(
+        params["keywords"],
+        [java_sink(*_java_cfg())],
+        max_pages=params["max_pages"],
+        per_page_delay=params["per_page_delay"],
+        detail_delay=params["detail_delay"],
+        checkpoint=checkpoint,
+        on_items=progress.item,
+    )
+
+
+jobs = get_job_queue()
+jobs.register("process", _run_process_job)
+jobs.register("batch", _run_batch_job)
+
+
 @app.post("/process")
-def process(req: ProcessRequest):
-    if req.url:
-        items = scrape_listing_from_url(req.url, max_pages=req.max_pages, per_page_delay=req.per_page_delay, detail_delay=req.detail_delay)
-        source = req.url
-    else:
-        items = scrape_listing(req.keyword or "", max_pages=req.max_pages, per_page_delay=req.per_page_delay, detail_delay=req.detail_delay)
-        source = req.keyword or ""
-    java_url, token = _java_cfg()
-    ok = send_results_to_java(items, source, java_url, token)
-    logging.info("process ok=%s count=%s", ok, len(items))
-    return {"ok": ok, "count": len(items)}
+async def process(req: ProcessRequest):
+    source = req.url or req.keyword or ""
+
+    async def _run() -> dict:
+        if req.url:
+            items = await scrape_listing_from_url_async(req.url, max_pages=req.max_pages, per_page_delay=req.per_page_delay, detail_delay=req.detail_delay)
+        else:
+            items = await scrape_listing_async(source, max_pages=req.max_pages, per_page_delay=req.per_page_delay, detail_delay=req.detail_delay)
+        java_url, token = _java_cfg()
+        ok = await run_in_threadpool(send_results_to_java, items, source, java_url, token)
+        logging.info("process ok=%s count=%s", ok, len(items))
+        return {"ok": ok, "count": len(items)}
+
+    # Peticiones idénticas concurrentes comparten el scrape y un único envío a Java
+    return await search_flight_async.do("process|" + flight_key(source, req.max_pages, 15), _run)
+
+
+@app.post("/process/jobs", status_code=202)
+async def process_job(req: ProcessRequest):
+    return await run_in_threadpool(jobs.submit, "process", req.dict())
+
+
+@app.post("/process/batch", status_code=202)
+async def process_batch(req: BatchRequest):
+    if not any(k.strip() for k in req.keywords):
+        raise HTTPException(status_code=400, detail="Se requiere al menos una palabra clave")
+    return await run_in_threadpool(jobs.submit, "batch", req.dict())
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(jobs.get, job_id, True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job["status"] not in (DONE, FAILED):
+        return JSONResponse(status_code=202, content=job)
+    return job
 
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
\ No newline at end of file
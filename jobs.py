@@ -0,0 +1,322 @@
+"""
+Cola de trabajos en segundo plano para los scrapes.
+
+Los trabajos se guardan en SQLite (sin broker externo): al enviar uno se
+devuelve su id de inmediato y un pool acotado de hilos lo ejecuta. Cada app
+registra los handlers de los tipos que sabe ejecutar y sus workers solo
+toman esos tipos. Un trabajo idéntico (mismo tipo y parámetros) que ya esté
+en cola o en ejecución se reutiliza en lugar de duplicarse.
+
+Cada trabajo en ejecución lleva el id del worker que lo tomó y un lease que
+ese proceso renueva periódicamente. Varios procesos pueden compartir el mismo
+archivo: solo vuelven a la cola los trabajos cuyo lease venció (su proceso se
+cayó o quedó colgado), no los que otro worker vivo está ejecutando.
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+JOBS_DB = os.environ.get("SCRAPER_JOBS_DB", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("SCRAPER_JOB_WORKERS", "2"))
+# Días que se conservan los trabajos terminados
+JOB_RETENTION_DAYS = float(os.environ.get("SCRAPER_JOB_RETENTION_DAYS", "7"))
+# Segundos de validez del lease de un trabajo en ejecución; se renueva cada tercio
+JOB_LEASE = float(os.environ.get("SCRAPER_JOB_LEASE", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    coalesce_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pages INTEGER NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_kind ON jobs (status, kind, created_at);
+CREATE INDEX IF NOT EXISTS jobs_coalesce ON jobs (coalesce_key, status);
+"""
+
+
+class JobProgress:
+    """
+    Avance de un trabajo en ejecución; los handlers lo actualizan con page()/item().
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self._queue = queue
+        self.job_id = job_id
+        self.pages = 0
+        self.items = 0
+
+    def page(self, pages: Optional[int] = None) -> None:
+        self.pages = pages if pages is not None else self.pages + 1
+        self._queue._update(self.job_id, pages=self.pages)
+
+    def item(self, count: int = 1) -> None:
+        self.items += count
+        self._queue._update(self.job_id, items=self.items)
+
+
+Handler = Callable[[Dict[str, Any], JobProgress], Any]
+
+
+def coalesce_key(kind: str, params: Dict[str, Any]) -> str:
+    """
+    Clave de deduplicación: tipo + parámetros con texto normalizado.
+    """
+    norm = {}
+    for k, v in params.items():
+        if isinstance(v, str):
+            v = " ".join(v.strip().lower().split())
+        norm[k] = v
+    return kind + ":" + json.dumps(norm, sort_keys=True, default=str)
+
+
+class JobQueue:
+    def __init__(self, path: str = JOBS_DB, workers: int = JOB_WORKERS):
+        self.path = path
+        self.workers = max(1, workers)
+        self._handlers: Dict[str, Handler] = {}
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._ready = False
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _ensure_db(self) -> None:
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                # Bases creadas antes de existir los leases
+                cols = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+                for col, typ in (("owner", "TEXT"), ("lease_until", "REAL")):
+                    if col not in cols:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} {typ}")
+            self._ready = True
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        """
+        Arranca los workers y el hilo que renueva los leases. Los trabajos de
+        los tipos registrados cuyo lease venció vuelven a la cola, y se purgan
+        los viejos.
+        """
+        self._ensure_db()
+        with self._connect() as conn:
+            self._requeue_expired(conn)
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - JOB_RETENTION_DAYS * 86400),
+            )
+        self._stop.clear()
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name=f"job-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._heartbeat, name="job-lease", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            threads = list(self._threads)
+            self._threads = []
+        for t in threads:
+            t.join(timeout=timeout)
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encola un trabajo y devuelve {"id", "status", "coalesced"}. Si hay uno
+        idéntico en cola o en ejecución devuelve ese.
+        """
+        self._ensure_db()
+        key = coalesce_key(kind, params)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, status FROM jobs WHERE coalesce_key=? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                    (key, QUEUED, RUNNING),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return {"id": row["id"], "status": row["status"], "coalesced": True}
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, params, coalesce_key, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(params, default=str), key, QUEUED, time.time()),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self._wake.set()
+        return {"id": job_id, "status": QUEUED, "coalesced": False}
+
+    def get(self, job_id: str, with_result: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Estado y avance del trabajo (y su resultado si with_result), o None si no existe.
+        """
+        self._ensure_db()
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        out = {
+            "id": row["id"],
+            "kind": row["kind"],
+            "params": json.loads(row["params"]),
+            "status": row["status"],
+            "progress": {"pages": row["pages"], "items": row["items"]},
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if with_result:
+            out["result"] = json.loads(row["result"]) if row["result"] else None
+        return out
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        cols = ", ".join(f"{k}=?" for k in fields)
+        try:
+            with self._connect() as conn:
+                conn.execute(f"UPDATE jobs SET {cols} WHERE id=?", list(fields.values()) + [job_id])
+        except sqlite3.Error as e:
+            logging.warning("No se pudo actualizar el trabajo %s: %s", job_id, e)
+
+    def _requeue_expired(self, conn: sqlite3.Connection) -> int:
+        """
+        Devuelve a la cola los trabajos en ejecución de los tipos registrados
+        cuyo lease venció (o que no tienen, por ser de antes de los leases).
+        """
+        kinds = list(self._handlers)
+        if not kinds:
+            return 0
+        marks = ",".join("?" * len(kinds))
+        cur = conn.execute(
+            f"UPDATE jobs SET status=?, started_at=NULL, owner=NULL, lease_until=NULL "
+            f"WHERE status=? AND kind IN ({marks}) AND (lease_until IS NULL OR lease_until < ?)",
+            [QUEUED, RUNNING] + kinds + [time.time()],
+        )
+        if cur.rowcount:
+            logging.warning("%d trabajos con el lease vencido vuelven a la cola", cur.rowcount)
+        return cur.rowcount
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(JOB_LEASE / 3):
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET lease_until=? WHERE status=? AND owner=?",
+                        (time.time() + JOB_LEASE, RUNNING, self.worker_id),
+                    )
+                    # Trabajos de workers caídos mientras este proceso sigue vivo
+                    if self._requeue_expired(conn):
+                        self._wake.set()
+            except sqlite3.Error as e:
+                logging.warning("No se pudieron renovar los leases: %s", e)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        marks = ",".join("?" * len(kinds))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status=? AND kind IN ({marks}) ORDER BY created_at LIMIT 1",
+                    [QUEUED] + kinds,
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    conn.execute(
+                        "UPDATE jobs SET status=?, started_at=?, owner=?, lease_until=? WHERE id=?",
+                        (RUNNING, now, self.worker_id, now + JOB_LEASE, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logging.warning("Cola de trabajos no disponible: %s", e)
+                row = None
+            if row is None:
+                # Sondeo periódico por si otro proceso encola trabajos
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            progress = JobProgress(self, row["id"])
+            try:
+                result = self._handlers[row["kind"]](json.loads(row["params"]), progress)
+                self._update(row["id"], status=DONE, result=json.dumps(result, default=str), finished_at=time.time(), lease_until=None)
+            except Exception as e:
+                logging.exception("Trabajo %s falló", row["id"])
+                self._update(row["id"], status=FAILED, error=str(e), finished_at=time.time(), lease_until=None)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Devuelve la cola de trabajos del proceso, creándola de forma perezosa.
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
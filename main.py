@@ -1,15 +1,72 @@
 import argparse
+import math
+import multiprocessing
 import os
+import re
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
+import numpy as np
 import pandas as pd
-from pymongo import MongoClient, UpdateOne
+from pymongo import ASCENDING, TEXT, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
 import hashlib
 import json
 
-from scraper.mercadolibre import scrape_listing, scrape_listing_from_url, save_results_to_json, send_results_to_java
+from scraper.mercadolibre import _slugify, scrape_listing, scrape_listing_from_url, save_results_to_json, send_results_to_java
+from scraper.models import Product, ProductBatch, as_dicts
+
+# Tamaño de lote para el diff y bulk_write de productos
+MONGO_UPSERT_CHUNK = int(os.environ.get("MONGO_UPSERT_CHUNK", "500"))
+# Reintentos de un producto que otro proceso cambió entre la lectura y la escritura
+MONGO_UPSERT_RETRIES = int(os.environ.get("MONGO_UPSERT_RETRIES", "3"))
+# Pool de conexiones del MongoClient compartido
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+
+_mongo_client_instance: Optional[MongoClient] = None
+_mongo_lock = threading.Lock()
+_mongo_indexes_ready = False
+_mongo_indexes_retry_at = 0.0
+
+# Modelo de sentimiento (cargado una vez por proceso) y memo por hash de reseña
+SENTIMENT_MODEL = os.environ.get("SENTIMENT_MODEL", "cardiffnlp/twitter-xlm-roberta-base-sentiment")
+SENTIMENT_BATCH_SIZE = int(os.environ.get("SENTIMENT_BATCH_SIZE", "32"))
+SENTIMENT_MEMO_SIZE = int(os.environ.get("SENTIMENT_MEMO_SIZE", "20000"))
+
+_sentiment_backend: Optional[tuple] = None
+_sentiment_lock = threading.Lock()
+_sentiment_memo_lock = threading.Lock()
+_sentiment_memo: "OrderedDict[str, tuple]" = OrderedDict()
+
+# Pool de procesos para el sentimiento: tamaño, trabajos en cola máximos y espera por petición
+SENTIMENT_PROCESSES = int(os.environ.get("SENTIMENT_PROCESSES", "1"))
+SENTIMENT_QUEUE_MAX = int(os.environ.get("SENTIMENT_QUEUE_MAX", "8"))
+SENTIMENT_TIMEOUT = float(os.environ.get("SENTIMENT_TIMEOUT", "5"))
+SENTIMENT_RESULT_TTL = float(os.environ.get("SENTIMENT_RESULT_TTL", "600"))
+
+_sentiment_pool: Optional[ProcessPoolExecutor] = None
+_sentiment_pool_lock = threading.Lock()
+_sentiment_jobs: Dict[str, tuple] = {}
+
+# Agregaciones por palabra clave (colección keyword_stats): sketch de precios
+# con cubos logarítmicos (error relativo ~1% en la mediana). El sentimiento
+# por ítem se puntúa en segundo plano, en lotes y con una espera máxima por lote
+PRICE_SKETCH_GAMMA = float(os.environ.get("PRICE_SKETCH_GAMMA", "1.02"))
+_SKETCH_LOG_GAMMA = math.log(PRICE_SKETCH_GAMMA)
+KEYWORD_STATS_SENTIMENT_TIMEOUT = float(os.environ.get("KEYWORD_STATS_SENTIMENT_TIMEOUT", "30"))
+KEYWORD_STATS_SENTIMENT_BATCH = int(os.environ.get("KEYWORD_STATS_SENTIMENT_BATCH", "64"))
+
+_scoring_lock = threading.Lock()
+_scoring_slugs: set = set()
+_scoring_thread: Optional[threading.Thread] = None
 
 def to_dataframe(items: List[Dict]) -> pd.DataFrame:
     df = pd.DataFrame(items)
@@ -85,7 +142,194 @@ def _best_benefit(df: pd.DataFrame, top: int = 20) -> List[Dict[str, Any]]:
         })
     return out
 
-def _sentiment(items: List[Dict], max_reviews: int = 300) -> Dict[str, Any]:
+def _round_frac(x: float, precision: int = 3) -> float:
+    # Mismo redondeo que pd.cut usa para las etiquetas de los intervalos
+    if not math.isfinite(x) or x == 0:
+        return x
+    frac, whole = math.modf(x)
+    if whole == 0:
+        digits = -int(math.floor(math.log10(abs(frac)))) - 1 + precision
+    else:
+        digits = precision
+    return float(np.around(x, digits))
+
+def _cut_edges(mn: float, mx: float, bins: int):
+    """
+    Bordes de pd.cut(bins=n, include_lowest=True): los reales (para asignar
+    valores, intervalos cerrados a la derecha) y los redondeados de las etiquetas.
+    """
+    if mn == mx:
+        mn -= 0.001 * abs(mn) if mn != 0 else 0.001
+        mx += 0.001 * abs(mx) if mx != 0 else 0.001
+        edges = np.linspace(mn, mx, bins + 1, endpoint=True)
+    else:
+        edges = np.linspace(mn, mx, bins + 1, endpoint=True)
+        edges[0] -= (mx - mn) * 0.001
+    # pandas sube la precisión hasta que las etiquetas no se repitan
+    precision = 3
+    for p in range(3, 20):
+        if len(set(_round_frac(float(b), p) for b in edges)) == len(edges):
+            precision = p
+            break
+    labels = [_round_frac(float(b), precision) for b in edges]
+    labels[0] = labels[0] - 10 ** -precision
+    return edges, labels
+
+def _stats_kernel(batch: ProductBatch, bins: int = 30, top: int = 20) -> Dict[str, Any]:
+    """
+    Resumen, histograma de precios y mejores ítems por beneficio en una sola
+    pasada sobre las columnas del lote, sin construir el DataFrame. Devuelve lo
+    mismo que _summary, _histogram y _best_benefit (que quedan como referencia).
+    """
+    price = batch.price
+    rating = batch.rating
+    discount = batch.discount_price
+    has_price = ~np.isnan(price)
+    p = price[has_price]
+    r = rating[~np.isnan(rating)]
+
+    summary = {
+        "count": len(batch),
+        "price": {
+            "min": float(p.min()) if p.size else None,
+            "max": float(p.max()) if p.size else None,
+            "avg": float(p.sum() / p.size) if p.size else None,
+            "median": float(np.median(p)) if p.size else None,
+        },
+        "rating": {
+            "min": float(r.min()) if r.size else None,
+            "max": float(r.max()) if r.size else None,
+            "avg": float(r.sum() / r.size) if r.size else None,
+        },
+        "discount_count": int(np.count_nonzero(~np.isnan(discount))),
+    }
+
+    histogram: List[Dict[str, Any]] = []
+    finite = p[np.isfinite(p)]
+    if finite.size:
+        edges, labels = _cut_edges(float(finite.min()), float(finite.max()), bins)
+        ids = np.searchsorted(edges, finite, side="left")
+        ids[finite == edges[0]] = 1
+        ids = ids[(ids > 0) & (ids <= bins)]
+        counts = np.bincount(ids - 1, minlength=bins)
+        histogram = [{"min": float(labels[i]), "max": float(labels[i + 1]), "count": int(counts[i])} for i in range(bins)]
+
+    best: List[Dict[str, Any]] = []
+    if top > 0 and p.size:
+        idx = np.flatnonzero(has_price)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            benefit = np.nan_to_num(rating[idx], nan=0.0) / p
+        keep = ~np.isnan(benefit)
+        idx, benefit = idx[keep], benefit[keep]
+        k = min(top, benefit.size)
+        cand = np.arange(benefit.size)
+        if 0 < k < benefit.size:
+            # Umbral del k-ésimo mayor; los empates se resuelven por orden de llegada
+            threshold = benefit[np.argpartition(-benefit, k - 1)[:k]].min()
+            cand = np.flatnonzero(benefit >= threshold)
+        order = cand[np.lexsort((cand, -benefit[cand]))][:k]
+        for j in order:
+            i = idx[j]
+            rt = rating[i]
+            best.append({
+                "title": batch.title[i],
+                "price": float(price[i]),
+                "rating": float(rt) if not np.isnan(rt) else None,
+                "benefit": float(benefit[j]),
+                "url": batch.url[i],
+            })
+
+    return {"summary": summary, "histogram_price": histogram, "best_benefit": best}
+
+def _load_sentiment_model():
+    """
+    Carga el clasificador una sola vez por proceso: transformers multilingüe
+    (POS/NEG/NEU) y, si no está disponible, flair (POS/NEG).
+    """
+    global _sentiment_backend
+    if _sentiment_backend is not None:
+        return _sentiment_backend
+    with _sentiment_lock:
+        if _sentiment_backend is not None:
+            return _sentiment_backend
+        backend = ("none", None)
+        try:
+            from transformers import pipeline
+            backend = ("transformers", pipeline("sentiment-analysis", model=SENTIMENT_MODEL))
+        except Exception as e:
+            logging.info("Modelo transformers no disponible (%s), se intenta flair", e)
+            try:
+                from flair.models import TextClassifier
+                backend = ("flair", TextClassifier.load("sentiment-fast"))
+            except Exception as e2:
+                logging.warning("Sin modelo de sentimiento: %s", e2)
+        _sentiment_backend = backend
+    return _sentiment_backend
+
+
+def warmup_sentiment() -> bool:
+    """
+    Carga el modelo y ejecuta una inferencia corta para que la primera
+    petición no pague el arranque. Devuelve False si no hay modelo.
+    """
+    kind, _ = _load_sentiment_model()
+    if kind == "none":
+        return False
+    try:
+        _predict_sentiment(["excelente producto"])
+    except Exception as e:
+        logging.warning("Fallo el calentamiento del modelo de sentimiento: %s", e)
+        return False
+    return True
+
+
+def _predict_sentiment(texts: List[str]) -> List[tuple]:
+    """
+    Devuelve (label, score) por texto con label en positive/negative/neutral.
+    Los resultados se memorizan por hash del texto; los pendientes se infieren
+    en lotes de SENTIMENT_BATCH_SIZE agrupados por longitud.
+    """
+    kind, clf = _load_sentiment_model()
+    if kind == "none":
+        raise RuntimeError("modelo de sentimiento no disponible")
+    keys = [hashlib.sha1(t[:512].encode("utf-8")).hexdigest() for t in texts]
+    results: Dict[str, tuple] = {}
+    with _sentiment_memo_lock:
+        for k in keys:
+            hit = _sentiment_memo.get(k)
+            if hit is not None:
+                _sentiment_memo.move_to_end(k)
+                results[k] = hit
+    missing: Dict[str, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in results:
+            missing[k] = t[:512]
+    # Lotes de longitud similar: menos padding por lote
+    pending = sorted(missing.items(), key=lambda kv: len(kv[1]))
+    for i in range(0, len(pending), SENTIMENT_BATCH_SIZE):
+        chunk = pending[i:i + SENTIMENT_BATCH_SIZE]
+        batch = [t for _, t in chunk]
+        if kind == "transformers":
+            outs = clf(batch, batch_size=len(batch), truncation=True)
+            preds = [(str(o.get("label") or "").lower(), float(o.get("score") or 0.0)) for o in outs]
+        else:
+            from flair.data import Sentence
+            sentences = [Sentence(t) for t in batch]
+            clf.predict(sentences, mini_batch_size=len(sentences))
+            preds = [
+                (str(s.labels[0].value).lower(), float(s.labels[0].score)) if s.labels else ("", 0.0)
+                for s in sentences
+            ]
+        with _sentiment_memo_lock:
+            for (k, _), pred in zip(chunk, preds):
+                results[k] = pred
+                _sentiment_memo[k] = pred
+            while len(_sentiment_memo) > SENTIMENT_MEMO_SIZE:
+                _sentiment_memo.popitem(last=False)
+    return [results[k] for k in keys]
+
+
+def _review_texts(items: List[Dict], max_reviews: int = 300) -> List[str]:
     texts: List[str] = []
     for it in items:
         for rv in it.get("reviews") or []:
@@ -96,120 +340,225 @@ def _sentiment(items: List[Dict], max_reviews: int = 300) -> Dict[str, Any]:
                     break
         if len(texts) >= max_reviews:
             break
+    return texts
+
+
+def _sentiment(items: List[Dict], max_reviews: int = 300) -> Dict[str, Any]:
+    texts = _review_texts(items, max_reviews)
     if not texts:
         return {"count": 0, "positive": 0, "negative": 0, "neutral": 0, "avg_score": None}
-    # Intenta un modelo multilingüe (POS/NEG/NEU)
     try:
-        from transformers import pipeline
-        clf = pipeline("sentiment-analysis", model="cardiffnlp/twitter-xlm-roberta-base-sentiment")
-        pos = neg = neu = 0
-        score_acc = 0.0
-        for t in texts:
-            out = clf(t[:512])[0]
-            label = out.get("label")
-            score = float(out.get("score") or 0.0)
-            if label == "positive":
-                pos += 1; score_acc += score
-            elif label == "negative":
-                neg += 1; score_acc -= score
-            else:
-                neu += 1
-        avg = score_acc / len(texts) if texts else 0.0
-        return {"count": len(texts), "positive": pos, "negative": neg, "neutral": neu, "avg_score": avg}
+        preds = _predict_sentiment(texts)
     except Exception:
-        # Fallback a flair (POS/NEG)
-        try:
-            from flair.models import TextClassifier
-            from flair.data import Sentence
-            clf = TextClassifier.load("sentiment-fast")
-            pos = neg = 0
-            score_acc = 0.0
-            for t in texts:
-                s = Sentence(t)
-                clf.predict(s)
-                lab = s.labels[0].value if s.labels else None
-                sc = float(s.labels[0].score) if s.labels else 0.0
-                if lab == "POSITIVE":
-                    pos += 1; score_acc += sc
-                elif lab == "NEGATIVE":
-                    neg += 1; score_acc -= sc
-            avg = score_acc / len(texts) if texts else 0.0
-            return {"count": len(texts), "positive": pos, "negative": neg, "neutral": 0, "avg_score": avg}
-        except Exception:
-            return {"count": len(texts), "positive": None, "negative": None, "neutral": None, "avg_score": None}
-
-def run_analysis(items: List[Dict]) -> Dict[str, Any]:
-    df = to_dataframe(items)
-    return {
-        "summary": _summary(df),
-        "histogram_price": _histogram(df["price"], bins=30),
-        "sentiment": _sentiment(items),
-        "reviews_report": _reviews_report(items),
+        return {"count": len(texts), "positive": None, "negative": None, "neutral": None, "avg_score": None}
+    pos = neg = neu = 0
+    score_acc = 0.0
+    for label, score in preds:
+        if label == "positive":
+            pos += 1; score_acc += score
+        elif label == "negative":
+            neg += 1; score_acc -= score
+        else:
+            neu += 1
+    avg = score_acc / len(texts) if texts else 0.0
+    return {"count": len(texts), "positive": pos, "negative": neg, "neutral": neu, "avg_score": avg}
+
+def _sentiment_worker_init() -> None:
+    # Cada proceso del pool precarga su propio modelo
+    warmup_sentiment()
+
+
+def _sentiment_executor() -> ProcessPoolExecutor:
+    global _sentiment_pool
+    with _sentiment_pool_lock:
+        if _sentiment_pool is None:
+            _sentiment_pool = ProcessPoolExecutor(
+                max_workers=max(1, SENTIMENT_PROCESSES),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_sentiment_worker_init,
+            )
+        return _sentiment_pool
+
+
+def prepare_sentiment() -> None:
+    """
+    Hook de arranque: lanza los procesos del pool (su initializer carga el
+    modelo) o, sin pool, calienta el modelo en este proceso.
+    """
+    if SENTIMENT_PROCESSES > 0:
+        pool = _sentiment_executor()
+        for _ in range(SENTIMENT_PROCESSES):
+            pool.submit(int)
+    else:
+        warmup_sentiment()
+
+
+def shutdown_sentiment_pool() -> None:
+    global _sentiment_pool
+    with _sentiment_pool_lock:
+        pool = _sentiment_pool
+        _sentiment_pool = None
+        _sentiment_jobs.clear()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _sentiment_unavailable(items: List[Dict], pending_id: Optional[str] = None) -> Dict[str, Any]:
+    return {"count": len(_review_texts(items)), "positive": None, "negative": None, "neutral": None, "avg_score": None, "pending": pending_id}
+
+
+def _submit_sentiment(items: List[Dict]) -> Optional[str]:
+    """
+    Encola el sentimiento en el pool de procesos y devuelve su id, o None si
+    la cola está llena o el pool no está disponible.
+    """
+    now = time.time()
+    with _sentiment_pool_lock:
+        for key, (fut, created) in list(_sentiment_jobs.items()):
+            if now - created > SENTIMENT_RESULT_TTL:
+                _sentiment_jobs.pop(key, None)
+        in_flight = sum(1 for fut, _ in _sentiment_jobs.values() if not fut.done())
+        if in_flight >= SENTIMENT_QUEUE_MAX:
+            return None
+    try:
+        fut = _sentiment_executor().submit(_sentiment, items)
+    except (BrokenProcessPool, RuntimeError, OSError) as e:
+        logging.warning("Pool de sentimiento no disponible: %s", e)
+        shutdown_sentiment_pool()
+        return None
+    pending_id = uuid.uuid4().hex
+    with _sentiment_pool_lock:
+        _sentiment_jobs[pending_id] = (fut, now)
+    return pending_id
+
+
+def get_sentiment_result(pending_id: str, wait: Optional[float] = 0) -> Optional[Dict[str, Any]]:
+    """
+    Resultado de un sentimiento encolado: el dict final, {"status": "pending"}
+    si aún no termina tras esperar `wait` segundos (None = sin límite), o None
+    si el id no existe o expiró.
+    """
+    with _sentiment_pool_lock:
+        entry = _sentiment_jobs.get(pending_id)
+    if entry is None:
+        return None
+    fut, _ = entry
+    try:
+        return fut.result(timeout=wait)
+    except FutureTimeoutError:
+        return {"status": "pending", "pending": pending_id}
+    except Exception as e:
+        logging.warning("Falló el sentimiento %s: %s", pending_id, e)
+        if isinstance(e, BrokenProcessPool):
+            shutdown_sentiment_pool()
+        return {"count": None, "positive": None, "negative": None, "neutral": None, "avg_score": None, "error": str(e)}
+
+
+def run_analysis(items: List[Dict], sentiment_timeout: Optional[float] = None, offload: bool = False) -> Dict[str, Any]:
+    """
+    Estadísticas, histograma, sentimiento y reporte de reseñas. Con offload el
+    sentimiento corre en el pool de procesos; si no termina en sentiment_timeout
+    segundos se devuelve parcial (avg_score None) con un id "pending" para
+    consultarlo después con get_sentiment_result.
+    """
+    pending_id = _submit_sentiment(items) if offload and SENTIMENT_PROCESSES > 0 else None
+    batch = ProductBatch.from_items(items)
+    stats = _stats_kernel(batch, bins=30, top=0)
+    out = {
+        "summary": stats["summary"],
+        "histogram_price": stats["histogram_price"],
+        "sentiment": None,
+        "reviews_report": _reviews_report(items, batch),
     }
+    if not offload or SENTIMENT_PROCESSES <= 0:
+        out["sentiment"] = _sentiment(items)
+    elif pending_id is None:
+        # Cola llena o pool caído: no se bloquea la petición
+        out["sentiment"] = _sentiment_unavailable(items)
+    else:
+        res = get_sentiment_result(pending_id, wait=sentiment_timeout)
+        if res is None or res.get("status") == "pending":
+            res = _sentiment_unavailable(items, pending_id)
+        out["sentiment"] = res
+    return out
 
-def _reviews_report(items: List[Dict]) -> Dict[str, Any]:
-    products: List[Dict[str, Any]] = []
-    for it in items:
-        revs = it.get("reviews") or []
-        vals: List[int] = []
-        for rv in revs:
-            r = rv.get("rate")
-            if isinstance(r, (int, float)):
-                v = int(r)
-                if 0 < v <= 5:
-                    vals.append(v)
-        if not vals:
-            continue
-        avg = sum(vals) / len(vals)
-        pos = sum(1 for v in vals if v >= 4)
-        pct = (pos / len(vals)) if len(vals) else 0.0
-        products.append({
-            "title": it.get("title"),
-            "avg_rating": avg,
-            "reviews_count": len(vals),
-            "positive_pct": pct,
-            "url": it.get("url"),
-        })
-    ranking = sorted(products, key=lambda x: (-x["avg_rating"], -x["reviews_count"], str(x.get("title") or "")))[:max(10, len(products))]
-    top3 = [p for p in ranking if p["avg_rating"] >= 4.5 and p["reviews_count"] >= 10][:3]
+def _ranks(keys: List[Any]) -> np.ndarray:
+    # Posición de cada clave en el orden de Python (para usar en np.lexsort)
+    order = {k: r for r, k in enumerate(sorted(set(keys)))}
+    return np.fromiter((order[k] for k in keys), dtype=np.int64, count=len(keys))
+
+def _reviews_report(items: List[Dict], batch: Optional[ProductBatch] = None) -> Dict[str, Any]:
+    if batch is None:
+        batch = ProductBatch.from_items(items)
+    item, rate = batch.review_item, batch.review_rate
+    titles = batch.title
+    n_items = len(batch)
+
+    # Promedio y % positivo por producto con calificaciones 1..5
+    valid = (rate > 0) & (rate <= 5)
+    n = np.bincount(item[valid], minlength=n_items)
+    total = np.bincount(item[valid], weights=rate[valid], minlength=n_items)
+    pos = np.bincount(item[valid & (rate >= 4)], minlength=n_items)
+    idx = np.flatnonzero(n > 0)
+    cnt = n[idx]
+    avg = total[idx] / cnt
+    pct = pos[idx] / cnt
+    products: List[Dict[str, Any]] = [
+        {"title": titles[i], "avg_rating": float(a), "reviews_count": int(c), "positive_pct": float(p), "url": batch.url[i]}
+        for i, a, c, p in zip(idx.tolist(), avg, cnt, pct)
+    ]
+
+    # np.lexsort es estable: a igualdad de claves se conserva el orden original
+    title_rank = _ranks([str(titles[i] or "") for i in idx.tolist()])
+    ranked = np.lexsort((title_rank, -cnt, -avg))
+    ranking = [products[k] for k in ranked.tolist()]
+    top3 = [products[k] for k in ranked.tolist() if avg[k] >= 4.5 and cnt[k] >= 10][:3]
     star = None
-    if products:
-        best_all = sorted(products, key=lambda x: (-x["avg_rating"], -x["reviews_count"]))
-        for p in best_all:
-            if p["reviews_count"] >= 20:
-                star = p
-                break
-    best_reviews_by_product: List[Dict[str, Any]] = []
-    for it in items:
-        revs = it.get("reviews") or []
-        if not isinstance(revs, list):
-            continue
-        toks = [t.lower() for t in str(it.get("title") or "").split() if len(t) >= 3]
-        cand: List[Dict[str, Any]] = []
-        for rv in revs:
-            rate = rv.get("rate")
-            txt = rv.get("content") or rv.get("title") or ""
-            if not isinstance(txt, str):
-                continue
-            s = txt.strip()
-            if not s or len(s) < 100:
-                continue
-            if not isinstance(rate, (int, float)) or int(rate) != 5:
-                continue
-            low = s.lower()
-            hits = sum(1 for tk in toks if tk in low)
-            if hits < 1:
+    eligible = np.flatnonzero(cnt >= 20)
+    if eligible.size:
+        best = eligible[np.lexsort((-cnt[eligible], -avg[eligible]))]
+        star = products[int(best[0])]
+
+    # Mejores reseñas: 5 estrellas, >= 100 caracteres y que mencionen alguna palabra
+    # del título. Se ordenan antes (ítem, -largo, fecha) para buscar las palabras
+    # solo hasta tener 3 por producto
+    reviews = batch.reviews
+    rows: List[int] = []
+    texts: List[str] = []
+    for r in np.flatnonzero(rate == 5).tolist():
+        rv = reviews[r]
+        txt = rv.get("content") or rv.get("title") or ""
+        if isinstance(txt, str):
+            txt = txt.strip()
+            if len(txt) >= 100:
+                rows.append(r)
+                texts.append(txt)
+    picked: Dict[int, List[Dict[str, Any]]] = {}
+    if rows:
+        cand_item = item[rows]
+        dates = [reviews[r].get("date") for r in rows]
+        length = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        order = np.lexsort((_ranks([d or "" for d in dates]), -length, cand_item))
+        toks: List[str] = []
+        current = -1
+        for k in order.tolist():
+            i = int(cand_item[k])
+            if i != current:
+                current = i
+                toks = [t.lower() for t in str(titles[i] or "").split() if len(t) >= 3]
+                lst = picked.setdefault(i, [])
+            if len(lst) >= 3 or not toks:
                 continue
-            cand.append({
-                "rate": int(rate),
-                "date": rv.get("date"),
-                "content": s,
-            })
-        cand = sorted(cand, key=lambda r: (-len(str(r.get("content") or "")), r.get("date") or ""))[:3]
-        best_reviews_by_product.append({
-            "title": it.get("title"),
-            "reviews": cand,
-        })
+            low = texts[k].lower()
+            for tk in toks:
+                if tk in low:
+                    lst.append({"rate": 5, "date": dates[k], "content": texts[k]})
+                    break
+    best_reviews_by_product = [
+        {"title": titles[i], "reviews": picked.get(i, [])}
+        for i, it in enumerate(items)
+        if isinstance(it, Product) or isinstance(it.get("reviews") or [], list)
+    ]
     return {
         "products": products,
         "ranking": ranking[:10],
@@ -218,6 +567,47 @@ def _reviews_report(items: List[Dict]) -> Dict[str, Any]:
         "best_reviews_by_product": best_reviews_by_product,
     }
 
+def _item_report(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Aporte de un producto a reviews_report: promedio, cantidad y % positivo de
+    sus calificaciones y sus mejores reseñas. Se guarda en stats al escribirlo.
+    """
+    rep = _reviews_report([doc])
+    prod = rep["products"][0] if rep["products"] else {}
+    best = rep["best_reviews_by_product"]
+    return {
+        "avg_rating": prod.get("avg_rating"),
+        "reviews_count": prod.get("reviews_count", 0),
+        "positive_pct": prod.get("positive_pct"),
+        # None: el producto no entra en best_reviews_by_product (reseñas que no son lista)
+        "best_reviews": best[0]["reviews"] if best else None,
+    }
+
+def _report_from_stats(rows: List[tuple]) -> Dict[str, Any]:
+    """
+    Mismo resultado que _reviews_report a partir de (título, url, aporte) de
+    cada producto en el orden de los ítems, sin recorrer reseñas.
+    """
+    products: List[Dict[str, Any]] = [
+        {"title": title, "avg_rating": rep["avg_rating"], "reviews_count": rep["reviews_count"], "positive_pct": rep["positive_pct"], "url": url}
+        for title, url, rep in rows
+        if rep.get("reviews_count")
+    ]
+    # sorted es estable, como np.lexsort en _reviews_report
+    ranking = sorted(products, key=lambda p: (-p["avg_rating"], -p["reviews_count"], str(p["title"] or "")))
+    top3 = [p for p in ranking if p["avg_rating"] >= 4.5 and p["reviews_count"] >= 10][:3]
+    eligible = sorted((p for p in products if p["reviews_count"] >= 20), key=lambda p: (-p["avg_rating"], -p["reviews_count"]))
+    return {
+        "products": products,
+        "ranking": ranking[:10],
+        "top3": top3,
+        "star_product": eligible[0] if eligible else None,
+        "best_reviews_by_product": [
+            {"title": title, "reviews": rep["best_reviews"]}
+            for title, _, rep in rows
+            if rep.get("best_reviews") is not None
+        ],
+    }
 
 def run():
     parser = argparse.ArgumentParser(description="Scraper de Mercado Libre Colombia")
@@ -230,17 +620,40 @@ def run():
     parser.add_argument("--java-url", dest="java_url", default=os.environ.get("JAVA_API_URL", "http://localhost:8080"))
     parser.add_argument("--token", dest="token", default=os.environ.get("PYTHON_SERVICE_TOKEN"))
     parser.add_argument("--save-json", action="store_true", dest="save_json")
+    parser.add_argument("--keywords-file", dest="keywords_file", help="Archivo con una palabra clave o URL por línea (modo lote)")
+    parser.add_argument("--batch-workers", type=int, default=None, dest="batch_workers", help="Palabras scrapeadas en paralelo en modo lote")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint del lote (por defecto <keywords-file>.progress.jsonl)")
+    parser.add_argument("--incremental", action="store_true", help="Reutiliza el detalle guardado en MongoDB de productos sin cambios")
     # Flags de storage_state removidos para volver al estado base
     args = parser.parse_args()
 
     # Sin guardado de storage_state en estado base
 
+    known = mongo_known_products if args.incremental else None
+    if args.keywords_file:
+        from batch import BATCH_WORKERS, Checkpoint, java_sink, read_keywords, run_batch
+
+        logging.basicConfig(level=logging.INFO)
+        summary = run_batch(
+            read_keywords(args.keywords_file),
+            [_mongo_upsert_items, java_sink(args.java_url, args.token)],
+            max_pages=args.max_pages,
+            per_page_delay=args.per_page_delay,
+            detail_delay=args.detail_delay,
+            workers=args.batch_workers or BATCH_WORKERS,
+            checkpoint=Checkpoint(args.checkpoint or args.keywords_file + ".progress.jsonl"),
+            known=known,
+        )
+        print(f"Lote: {summary['done']} terminadas, {summary['failed']} fallidas, {summary['skipped']} ya hechas de {summary['total']}; {summary['items']} productos")
+        return
+
     if args.url:
         results = scrape_listing_from_url(
             url=args.url,
             max_pages=args.max_pages,
             per_page_delay=args.per_page_delay,
             detail_delay=args.detail_delay,
+            known=known,
         )
         source = args.url
         default_name = "listado"
@@ -250,6 +663,7 @@ def run():
             max_pages=args.max_pages,
             per_page_delay=args.per_page_delay,
             detail_delay=args.detail_delay,
+            known=known,
         )
         source = args.keyword
         default_name = (args.keyword or "listado").replace(" ", "_")
@@ -258,8 +672,8 @@ def run():
     ok = send_results_to_java(results, source, args.java_url, args.token)
     print(f"Enviado {len(results)} productos a: {args.java_url}/api/data ok={ok}")
     try:
-        _mongo_upsert_items(results, source)
-        print(f"MongoDB actualizado para '{source}'")
+        stats = _mongo_upsert_items(results, source)
+        print(f"MongoDB actualizado para '{source}': {stats['inserted']} nuevos, {stats['updated']} actualizados, {stats['unchanged']} sin cambios")
     except Exception as e:
         print(f"MongoDB error: {e}")
     if args.save_json:
@@ -271,14 +685,68 @@ def run():
         print(f"Guardado {len(results)} productos en: {out_file}")
     
 
-def _mongo_db():
+def _mongo_client() -> MongoClient:
+    """
+    MongoClient compartido por el proceso (un solo pool de conexiones y
+    monitor de servidor), creado de forma perezosa.
+    """
+    global _mongo_client_instance
+    if _mongo_client_instance is None:
+        with _mongo_lock:
+            if _mongo_client_instance is None:
+                _mongo_client_instance = MongoClient(
+                    os.environ.get("MONGO_URI", "mongodb://localhost:27017/scraping"),
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                )
+    return _mongo_client_instance
+
+def ensure_mongo_indexes(db=None) -> bool:
+    """
+    Crea los índices que usan las consultas: url (único), keyword, item_hash,
+    keyword_slug y el índice de texto para búsquedas aproximadas.
+    Devuelve True si quedaron creados.
+    """
+    global _mongo_indexes_ready, _mongo_indexes_retry_at
+    col = (db if db is not None else _mongo_db(ensure_indexes=False))["products"]
+    try:
+        try:
+            col.create_index("url", unique=True, name="url_unique")
+        except OperationFailure as e:
+            # Datos previos con URLs duplicadas: al menos indexar sin unicidad
+            logging.warning("No se pudo crear índice único en url: %s", e)
+            col.create_index("url", name="url_1")
+        col.create_index("keyword")
+        col.create_index("item_hash")
+        col.create_index([("keyword_slug", ASCENDING), ("_id", ASCENDING)])
+        col.create_index([("keyword", TEXT)], name="keyword_text", default_language="spanish")
+        _backfill_keyword_slug(col)
+    except PyMongoError as e:
+        logging.warning("No se pudieron crear índices de MongoDB: %s", e)
+        # Evita reintentar en cada petición mientras Mongo no responde
+        _mongo_indexes_retry_at = time.time() + 60.0
+        return False
+    _mongo_indexes_ready = True
+    return True
+
+def _backfill_keyword_slug(col) -> None:
+    """
+    Completa keyword_slug en documentos guardados antes de existir el campo.
+    """
+    for kw in col.distinct("keyword", {"keyword_slug": {"$exists": False}}):
+        if isinstance(kw, str):
+            col.update_many({"keyword": kw, "keyword_slug": {"$exists": False}}, {"$set": {"keyword_slug": _slugify(kw)}})
+
+def _mongo_db(ensure_indexes: bool = True):
     uri = os.environ.get("MONGO_URI", "mongodb://localhost:27017/scraping")
-    client = MongoClient(uri)
+    client = _mongo_client()
     try:
         dbname = uri.rsplit('/', 1)[-1]
         db = client[dbname]
     except Exception:
         db = client["scraping"]
+    if ensure_indexes and not _mongo_indexes_ready and time.time() >= _mongo_indexes_retry_at:
+        ensure_mongo_indexes(db)
     return db
 
 def _item_hash(d: Dict[str, Any]) -> str:
@@ -287,11 +755,401 @@ def _item_hash(d: Dict[str, Any]) -> str:
     s = json.dumps(payload, ensure_ascii=False, sort_keys=True)
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
-def _mongo_upsert_items(items: List[Dict], keyword: str):
+def _sketch_key(v: float) -> str:
+    if v <= 0:
+        return "z"
+    return str(math.ceil(math.log(v) / _SKETCH_LOG_GAMMA))
+
+def _sketch_value(key: str) -> float:
+    # Representante del cubo (gamma^(i-1), gamma^i]: error relativo <= (gamma-1)/(gamma+1)
+    if key == "z":
+        return 0.0
+    return 2.0 * PRICE_SKETCH_GAMMA ** int(key) / (PRICE_SKETCH_GAMMA + 1.0)
+
+def _sketch_sorted(sketch: Dict[str, Any]) -> List[tuple]:
+    return sorted((_sketch_value(k), int(c)) for k, c in (sketch or {}).items() if c and c > 0)
+
+def _sketch_median(sketch: Dict[str, Any]) -> Optional[float]:
+    buckets = _sketch_sorted(sketch)
+    n = sum(c for _, c in buckets)
+    if n == 0:
+        return None
+    # Igual que pandas: con n par, promedio de los dos centrales
+    ranks = [(n - 1) // 2, n // 2]
+    vals: List[float] = []
+    acc = 0
+    for v, c in buckets:
+        while ranks and ranks[0] < acc + c:
+            vals.append(v)
+            ranks.pop(0)
+        acc += c
+    return sum(vals) / len(vals)
+
+def _sketch_histogram(sketch: Dict[str, Any], mn: Optional[float], mx: Optional[float], bins: int = 30) -> List[Dict[str, Any]]:
+    buckets = _sketch_sorted(sketch)
+    if not buckets or mn is None or mx is None:
+        return []
+    edges, labels = _cut_edges(float(mn), float(mx), bins)
+    counts = [0] * bins
+    for v, c in buckets:
+        v = min(max(v, float(mn)), float(mx))
+        idx = int(np.searchsorted(edges, v, side="left")) - 1
+        counts[min(max(idx, 0), bins - 1)] += c
+    return [{"min": float(labels[i]), "max": float(labels[i + 1]), "count": counts[i]} for i in range(bins)]
+
+def _num(v: Any) -> Optional[float]:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if math.isfinite(f) else None
+
+def _item_review_texts(it: Dict) -> List[str]:
+    texts: List[str] = []
+    for rv in it.get("reviews") or []:
+        t = rv.get("content") or rv.get("title")
+        if isinstance(t, str) and t.strip():
+            texts.append(t.strip())
+    return texts
+
+def _item_sentiments(text_lists: List[List[str]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Conteos de sentimiento por ítem (una sola inferencia en lotes para todos).
+    """
+    flat = [t for texts in text_lists for t in texts]
+    preds = _predict_sentiment(flat) if flat else []
+    out: List[Optional[Dict[str, Any]]] = []
+    pos = 0
+    for texts in text_lists:
+        tally = {"count": len(texts), "positive": 0, "negative": 0, "neutral": 0, "score": 0.0}
+        for label, score in preds[pos:pos + len(texts)]:
+            if label == "positive":
+                tally["positive"] += 1; tally["score"] += score
+            elif label == "negative":
+                tally["negative"] += 1; tally["score"] -= score
+            else:
+                tally["neutral"] += 1
+        pos += len(texts)
+        out.append(tally)
+    return out
+
+def _score_items_sentiment(items: List[Dict]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Sentimiento por ítem para las agregaciones, en el pool de procesos si está
+    activo. Si no hay modelo o no termina a tiempo, None (ítems sin puntuar).
+    Solo se llama desde el hilo de puntuación, nunca al guardar.
+    """
+    text_lists = [_item_review_texts(it) for it in items]
+    if not any(text_lists):
+        return _item_sentiments(text_lists)
+    try:
+        if SENTIMENT_PROCESSES > 0:
+            return _sentiment_executor().submit(_item_sentiments, text_lists).result(timeout=KEYWORD_STATS_SENTIMENT_TIMEOUT)
+        return _item_sentiments(text_lists)
+    except Exception as e:
+        logging.warning("Sin sentimiento para keyword_stats: %s", e)
+        return [None] * len(items)
+
+def _initial_sentiment(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Sin reseñas no hay nada que inferir; con reseñas queda sin puntuar (None)
+    return None if _item_review_texts(doc) else _item_sentiments([[]])[0]
+
+def schedule_sentiment_scoring(slug: str) -> None:
+    """
+    Encola la puntuación en segundo plano de los productos del slug que
+    quedaron sin sentimiento. No bloquea; un solo hilo procesa la cola.
+    """
+    global _scoring_thread
+    with _scoring_lock:
+        _scoring_slugs.add(slug)
+        if _scoring_thread is None:
+            _scoring_thread = threading.Thread(target=_scoring_loop, name="sentiment-stats", daemon=True)
+            _scoring_thread.start()
+
+def _scoring_loop() -> None:
+    global _scoring_thread
+    while True:
+        with _scoring_lock:
+            if not _scoring_slugs:
+                _scoring_thread = None
+                return
+            slug = _scoring_slugs.pop()
+        try:
+            score_pending_sentiment(slug)
+        except Exception as e:
+            logging.warning("No se pudo puntuar el sentimiento de %s: %s", slug, e)
+
+def score_pending_sentiment(slug: str, db=None) -> int:
+    """
+    Completa el sentimiento de los productos del slug guardados sin él y
+    mueve sus conteos en keyword_stats de "unscored" a los totales. Cada
+    producto se actualiza solo si no cambió desde que se leyó (stats_rev).
+    Devuelve cuántos productos se puntuaron.
+    """
+    db = db if db is not None else _mongo_db()
+    col = db["products"]
+    done = 0
+    while True:
+        rows = list(
+            col.find(
+                {"keyword_slug": slug, "stats": {"$exists": True}, "stats.sentiment": None},
+                {"_id": 1, "item_hash": 1, "stats_rev": 1, "reviews": 1},
+            ).limit(KEYWORD_STATS_SENTIMENT_BATCH)
+        )
+        if not rows:
+            return done
+        inc: Dict[str, float] = {}
+        confirmed = 0
+        for d, sent in zip(rows, _score_items_sentiment(rows)):
+            if sent is None:
+                continue
+            res = col.update_one(
+                {"_id": d["_id"], "item_hash": d.get("item_hash"), "stats_rev": d.get("stats_rev")},
+                {"$set": {"stats.sentiment": sent, "stats_rev": uuid.uuid4().hex}},
+            )
+            if not res.modified_count:
+                continue
+            confirmed += 1
+            inc["sentiment.unscored"] = inc.get("sentiment.unscored", 0) - 1
+            for k in ("count", "positive", "negative", "neutral", "score"):
+                inc[f"sentiment.{k}"] = inc.get(f"sentiment.{k}", 0) + (sent.get(k) or 0)
+        if not confirmed:
+            # Sin modelo o todo cambió en el medio: se reintenta en la próxima programación
+            return done
+        db["keyword_stats"].update_one({"_id": slug}, {"$inc": inc, "$set": {"updated_at": time.time()}})
+        done += confirmed
+
+def _reviews_digest(doc: Dict[str, Any]) -> str:
+    # Huella de las reseñas (texto y calificación) para saber si un detalle renovado cambió su aporte
+    payload = [(rv.get("rate"), rv.get("content") or rv.get("title")) for rv in doc.get("reviews") or []]
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def _item_stats(doc: Dict[str, Any], sentiment: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aporte de un producto a las agregaciones de su palabra clave.
+    """
+    rates: Dict[str, int] = {}
+    for rv in doc.get("reviews") or []:
+        r = rv.get("rate")
+        if isinstance(r, (int, float)):
+            v = int(r)
+            if 0 < v <= 5:
+                rates[str(v)] = rates.get(str(v), 0) + 1
+    return {
+        "price": _num(doc.get("price")),
+        "rating": _num(doc.get("rating")),
+        "discount": _num(doc.get("discount_price")) is not None,
+        "rates": rates,
+        "sentiment": sentiment,
+        "reviews_digest": _reviews_digest(doc),
+        "report": _item_report(doc),
+    }
+
+class _StatsDelta:
+    """
+    Cambios acumulados de keyword_stats para una palabra clave en un lote.
+    """
+
+    def __init__(self):
+        self.inc: Dict[str, float] = {}
+        self.mins: Dict[str, float] = {}
+        self.maxs: Dict[str, float] = {}
+        self.removed: Dict[str, List[float]] = {"price": [], "rating": []}
+
+    def _add(self, field: str, v: float) -> None:
+        self.inc[field] = self.inc.get(field, 0) + v
+
+    def apply(self, st: Dict[str, Any], sign: int) -> None:
+        self._add("count", sign)
+        if st.get("discount"):
+            self._add("discount_count", sign)
+        for name in ("price", "rating"):
+            v = st.get(name)
+            if v is None:
+                continue
+            self._add(f"{name}.n", sign)
+            self._add(f"{name}.sum", sign * v)
+            if name == "price":
+                self._add(f"price.sketch.{_sketch_key(v)}", sign)
+            if sign > 0:
+                self.mins[f"{name}.min"] = min(self.mins.get(f"{name}.min", v), v)
+                self.maxs[f"{name}.max"] = max(self.maxs.get(f"{name}.max", v), v)
+            else:
+                self.removed[name].append(v)
+        for r, c in (st.get("rates") or {}).items():
+            self._add(f"rates.{r}", sign * c)
+            self._add("reviews_count", sign * c)
+        sent = st.get("sentiment")
+        if sent is None:
+            self._add("sentiment.unscored", sign)
+        else:
+            for k in ("count", "positive", "negative", "neutral", "score"):
+                self._add(f"sentiment.{k}", sign * (sent.get(k) or 0))
+
+    def update(self) -> Dict[str, Any]:
+        upd: Dict[str, Any] = {"$set": {"updated_at": time.time()}}
+        inc = {k: v for k, v in self.inc.items() if v}
+        if inc:
+            upd["$inc"] = inc
+        if self.mins:
+            upd["$min"] = self.mins
+        if self.maxs:
+            upd["$max"] = self.maxs
+        return upd
+
+def _recompute_extremes(db, slug: str, names: List[str]) -> None:
+    """
+    Recalcula min/max cuando se retiró un valor que podía ser el extremo
+    (no se pueden descontar con $inc). Recorre solo los productos del slug.
+    """
+    group: Dict[str, Any] = {"_id": None}
+    for name in names:
+        group[f"{name}_min"] = {"$min": f"$stats.{name}"}
+        group[f"{name}_max"] = {"$max": f"$stats.{name}"}
+    rows = list(db["products"].aggregate([{"$match": {"keyword_slug": slug, "stats": {"$exists": True}}}, {"$group": group}]))
+    row = rows[0] if rows else {}
+    db["keyword_stats"].update_one(
+        {"_id": slug},
+        {"$set": {f"{name}.{edge}": row.get(f"{name}_{edge}") for name in names for edge in ("min", "max")}},
+    )
+
+def _apply_stats_deltas(db, deltas: Dict[str, "_StatsDelta"]) -> None:
+    col = db["keyword_stats"]
+    for slug, delta in deltas.items():
+        if col.find_one({"_id": slug}, {"_id": 1}) is None:
+            # Primera vez para este slug: incluye productos guardados antes de las agregaciones
+            _rebuild_stats(db, slug)
+            continue
+        doc = col.find_one_and_update({"_id": slug}, delta.update(), upsert=True, return_document=ReturnDocument.AFTER)
+        stale = [
+            name for name, vals in delta.removed.items()
+            if vals and ((doc.get(name) or {}).get("min") is None or min(vals) <= doc[name]["min"] or max(vals) >= doc[name]["max"])
+        ]
+        if stale:
+            _recompute_extremes(db, slug, stale)
+
+def rebuild_keyword_stats(keyword: str, db=None) -> Optional[Dict[str, Any]]:
+    """
+    Reconstruye keyword_stats de una palabra clave desde sus productos
+    (documentos anteriores a las agregaciones quedan sin sentimiento).
+    """
+    return _rebuild_stats(db if db is not None else _mongo_db(), _slugify(keyword))
+
+def _rebuild_stats(db, slug: str) -> Optional[Dict[str, Any]]:
+    col = db["products"]
+    delta = _StatsDelta()
+    # Los campos de las reseñas que usan _reviews_digest y _item_report, para que coincidan con los del guardado
+    projection = {"_id": 1, "stats": 1, "title": 1, "price": 1, "rating": 1, "discount_price": 1, "reviews.rate": 1, "reviews.title": 1, "reviews.content": 1, "reviews.date": 1}
+    for d in col.find({"keyword_slug": slug}, projection):
+        st = d.get("stats")
+        if st is None:
+            st = _item_stats(d, None)
+            col.update_one({"_id": d["_id"]}, {"$set": {"stats": st}})
+        delta.apply(st, 1)
+    if not delta.inc.get("count"):
+        db["keyword_stats"].delete_one({"_id": slug})
+        return None
+    doc: Dict[str, Any] = {"_id": slug, "updated_at": time.time()}
+    for path, v in list(delta.inc.items()) + list(delta.mins.items()) + list(delta.maxs.items()):
+        node = doc
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+        node[parts[-1]] = v
+    db["keyword_stats"].replace_one({"_id": slug}, doc, upsert=True)
+    return doc
+
+def _stored_reviews_report(db, slug: str) -> Dict[str, Any]:
+    """
+    reviews_report de una palabra clave desde el aporte guardado de cada
+    producto (stats.report): lee título, URL y aporte, no las reseñas. Los
+    productos guardados antes de que existiera el aporte lo calculan una vez.
+    """
+    col = db["products"]
+    rows: List[tuple] = []
+    for d in col.find({"keyword_slug": slug}, {"_id": 1, "title": 1, "url": 1, "stats.report": 1}).sort("_id", 1):
+        rep = (d.get("stats") or {}).get("report")
+        if rep is None:
+            full = col.find_one({"_id": d["_id"]}, {"_id": 1, "title": 1, "item_hash": 1, "reviews": 1})
+            if full is None:
+                continue
+            rep = _item_report(full)
+            col.update_one({"_id": d["_id"], "item_hash": full.get("item_hash"), "stats": {"$exists": True}}, {"$set": {"stats.report": rep}})
+        rows.append((d.get("title"), d.get("url"), rep))
+    return _report_from_stats(rows)
+
+def keyword_analysis(keyword: str, reviews_report: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Análisis de una palabra clave servido desde keyword_stats (sin recorrer
+    productos ni reseñas). La mediana y el histograma salen del sketch de
+    precios y reviews_distribution trae la distribución de calificaciones.
+    Con reviews_report se agrega el reporte de reseñas con la misma forma que
+    en run_analysis, armado con el aporte guardado de cada producto. None si
+    no hay datos guardados.
+    """
+    db = _mongo_db()
+    slug = _slugify(keyword)
+    st = db["keyword_stats"].find_one({"_id": slug})
+    if st is None:
+        st = _rebuild_stats(db, slug)
+    if not st or not st.get("count"):
+        return None
+    price = st.get("price") or {}
+    rating = st.get("rating") or {}
+    sent = st.get("sentiment") or {}
+    rates = {str(r): int((st.get("rates") or {}).get(str(r), 0)) for r in range(1, 6)}
+    reviews_count = sum(rates.values())
+    scored = int(sent.get("count") or 0)
+    if sent.get("unscored"):
+        # Productos aún sin puntuar (p. ej. el proceso se reinició antes): se completan después
+        schedule_sentiment_scoring(slug)
+    return {
+        "summary": {
+            "count": int(st["count"]),
+            "price": {
+                "min": price.get("min") if price.get("n") else None,
+                "max": price.get("max") if price.get("n") else None,
+                "avg": price["sum"] / price["n"] if price.get("n") else None,
+                "median": _sketch_median(price.get("sketch") or {}),
+            },
+            "rating": {
+                "min": rating.get("min") if rating.get("n") else None,
+                "max": rating.get("max") if rating.get("n") else None,
+                "avg": rating["sum"] / rating["n"] if rating.get("n") else None,
+            },
+            "discount_count": int(st.get("discount_count") or 0),
+        },
+        "histogram_price": _sketch_histogram(price.get("sketch") or {}, price.get("min"), price.get("max"), bins=30),
+        "sentiment": {
+            "count": scored,
+            "positive": int(sent.get("positive") or 0) if scored else None,
+            "negative": int(sent.get("negative") or 0) if scored else None,
+            "neutral": int(sent.get("neutral") or 0) if scored else None,
+            "avg_score": (sent.get("score") or 0.0) / scored if scored else None,
+            "unscored_items": int(sent.get("unscored") or 0),
+        },
+        "reviews_distribution": {
+            "reviews_count": reviews_count,
+            "rates": rates,
+            "avg_rating": sum(int(r) * c for r, c in rates.items()) / reviews_count if reviews_count else None,
+            "positive_pct": (rates["4"] + rates["5"]) / reviews_count if reviews_count else None,
+        },
+        "reviews_report": _stored_reviews_report(db, slug) if reviews_report else None,
+        "source": "keyword_stats",
+    }
+
+def _mongo_upsert_items(items: List[Dict], keyword: str, chunk_size: int = MONGO_UPSERT_CHUNK) -> Dict[str, int]:
+    """
+    Inserta/actualiza productos por URL. El diff contra Mongo se hace con una
+    consulta $in por lote y un bulk_write condicional por lote; los productos
+    que cambian en el medio se reintentan. Devuelve los conteos
+    inserted/updated/unchanged.
+    """
     db = _mongo_db()
     col = db["products"]
-    ops: List[UpdateOne] = []
-    for it in items:
+    keyword_slug = _slugify(keyword)
+    docs: Dict[str, Dict[str, Any]] = {}
+    for it in as_dicts(items):
         url = it.get("url")
         if not isinstance(url, str):
             continue
@@ -307,25 +1165,147 @@ def _mongo_upsert_items(items: List[Dict], keyword: str):
             "description": it.get("description"),
             "keyword": keyword,
             "reviews": it.get("reviews") or [],
+            "detail_at": it.get("detail_at"),
         }
-        h = _item_hash(doc)
-        existing = col.find_one({"url": url}, {"item_hash": 1})
-        if existing and existing.get("item_hash") == h:
+        docs[url] = {**doc, "keyword_slug": keyword_slug, "item_hash": _item_hash(doc)}
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0}
+    urls = list(docs)
+    for i in range(0, len(urls), max(1, chunk_size)):
+        pending = urls[i:i + chunk_size]
+        for attempt in range(MONGO_UPSERT_RETRIES + 1):
+            pending = _upsert_chunk(db, docs, pending, keyword_slug, stats, force=attempt == MONGO_UPSERT_RETRIES)
+            if not pending:
+                break
+    if stats["inserted"] or stats["updated"]:
+        # El sentimiento de los productos nuevos o cambiados no bloquea la escritura
+        schedule_sentiment_scoring(keyword_slug)
+    return stats
+
+def _upsert_chunk(db, docs: Dict[str, Dict[str, Any]], batch: List[str], keyword_slug: str, counts: Dict[str, int], force: bool = False) -> List[str]:
+    """
+    Diff y escritura de un lote. Cada producto se reemplaza solo si sigue
+    como se leyó (mismo item_hash y stats_rev), y el aporte a keyword_stats
+    se mueve solo para las escrituras confirmadas. Devuelve las URLs que
+    otro proceso cambió en el medio, para reintentarlas. Con force se
+    escribe sin condición y se reconstruyen las agregaciones afectadas.
+    """
+    col = db["products"]
+    existing = {
+        d["url"]: d
+        for d in col.find({"url": {"$in": batch}}, {"_id": 0, "url": 1, "item_hash": 1, "keyword_slug": 1, "stats": 1, "stats_rev": 1, "detail_at": 1})
+    }
+    changed: List[Dict[str, Any]] = []
+    refreshed: List[UpdateOne] = []
+    for url in batch:
+        doc = docs[url]
+        old = existing.get(url)
+        if old is not None and old.get("item_hash") == doc["item_hash"]:
+            newer = (doc["detail_at"] or 0) > (old.get("detail_at") or 0)
+            if newer and _reviews_digest(doc) != (old.get("stats") or {}).get("reviews_digest"):
+                # Detalle renovado con otras reseñas: cambia su aporte a las agregaciones
+                changed.append(doc)
+                continue
+            counts["unchanged"] += 1
+            if newer:
+                # Detalle descargado de nuevo sin cambios: solo se renueva su fecha
+                refreshed.append(UpdateOne({"url": url}, {"$set": {"detail_at": doc["detail_at"]}}))
+            continue
+        changed.append(doc)
+    if refreshed:
+        col.bulk_write(refreshed, ordered=False)
+    if not changed:
+        return []
+    ops: List[UpdateOne] = []
+    for doc in changed:
+        doc["stats"] = _item_stats(doc, _initial_sentiment(doc))
+        doc["stats_rev"] = uuid.uuid4().hex
+        old = existing.get(doc["url"])
+        if force:
+            ops.append(UpdateOne({"url": doc["url"]}, {"$set": doc}, upsert=True))
+        elif old is None:
+            # Si otro proceso lo insertó en el medio no se pisa: queda como conflicto
+            ops.append(UpdateOne({"url": doc["url"]}, {"$setOnInsert": doc}, upsert=True))
+        else:
+            ops.append(UpdateOne({"url": doc["url"], "item_hash": old.get("item_hash"), "stats_rev": old.get("stats_rev")}, {"$set": doc}))
+    try:
+        res = col.bulk_write(ops, ordered=False)
+        confirmed = res.modified_count + res.upserted_count == len(ops)
+    except BulkWriteError as e:
+        # Inserción concurrente de la misma URL (índice único)
+        logging.debug("Conflicto al guardar productos: %s", e.details.get("writeErrors"))
+        confirmed = False
+    if force:
+        slugs = {keyword_slug} | {old["keyword_slug"] for old in existing.values() if old.get("keyword_slug")}
+        for slug in slugs:
+            _rebuild_stats(db, slug)
+        applied = changed
+    elif confirmed:
+        applied = changed
+    else:
+        revs = {doc["stats_rev"] for doc in changed}
+        ours = {d["url"] for d in col.find({"url": {"$in": [doc["url"] for doc in changed]}, "stats_rev": {"$in": list(revs)}}, {"_id": 0, "url": 1})}
+        applied = [doc for doc in changed if doc["url"] in ours]
+    # Agregaciones por palabra clave: se retira el aporte anterior y se suma el nuevo
+    deltas: Dict[str, _StatsDelta] = {}
+    for doc in applied:
+        old = existing.get(doc["url"])
+        counts["updated" if old is not None else "inserted"] += 1
+        if force:
             continue
-        ops.append(UpdateOne({"url": url}, {"$set": {**doc, "item_hash": h}}, upsert=True))
-    if ops:
-        col.bulk_write(ops, ordered=False)
+        if old is not None and old.get("stats") is not None and old.get("keyword_slug"):
+            deltas.setdefault(old["keyword_slug"], _StatsDelta()).apply(old["stats"], -1)
+        deltas.setdefault(keyword_slug, _StatsDelta()).apply(doc["stats"], 1)
+    _apply_stats_deltas(db, deltas)
+    applied_urls = {doc["url"] for doc in applied}
+    return [doc["url"] for doc in changed if doc["url"] not in applied_urls]
+
+def mongo_known_products(urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Documentos guardados para esas URLs, con los campos que el recrawl
+    incremental compara (listado) y reutiliza (detalle).
+    """
+    col = _mongo_db()["products"]
+    projection = {"_id": 0, "url": 1, "title": 1, "price": 1, "discount_price": 1, "rating": 1, "rating_count": 1, "description": 1, "sold": 1, "reviews": 1, "detail_at": 1}
+    found: Dict[str, Dict[str, Any]] = {}
+    unique = list(dict.fromkeys(u for u in urls if isinstance(u, str)))
+    for i in range(0, len(unique), MONGO_UPSERT_CHUNK):
+        for d in col.find({"url": {"$in": unique[i:i + MONGO_UPSERT_CHUNK]}}, projection):
+            found[d["url"]] = d
+    return found
+
 
-def mongo_get_items(keyword: str) -> List[Dict]:
+# Campos de uso interno que no se devuelven a los clientes
+_INTERNAL_FIELDS = ("_id", "item_hash", "stats", "stats_rev", "keyword_slug", "detail_at")
+
+
+def mongo_get_items(keyword: str, mode: str = "exact", fields: Optional[List[str]] = None, skip: int = 0, limit: int = 0) -> List[Dict]:
+    """
+    Productos guardados para una palabra clave usando el campo normalizado
+    keyword_slug (indexado).
+    - exact: mismo slug
+    - prefix: slug que empieza por el de la búsqueda (regex anclada, usa el índice)
+    - fuzzy: búsqueda por palabras sobre el índice de texto de keyword
+    fields limita los campos devueltos; skip/limit paginan (limit=0 sin límite).
+    """
     db = _mongo_db()
     col = db["products"]
-    cur = col.find({"keyword": {"$regex": keyword, "$options": "i"}})
-    out: List[Dict] = []
-    for d in cur:
-        d.pop("_id", None)
-        d.pop("item_hash", None)
-        out.append(d)
-    return out
+    slug = _slugify(keyword)
+    if mode == "prefix":
+        query: Dict[str, Any] = {"keyword_slug": {"$regex": "^" + re.escape(slug)}}
+    elif mode == "fuzzy":
+        query = {"$text": {"$search": keyword}}
+    else:
+        query = {"keyword_slug": slug}
+    # Solo campos públicos (tampoco subcampos de los internos, p. ej. stats.count);
+    # si no queda ninguno se usa la exclusión por defecto en lugar de {"_id": 0}
+    public = [f for f in fields or [] if f.split(".", 1)[0] not in _INTERNAL_FIELDS]
+    if public:
+        projection: Dict[str, int] = {f: 1 for f in public}
+        projection["_id"] = 0
+    else:
+        projection = {f: 0 for f in _INTERNAL_FIELDS}
+    cur = col.find(query, projection).sort("_id", 1).skip(max(0, skip)).limit(max(0, limit))
+    return list(cur)
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Pool persistente de navegadores headless para los fallbacks con Playwright.
+
+La API síncrona de Playwright está ligada al hilo que la crea, por eso cada
+worker del pool es un hilo dedicado con su propio Chromium. Las tareas reciben
+una página nueva; el contexto se recicla tras N usos y el navegador se
+relanza si se cae.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, List, Optional
+
+
+# Máximo de navegadores (tareas simultáneas) y usos por contexto antes de recrearlo
+BROWSER_POOL_SIZE = int(os.environ.get("SCRAPER_BROWSERS", "2"))
+BROWSER_CONTEXT_USES = int(os.environ.get("SCRAPER_BROWSER_CONTEXT_USES", "20"))
+
+
+def playwright_available() -> bool:
+    try:
+        import playwright.sync_api  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+class BrowserPool:
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_context_uses: int = BROWSER_CONTEXT_USES, user_agents: Optional[List[str]] = None):
+        self.size = max(1, size)
+        self.max_context_uses = max(1, max_context_uses)
+        self.user_agents = user_agents or []
+        self._tasks: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BrowserPool cerrado")
+            while len(self._threads) < self.size:
+                t = threading.Thread(target=self._worker, name=f"browser-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def run(self, fn: Callable[[Any], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Ejecuta fn(page) en un navegador del pool y devuelve su resultado.
+        Lanza la excepción de fn, o TimeoutError si no termina a tiempo.
+        """
+        if not playwright_available():
+            raise ImportError("playwright no está instalado")
+        self._ensure_started()
+        fut: Future = Future()
+        self._tasks.put((fn, fut))
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Si aún estaba en cola, el worker la descarta
+            fut.cancel()
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._tasks.put(None)
+        for t in threads:
+            t.join(timeout=10)
+
+    def _new_context(self, browser):
+        kwargs = {"locale": "es-ES"}
+        if self.user_agents:
+            kwargs["user_agent"] = random.choice(self.user_agents)
+        return browser.new_context(**kwargs)
+
+    def _worker(self) -> None:
+        from playwright.sync_api import sync_playwright
+
+        pw = None
+        browser = None
+        context = None
+        uses = 0
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            fn, fut = task
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                if pw is None:
+                    pw = sync_playwright().start()
+                if browser is None or not browser.is_connected():
+                    browser = pw.chromium.launch(headless=True)
+                    context = None
+                if context is None or uses >= self.max_context_uses:
+                    if context is not None:
+                        try:
+                            context.close()
+                        except Exception:
+                            pass
+                    context = self._new_context(browser)
+                    uses = 0
+                uses += 1
+                page = context.new_page()
+                try:
+                    result = fn(page)
+                finally:
+                    try:
+                        page.close()
+                    except Exception:
+                        pass
+                fut.set_result(result)
+            except BaseException as e:
+                fut.set_exception(e)
+                # Navegador caído: se relanza en la siguiente tarea
+                if browser is not None and not browser.is_connected():
+                    logging.warning("Chromium desconectado, se relanzará: %s", e)
+                    browser = None
+                    context = None
+        for closer in (context, browser):
+            try:
+                if closer is not None:
+                    closer.close()
+            except Exception:
+                pass
+        try:
+            if pw is not None:
+                pw.stop()
+        except Exception:
+            pass
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool(user_agents: Optional[List[str]] = None) -> BrowserPool:
+    """
+    Devuelve el pool de navegadores del proceso, creándolo de forma perezosa.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool(user_agents=user_agents)
+                atexit.register(_pool.close)
+    return _pool
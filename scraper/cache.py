@@ -0,0 +1,213 @@
+"""
+Caché de respuestas HTTP en disco para el scraper.
+
+Cada respuesta se guarda bajo el sha256 de la URL normalizada: el cuerpo
+comprimido con zlib y un JSON con la URL final (tras redirecciones), ETag,
+Last-Modified y la hora de almacenamiento. Listados y detalles tienen TTL
+distintos; una entrada vencida con validadores se revalida con una petición
+condicional (304). Al superar el tamaño máximo se eliminan las entradas
+usadas hace más tiempo (LRU por mtime).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+CACHE_ENABLED = os.environ.get("SCRAPER_CACHE", "1") not in ("0", "false", "no")
+CACHE_DIR = os.environ.get("SCRAPER_CACHE_DIR", os.path.join(".cache", "http"))
+LISTING_TTL = float(os.environ.get("SCRAPER_CACHE_LISTING_TTL", "600"))
+DETAIL_TTL = float(os.environ.get("SCRAPER_CACHE_DETAIL_TTL", "21600"))
+CACHE_MAX_BYTES = int(float(os.environ.get("SCRAPER_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normaliza la URL para usarla como clave: esquema/host en minúsculas,
+    sin puerto por defecto, parámetros ordenados y sin fragmento.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+@dataclass
+class CacheEntry:
+    body: str
+    final_url: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+    def validators(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".z", base + ".json"
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = zlib.decompress(f.read()).decode("utf-8")
+            # Marca de uso para el LRU
+            os.utime(body_path, None)
+        except (OSError, ValueError, zlib.error):
+            return None
+        return CacheEntry(
+            body=body,
+            final_url=meta.get("final_url"),
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            stored_at=float(meta.get("stored_at") or 0.0),
+        )
+
+    def put(self, url: str, body: str, final_url: Optional[str] = None, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        body_path, meta_path = self._paths(url)
+        data = zlib.compress(body.encode("utf-8"), 6)
+        meta = {
+            "url": normalize_url(url),
+            "final_url": final_url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.time(),
+        }
+        try:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            old = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+            self._write_atomic(body_path, data)
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - old
+        self._evict_if_needed()
+
+    def touch(self, url: str) -> None:
+        """
+        Renueva la hora de almacenamiento tras una revalidación 304.
+        """
+        _, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            meta["stored_at"] = time.time()
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except (OSError, ValueError):
+            pass
+
+    def delete(self, url: str) -> None:
+        """
+        Elimina la entrada, p. ej. una página de bloqueo que no debe servirse.
+        """
+        body_path, meta_path = self._paths(url)
+        try:
+            size = os.path.getsize(body_path)
+        except OSError:
+            size = 0
+        for path in (body_path, meta_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".z"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_if_needed(self) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            if self._size <= self.max_bytes:
+                return
+            # Elimina las menos usadas hasta quedar en el 90% del límite
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in sorted(self._scan()):
+                if self._size <= target:
+                    break
+                for p in (path, path[:-2] + ".json"):
+                    try:
+                        os.unlink(p)
+                    except OSError:
+                        pass
+                self._size -= size
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """
+    Caché compartida del proceso, o None si está desactivada (SCRAPER_CACHE=0).
+    """
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def ttl_for(is_detail: bool) -> float:
+    return DETAIL_TTL if is_detail else LISTING_TTL
@@ -0,0 +1,278 @@
+"""
+Backend rápido de parseo sobre lxml con selectores XPath precompilados.
+
+Replica el comportamiento del camino BeautifulSoup de mercadolibre.py (que se
+mantiene como referencia) sin recorrer cada subárbol con soupsieve. El
+backend se elige con SCRAPER_PARSER=lxml|bs4. La paridad entre ambos se
+comprueba en tests/test_fastparse.py sobre las páginas de tests/fixtures.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+import lxml.html
+from lxml import etree
+
+
+def _cls(tag: str, cls: str) -> str:
+    return f"{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+
+
+def _xp(path: str) -> etree.XPath:
+    return etree.XPath(path, smart_strings=False)
+
+
+def _first(el, selectors: Tuple[etree.XPath, ...]):
+    for sel in selectors:
+        found = sel(el)
+        if found:
+            return found[0]
+    return None
+
+
+# Igual que BeautifulSoup: el texto de script/style/template/rt/rp no cuenta en get_text
+_TEXT = _xp("descendant::text()[not(ancestor::script or ancestor::style or ancestor::template or ancestor::rt or ancestor::rp)]")
+
+
+def _text(el, sep: str = "") -> str:
+    return sep.join(s for s in (t.strip() for t in _TEXT(el)) if s)
+
+
+# Listado
+_LI_ITEMS = _xp("descendant::" + _cls("li", "ui-search-layout__item"))
+_DIV_ITEMS = _xp(
+    "descendant::div[contains(concat(' ', normalize-space(@class), ' '), ' ui-search-result ')"
+    " or contains(concat(' ', normalize-space(@class), ' '), ' ui-search-result__wrapper ')]"
+)
+_LINK = tuple(_xp("descendant::" + _cls("a", c)) for c in (
+    "poly-component__title",
+    "ui-search-link",
+    "ui-search-item__group__link",
+    "ui-search-result__content-wrapper-link",
+))
+_TITLE = (
+    _xp("descendant::" + _cls("a", "poly-component__title")),
+    _xp("descendant::" + _cls("h2", "ui-search-item__title")),
+    _xp("descendant::" + _cls("h3", "poly-component__title-wrapper")),
+)
+_IMAGE = (
+    _xp("descendant::" + _cls("img", "poly-component__picture")),
+    _xp("descendant::" + _cls("img", "ui-search-result-image__element")),
+    _xp("descendant::img"),
+)
+_PRICE_FRACTION = _xp("descendant::" + _cls("span", "andes-money-amount__fraction"))
+_PRICE_CENTS = _xp("descendant::" + _cls("span", "andes-money-amount__cents"))
+_PRICE_STRIKE = _xp("descendant::" + _cls("s", "ui-search-price__part"))
+_RATING = (
+    _xp("descendant::" + _cls("span", "ui-search-reviews__rating-number")),
+    _xp("descendant::" + _cls("span", "ui-search-reviews__rating")),
+)
+_RATING_AMOUNT = _xp("descendant::" + _cls("span", "ui-search-reviews__amount"))
+_NEXT_PAGE = _xp("descendant::" + _cls("li", "andes-pagination__button--next") + "/descendant::a")
+_PRELOADED = _xp("descendant::script[@id='__PRELOADED_STATE__']")
+_LD_JSON = _xp("descendant::script[@type='application/ld+json']")
+
+# Detalle
+_DESCRIPTION = (
+    _xp("descendant::" + _cls("div", "ui-pdp-description__content")),
+    _xp("descendant::" + _cls("p", "ui-pdp-description__content")),
+)
+_DESCRIPTION_LEGACY = _xp("descendant::" + _cls("div", "item-description"))
+_SUBTITLE = _xp("descendant::" + _cls("span", "ui-pdp-subtitle"))
+_RATING_VALUE = _xp("descendant::*[@itemprop='ratingValue']")
+_RATING_COUNT = _xp("descendant::*[@itemprop='ratingCount']")
+_PDP_RATING = _xp("descendant::" + _cls("span", "ui-pdp-review__rating"))
+_PDP_AMOUNT = _xp("descendant::" + _cls("span", "ui-pdp-review__amount"))
+_REVIEWS = _xp("descendant::" + _cls("div", "ui-review"))
+_REVIEW_TITLE = _xp("descendant::" + _cls("*", "ui-review__title"))
+_REVIEW_BODY = (
+    _xp("descendant::" + _cls("*", "ui-review__comment-text")),
+    _xp("descendant::" + _cls("*", "ui-pdp-review__comment")),
+)
+_REVIEW_RATING = _xp("descendant::" + _cls("*", "ui-review__rating"))
+_REVIEW_TIME = _xp("descendant::time")
+
+
+def parse_html(html: Optional[str]):
+    """
+    Devuelve la raíz lxml del documento o None si está vacío.
+    """
+    if not html or not html.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _as_float(text: str) -> Optional[float]:
+    text = text.replace(".", "").replace(",", ".")
+    m = re.search(r"(\d+(?:\.\d+)?)", text)
+    return float(m.group(1)) if m else None
+
+
+def _price_block(node) -> Tuple[Optional[float], Optional[float]]:
+    price = None
+    fractions = _PRICE_FRACTION(node)
+    if fractions:
+        cents = _PRICE_CENTS(node)
+        frac = _text(fractions[0])
+        cent = _text(cents[0]) if cents else ""
+        price = _as_float(f"{frac}{','+cent if cent else ''}")
+    discount_price = None
+    strike = _PRICE_STRIKE(node)
+    if strike:
+        discount_price = _as_float(_text(strike[0]))
+    return price, discount_price
+
+
+def _listing_item(node, with_rating: bool) -> Dict:
+    link = _first(node, _LINK)
+    title_node = _first(node, _TITLE)
+    image_node = _first(node, _IMAGE)
+    title = _text(title_node) if title_node is not None else None
+    url = link.get("href") if link is not None else None
+    image = None
+    if image_node is not None:
+        image = image_node.get("data-src")
+        if image is None:
+            image = image_node.get("src")
+    price, discount_price = _price_block(node)
+    rating_avg = None
+    rating_count = None
+    if with_rating:
+        rating_node = _first(node, _RATING)
+        if rating_node is not None:
+            try:
+                rating_avg = float(_text(rating_node).replace(",", "."))
+            except Exception:
+                rating_avg = None
+        count_nodes = _RATING_AMOUNT(node)
+        if count_nodes:
+            m = re.search(r"(\d+)", _text(count_nodes[0]))
+            rating_count = int(m.group(1)) if m else None
+    return {
+        "title": title,
+        "url": url,
+        "image": image,
+        "price": price,
+        "discount_price": discount_price,
+        "rating": rating_avg,
+        "rating_count": rating_count,
+    }
+
+
+def listing_dom_items(root) -> List[Dict]:
+    """
+    Ítems del listado a partir del DOM (tarjetas li y, si no hay, div.ui-search-result).
+    """
+    if root is None:
+        return []
+    items = [_listing_item(li, True) for li in _LI_ITEMS(root)]
+    if items:
+        return items
+    return [_listing_item(div, False) for div in _DIV_ITEMS(root)]
+
+
+def next_page_url(root) -> Optional[str]:
+    if root is None:
+        return None
+    found = _NEXT_PAGE(root)
+    if found:
+        return found[0].get("href")
+    return None
+
+
+def preloaded_state_text(root) -> Optional[str]:
+    if root is None:
+        return None
+    found = _PRELOADED(root)
+    return (found[0].text or "") if found else None
+
+
+def ld_json_texts(root) -> List[str]:
+    if root is None:
+        return []
+    return [el.text or "" for el in _LD_JSON(root)]
+
+
+def product_detail_dom(root) -> Dict:
+    """
+    Campos del detalle que salen del DOM: descripción, vendidos, calificación y reseñas.
+    """
+    out: Dict = {"description": None, "sold": None, "detail_rating": None, "detail_rating_count": None, "reviews": []}
+    if root is None:
+        return out
+
+    desc_node = _first(root, _DESCRIPTION)
+    if desc_node is None:
+        legacy = _DESCRIPTION_LEGACY(root)
+        desc_node = legacy[0] if legacy else None
+    if desc_node is not None:
+        out["description"] = _text(desc_node, "\n")
+
+    sold_nodes = _SUBTITLE(root)
+    if sold_nodes:
+        mm = re.search(r"(\d+)", _text(sold_nodes[0]))
+        if mm:
+            try:
+                out["sold"] = int(mm.group(1))
+            except Exception:
+                out["sold"] = None
+
+    rating = None
+    rating_count = None
+    rv = _RATING_VALUE(root)
+    if rv and rv[0].get("content") is not None:
+        try:
+            rating = float(rv[0].get("content"))
+        except Exception:
+            pass
+    rc = _RATING_COUNT(root)
+    if rc and rc[0].get("content") is not None:
+        try:
+            rating_count = int(rc[0].get("content"))
+        except Exception:
+            pass
+    if rating is None:
+        rnode = _PDP_RATING(root)
+        if rnode:
+            try:
+                rating = float(_text(rnode[0]).replace(",", "."))
+            except Exception:
+                pass
+    if rating_count is None:
+        cnode = _PDP_AMOUNT(root)
+        if cnode:
+            mm = re.search(r"(\d+)", _text(cnode[0]))
+            rating_count = int(mm.group(1)) if mm else None
+    out["detail_rating"] = rating
+    out["detail_rating_count"] = rating_count
+
+    reviews: List[Dict] = []
+    for r in _REVIEWS(root):
+        try:
+            tnode = _REVIEW_TITLE(r)
+            title = _text(tnode[0]) if tnode else None
+            bnode = _first(r, _REVIEW_BODY)
+            body = _text(bnode, "\n") if bnode is not None else None
+            rate = None
+            rnode = _REVIEW_RATING(r)
+            if rnode:
+                m = re.search(r"(\d+)(?:\.|,)?", _text(rnode[0]))
+                rate = int(m.group(1)) if m else None
+            date = None
+            dnode = _REVIEW_TIME(r)
+            if dnode and dnode[0].get("datetime") is not None:
+                date = dnode[0].get("datetime")
+            if body or title:
+                reviews.append({
+                    "title": title,
+                    "content": body,
+                    "rate": rate,
+                    "date": date,
+                })
+        except Exception:
+            continue
+    out["reviews"] = reviews
+    return out
+
@@ -1,15 +1,28 @@
+import os
+import queue
 import re
 import time
 import random
 import json
+import threading
 import unicodedata
 import logging
-from typing import List, Dict, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, List, Dict, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import requests
 from bs4 import BeautifulSoup
 
+from . import fastparse
+from .browser import get_browser_pool
+from .cache import get_cache, ttl_for
+from .models import Product, as_dicts
+from .ratelimit import MAX_THROTTLE_WAIT, THROTTLE_STATUS, get_limiter
+from .scheduler import DISCOVERY_SHARE, HEDGE_AFTER, RACE_STAGGER, Deadline, hedged, race
+from .session import RETRY_BACKOFF, RETRY_STATUS, RETRY_TOTAL, get_session
+from .strategies import get_strategy_stats
+
 
 # Lista de User-Agents para rotación básica
 USER_AGENTS = [
@@ -22,6 +35,32 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0",
 ]
 
+# Hilos de la etapa de detalle (las peticiones simultáneas por host las acota el limitador)
+DETAIL_WORKERS = int(os.environ.get("SCRAPER_DETAIL_WORKERS", "8"))
+
+# Páginas de listado que se pueden tener descargadas por delante de la que se enriquece
+PAGE_PREFETCH = int(os.environ.get("SCRAPER_PAGE_PREFETCH", "1"))
+
+# Recrawl incremental: antigüedad máxima (segundos) de un detalle guardado para reutilizarlo
+DETAIL_TTL = float(os.environ.get("SCRAPER_DETAIL_TTL", str(24 * 3600)))
+# Campos del listado que deben coincidir con lo guardado para no volver al detalle
+LISTING_FIELDS = ("title", "price", "discount_price")
+
+# Consulta de productos guardados: fn(urls) -> {url: documento}
+KnownLookup = Callable[[List[str]], Dict[str, Dict]]
+
+# Tiempo mínimo (s) que se reserva para la petición en sí dentro de su timeout
+MIN_REQUEST_TIME = float(os.environ.get("SCRAPER_MIN_REQUEST_TIME", "1"))
+
+# Holgura (s) sobre las esperas de una tarea de Playwright (banners, scroll, extracción)
+# para acotar lo que se espera al pool de navegadores, cola incluida
+BROWSER_RUN_SLACK = float(os.environ.get("SCRAPER_BROWSER_RUN_SLACK", "10"))
+# Segundos mínimos antes del deadline para abrir el navegador a buscar más reseñas
+REVIEWS_RENDER_MIN = float(os.environ.get("SCRAPER_REVIEWS_RENDER_MIN", "3"))
+
+# Backend de parseo: "lxml" (XPath precompilado, rápido) o "bs4" (referencia)
+PARSER_BACKEND = os.environ.get("SCRAPER_PARSER", "lxml")
+
 
 def _slugify(text: str) -> str:
     """
@@ -64,282 +103,291 @@ def _headers() -> Dict[str, str]:
 
 def _request(url: str, timeout: int = 20) -> Optional[str]:
     """
-    Realiza una petición HTTP con reintentos exponenciales simples.
+    Realiza una petición HTTP sobre la sesión compartida (keep-alive, reintentos
+    con backoff en 5xx y ritmo adaptativo por host en 403/429), todo dentro
+    de timeout.
     """
-    delay = 1.0
-    for attempt in range(4):
+    html, _ = _request_with_url(url, timeout=timeout)
+    return html
+
+def _retry_wait(resp, attempt: int) -> float:
+    """
+    Espera antes del reintento `attempt` de un 5xx o error de red: Retry-After
+    si el servidor lo envía, si no backoff * 2^attempt con jitter.
+    """
+    if resp is not None:
+        ra = resp.headers.get("Retry-After")
+        if ra and ra.isdigit():
+            return float(ra)
+    return RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, 0.5)
+
+def _limited_get(url: str, headers: Dict[str, str], timeout: float) -> Optional[requests.Response]:
+    """
+    GET a través del limitador del host: espera su turno en el token bucket,
+    informa el resultado (AIMD) y reintenta 403/429 con el ritmo ya reducido,
+    y 5xx o errores de red con backoff. timeout acota todo, turnos, cupos,
+    esperas y reintentos incluidos. Devuelve None (o la última respuesta) sin
+    tocar la red si el circuito del host está abierto o el turno llegaría
+    después del timeout, y None si no hay cupo libre dentro del plazo.
+    """
+    limiter = get_limiter()
+    resp = None
+    end = time.monotonic() + timeout
+    for attempt in range(RETRY_TOTAL + 1):
+        left = end - time.monotonic()
+        if left <= 0:
+            return resp
+        # Se deja al menos MIN_REQUEST_TIME para la petición en sí
+        wait = limiter.reserve(url, max_wait=min(MAX_THROTTLE_WAIT, max(0.0, left - MIN_REQUEST_TIME)))
+        if wait is None:
+            return resp
+        if wait > 0:
+            time.sleep(wait)
         try:
-            resp = requests.get(url, headers=_headers(), timeout=timeout)
-            if resp.status_code == 200:
-                return resp.text
-            # Manejo de límites: backoff si 403/429
-            if resp.status_code in (403, 429):
-                time.sleep(delay + random.uniform(0, 0.5))
-                delay *= 2
-                continue
-            # Otros códigos: intentar una vez más
+            with limiter.slot(url, timeout=max(0.0, end - time.monotonic())) as acquired:
+                if not acquired:
+                    # Sin cupo dentro del plazo: la descarga falla sin tocar la red
+                    return None
+                t0 = time.monotonic()
+                resp = get_session().get(url, headers=headers, timeout=max(MIN_REQUEST_TIME, end - t0))
         except requests.RequestException:
-            time.sleep(delay + random.uniform(0, 0.5))
-            delay *= 2
-    return None
+            limiter.observe(url, None, time.monotonic() - t0)
+            resp = None
+        else:
+            limiter.observe(url, resp.status_code, time.monotonic() - t0, resp.headers.get("Retry-After"))
+            if resp.status_code in THROTTLE_STATUS:
+                # El limitador ya redujo el ritmo y espacia el próximo turno
+                continue
+            if resp.status_code not in RETRY_STATUS:
+                return resp
+        if attempt < RETRY_TOTAL:
+            time.sleep(min(_retry_wait(resp, attempt), max(0.0, end - time.monotonic())))
+    return resp
 
 def _request_with_url(url: str, timeout: int = 20) -> Tuple[Optional[str], Optional[str]]:
-    delay = 1.0
-    for attempt in range(4):
+    html, final_url, _ = _request_timed(url, timeout=timeout)
+    return html, final_url
+
+def _request_timed(url: str, timeout: float = 20) -> Tuple[Optional[str], Optional[str], Optional[float]]:
+    """
+    Igual que _request_with_url, más la fecha del contenido: la de la caché
+    si se sirvió de ahí sin revalidar, o la actual si se descargó o validó.
+    """
+    cache = get_cache()
+    entry = cache.get(url) if cache else None
+    if entry and entry.age() < ttl_for(_is_product_url(url)):
+        return entry.body, entry.final_url, entry.stored_at
+    headers = _headers()
+    if entry:
+        headers.update(entry.validators())
+    try:
+        resp = _limited_get(url, headers, timeout)
+    except requests.RequestException:
+        return None, None, None
+    if resp is None:
+        return None, None, None
+    if resp.status_code == 304 and entry:
+        cache.touch(url)
+        return entry.body, entry.final_url, time.time()
+    if resp.status_code == 200:
+        if cache:
+            cache.put(url, resp.text, resp.url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return resp.text, resp.url, time.time()
+    return None, None, None
+
+
+def _dismiss_banners(page) -> None:
+    for sel in [
+        'button:has-text("Aceptar")',
+        'button:has-text("Entendido")',
+        'button:has-text("OK")',
+        '[data-testid="action:understood-button"]',
+    ]:
         try:
-            resp = requests.get(url, headers=_headers(), timeout=timeout)
-            if resp.status_code == 200:
-                return resp.text, resp.url
-            if resp.status_code in (403, 429):
-                time.sleep(delay + random.uniform(0, 0.5))
-                delay *= 2
-                continue
-        except requests.RequestException:
-            time.sleep(delay + random.uniform(0, 0.5))
-            delay *= 2
-    return None, None
+            btn = page.locator(sel)
+            if btn and btn.count() > 0:
+                btn.first.click(timeout=2000)
+        except Exception:
+            pass
 
 
-def _request_rendered(url: str, wait_selector: str = "li.ui-search-layout__item", timeout_ms: int = 12000) -> Optional[str]:
-    try:
-        from playwright.sync_api import sync_playwright
-    except Exception:
-        return None
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=random.choice(USER_AGENTS), locale="es-ES")
-            page = context.new_page()
-            page.goto(url, wait_until="domcontentloaded")
-            for sel in [
-                'button:has-text("Aceptar")',
-                'button:has-text("Entendido")',
-                'button:has-text("OK")',
-                '[data-testid="action:understood-button"]',
-            ]:
+def _browser_run_timeout(timeout_ms: int, waits: int) -> float:
+    """
+    Timeout de BrowserPool.run: la navegación más `waits` esperas de timeout_ms
+    cada una, más la holgura. Una tarea que no entra a tiempo se descarta.
+    """
+    return (1 + waits) * timeout_ms / 1000.0 + BROWSER_RUN_SLACK
+
+
+def _request_rendered(url: str, wait_selector: str = "li.ui-search-layout__item", timeout_ms: int = 12000, deadline_ts: Optional[float] = None) -> Optional[str]:
+    # Hasta tres selectores alternativos, cada uno con su espera
+    run_timeout = _browser_run_timeout(timeout_ms, 3)
+    if deadline_ts is not None:
+        run_timeout = min(run_timeout, Deadline(deadline_ts).remaining())
+
+    def task(page) -> str:
+        page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+        _dismiss_banners(page)
+        try:
+            page.wait_for_selector(wait_selector, timeout=timeout_ms)
+        except Exception:
+            try:
+                page.wait_for_selector('a.poly-component__title', timeout=timeout_ms)
+            except Exception:
                 try:
-                    btn = page.locator(sel)
-                    if btn and btn.count() > 0:
-                        btn.first.click(timeout=2000)
+                    page.wait_for_selector('script#__PRELOADED_STATE__', timeout=timeout_ms)
                 except Exception:
                     pass
+        for _ in range(5):
             try:
-                page.wait_for_selector(wait_selector, timeout=timeout_ms)
+                page.mouse.wheel(0, 1200)
+                page.wait_for_timeout(400)
             except Exception:
-                try:
-                    page.wait_for_selector('a.poly-component__title', timeout=timeout_ms)
-                except Exception:
-                    try:
-                        page.wait_for_selector('script#__PRELOADED_STATE__', timeout=timeout_ms)
-                    except Exception:
-                        pass
-            for _ in range(5):
-                try:
-                    page.mouse.wheel(0, 1200)
-                    page.wait_for_timeout(400)
-                except Exception:
-                    break
-            html = page.content()
-            context.close(); browser.close()
-            return html
+                break
+        return page.content()
+
+    try:
+        return get_browser_pool(USER_AGENTS).run(task, timeout=run_timeout)
     except Exception:
         return None
 
 
-def _render_capture_search(url: str, timeout_ms: int = 15000) -> List[Dict]:
-    try:
-        from playwright.sync_api import sync_playwright
-    except Exception:
-        return []
+def _render_capture_search(url: str, timeout_ms: int = 15000, deadline_ts: Optional[float] = None) -> List[Dict]:
     results: List[Dict] = []
+    run_timeout = _browser_run_timeout(timeout_ms, 1)
+    if deadline_ts is not None:
+        run_timeout = min(run_timeout, Deadline(deadline_ts).remaining())
+
+    def handle_response(resp):
+        try:
+            url = resp.url
+            if resp.status == 200:
+                ct = resp.headers.get("content-type", "")
+                if "application/json" in ct or "json" in ct:
+                    data = resp.json()
+                    arr = None
+                    if isinstance(data, dict):
+                        if isinstance(data.get('results'), list):
+                            arr = data['results']
+                        elif isinstance(data.get('items'), list):
+                            arr = data['items']
+                        else:
+                            for k, v in data.items():
+                                if isinstance(v, dict) and isinstance(v.get('results'), list):
+                                    arr = v['results']; break
+                    if arr:
+                        for it in arr:
+                            title = it.get('title') or (it.get('name') if isinstance(it.get('name'), str) else None)
+                            permalink = it.get('permalink') or it.get('url')
+                            price = it.get('price') or (it.get('prices',{}).get('price') if isinstance(it.get('prices'), dict) else None)
+                            image = it.get('thumbnail') or it.get('image')
+                            if title and permalink:
+                                results.append({
+                                    'title': title,
+                                    'url': permalink,
+                                    'image': image,
+                                    'price': price,
+                                    'discount_price': None,
+                                    'rating': None,
+                                    'rating_count': None,
+                                })
+        except Exception:
+            pass
+
+    def task(page) -> None:
+        page.on("response", handle_response)
+        page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+        page.wait_for_timeout(timeout_ms)
+
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=random.choice(USER_AGENTS), locale="es-ES")
-            page = context.new_page()
-            def handle_response(resp):
-                try:
-                    url = resp.url
-                    if resp.status == 200:
-                        ct = resp.headers.get("content-type", "")
-                        if "application/json" in ct or "json" in ct:
-                            data = resp.json()
-                            arr = None
-                            if isinstance(data, dict):
-                                if isinstance(data.get('results'), list):
-                                    arr = data['results']
-                                elif isinstance(data.get('items'), list):
-                                    arr = data['items']
-                                else:
-                                    for k, v in data.items():
-                                        if isinstance(v, dict) and isinstance(v.get('results'), list):
-                                            arr = v['results']; break
-                            if arr:
-                                for it in arr:
-                                    title = it.get('title') or (it.get('name') if isinstance(it.get('name'), str) else None)
-                                    permalink = it.get('permalink') or it.get('url')
-                                    price = it.get('price') or (it.get('prices',{}).get('price') if isinstance(it.get('prices'), dict) else None)
-                                    image = it.get('thumbnail') or it.get('image')
-                                    if title and permalink:
-                                        results.append({
-                                            'title': title,
-                                            'url': permalink,
-                                            'image': image,
-                                            'price': price,
-                                            'discount_price': None,
-                                            'rating': None,
-                                            'rating_count': None,
-                                        })
-                except Exception:
-                    pass
-            page.on("response", handle_response)
-            page.goto(url, wait_until="domcontentloaded")
-            page.wait_for_timeout(timeout_ms)
-            context.close(); browser.close()
+        get_browser_pool(USER_AGENTS).run(task, timeout=run_timeout)
     except Exception:
         return []
     return results
 
-def _render_capture_reviews(url: str, timeout_ms: int = 15000, max_reviews: int = 60) -> List[Dict]:
-    try:
-        from playwright.sync_api import sync_playwright
-    except Exception:
-        return []
+def _render_capture_reviews(url: str, timeout_ms: int = 15000, max_reviews: int = 60, deadline_ts: Optional[float] = None) -> List[Dict]:
     out: List[Dict] = []
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=random.choice(USER_AGENTS), locale="es-ES")
-            page = context.new_page()
-            page.goto(url, wait_until="domcontentloaded")
-            for sel in [
-                'button:has-text("Aceptar")',
-                'button:has-text("Entendido")',
-                'button:has-text("OK")',
-                '[data-testid="action:understood-button"]',
-            ]:
-                try:
-                    btn = page.locator(sel)
-                    if btn and btn.count() > 0:
-                        btn.first.click(timeout=2000)
-                except Exception:
-                    pass
-            for sel in [
-                'a:has-text("Opiniones")',
-                'a:has-text("Ver todas")',
-                'a:has-text("Ver más")',
-                'a[href*="#reviews"]',
-            ]:
-                try:
-                    lnk = page.locator(sel)
-                    if lnk and lnk.count() > 0:
-                        lnk.first.click(timeout=3000)
-                        break
-                except Exception:
-                    pass
+    run_timeout = _browser_run_timeout(timeout_ms, 1)
+    if deadline_ts is not None:
+        run_timeout = min(run_timeout, Deadline(deadline_ts).remaining())
+
+    def task(page) -> None:
+        page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+        _dismiss_banners(page)
+        for sel in [
+            'a:has-text("Opiniones")',
+            'a:has-text("Ver todas")',
+            'a:has-text("Ver más")',
+            'a[href*="#reviews"]',
+        ]:
             try:
-                page.wait_for_selector('div.ui-review, section#reviews', timeout=timeout_ms)
+                lnk = page.locator(sel)
+                if lnk and lnk.count() > 0:
+                    lnk.first.click(timeout=3000)
+                    break
             except Exception:
                 pass
-            for _ in range(12):
+        try:
+            page.wait_for_selector('div.ui-review, section#reviews', timeout=timeout_ms)
+        except Exception:
+            pass
+        for _ in range(12):
+            try:
+                page.mouse.wheel(0, 1200)
+                page.wait_for_timeout(400)
+            except Exception:
+                break
+        cards = page.locator('div.ui-review')
+        n = cards.count()
+        for i in range(min(n, max_reviews)):
+            try:
+                card = cards.nth(i)
+                title = None
                 try:
-                    page.mouse.wheel(0, 1200)
-                    page.wait_for_timeout(400)
+                    t = card.locator('.ui-review__title')
+                    if t.count() > 0:
+                        title = t.first.inner_text().strip()
                 except Exception:
-                    break
-            cards = page.locator('div.ui-review')
-            n = cards.count()
-            for i in range(min(n, max_reviews)):
-                try:
-                    card = cards.nth(i)
-                    title = None
-                    try:
-                        t = card.locator('.ui-review__title')
-                        if t.count() > 0:
-                            title = t.first.inner_text().strip()
-                    except Exception:
-                        pass
-                    body = None
-                    try:
-                        b = card.locator('.ui-review__comment-text, .ui-pdp-review__comment')
-                        if b.count() > 0:
-                            body = b.first.inner_text().strip()
-                    except Exception:
-                        pass
-                    rate = None
-                    try:
-                        r = card.locator('.ui-review__rating')
-                        if r.count() > 0:
-                            txt = r.first.inner_text().strip()
-                            m = re.search(r"(\d+)(?:\.|,)?", txt)
-                            rate = int(m.group(1)) if m else None
-                    except Exception:
-                        pass
-                    date = None
-                    try:
-                        d = card.locator('time')
-                        if d.count() > 0:
-                            date = d.first.get_attribute('datetime')
-                    except Exception:
-                        pass
-                    if body or title:
-                        out.append({
-                            'title': title,
-                            'content': body,
-                            'rate': rate,
-                            'date': date,
-                        })
-                except Exception:
-                    continue
-            context.close(); browser.close()
-    except Exception:
-        return out
-    return out
-
-# storage_state helper removido para volver al estado estable
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=random.choice(USER_AGENTS), locale="es-ES")
-            page = context.new_page()
-            page.goto(url, wait_until="domcontentloaded")
-            # Intentar aceptar cookies/banners
-            for sel in [
-                'button:has-text("Aceptar")',
-                'button:has-text("Entendido")',
-                'button:has-text("OK")',
-                '[data-testid="action:understood-button"]',
-            ]:
+                    pass
+                body = None
                 try:
-                    btn = page.locator(sel)
-                    if btn and btn.count() > 0:
-                        btn.first.click(timeout=2000)
+                    b = card.locator('.ui-review__comment-text, .ui-pdp-review__comment')
+                    if b.count() > 0:
+                        body = b.first.inner_text().strip()
                 except Exception:
                     pass
-            # Esperar cualquier indicador de listado
-            try:
-                page.wait_for_selector(wait_selector, timeout=timeout_ms)
-            except Exception:
+                rate = None
                 try:
-                    page.wait_for_selector('a.poly-component__title', timeout=timeout_ms)
+                    r = card.locator('.ui-review__rating')
+                    if r.count() > 0:
+                        txt = r.first.inner_text().strip()
+                        m = re.search(r"(\d+)(?:\.|,)?", txt)
+                        rate = int(m.group(1)) if m else None
                 except Exception:
-                    try:
-                        page.wait_for_selector('script#__PRELOADED_STATE__', timeout=timeout_ms)
-                    except Exception:
-                        pass
-            # Desplazar para hidratar contenido perezoso
-            for _ in range(5):
+                    pass
+                date = None
                 try:
-                    page.mouse.wheel(0, 1200)
-                    page.wait_for_timeout(400)
+                    d = card.locator('time')
+                    if d.count() > 0:
+                        date = d.first.get_attribute('datetime')
                 except Exception:
-                    break
-            html = page.content()
-            context.close()
-            browser.close()
-            return html
+                    pass
+                if body or title:
+                    out.append({
+                        'title': title,
+                        'content': body,
+                        'rate': rate,
+                        'date': date,
+                    })
+            except Exception:
+                continue
+
+    try:
+        get_browser_pool(USER_AGENTS).run(task, timeout=run_timeout)
     except Exception:
-        return None
+        # Tras un timeout la tarea puede seguir agregando: se devuelve una copia
+        return list(out)
+    return out
 
 
 def _parse_price_block(node) -> Tuple[Optional[float], Optional[float]]:
@@ -373,8 +421,88 @@ def _parse_price_block(node) -> Tuple[Optional[float], Optional[float]]:
     return price, discount_price
 
 
+class ListingPage:
+    """
+    Página de listado parseada una sola vez. Expone los ítems, el enlace a la
+    siguiente página y el estado JSON embebido (__PRELOADED_STATE__, ld+json)
+    para que todos los consumidores reutilicen el mismo árbol.
+    """
+
+    def __init__(self, html: Optional[str], backend: Optional[str] = None):
+        self.html = html or ""
+        self.backend = backend or PARSER_BACKEND
+        self.soup = None
+        self.tree = None
+        if self.backend == "lxml":
+            self.tree = fastparse.parse_html(self.html)
+        else:
+            self.soup = BeautifulSoup(self.html, "lxml")
+        self._preloaded_state: Optional[Dict] = None
+        self._preloaded_parsed = False
+        self._ld_json: Optional[List] = None
+        self.items: List[Dict] = _listing_items_from_page(self)
+        if self.soup is not None:
+            self.next_url: Optional[str] = _next_page_from_soup(self.soup)
+        else:
+            self.next_url = fastparse.next_page_url(self.tree)
+
+    @property
+    def preloaded_state(self) -> Optional[Dict]:
+        if not self._preloaded_parsed:
+            self._preloaded_parsed = True
+            try:
+                if self.soup is not None:
+                    script = self.soup.select_one('script#__PRELOADED_STATE__')
+                    text = script.text if script else None
+                else:
+                    text = fastparse.preloaded_state_text(self.tree)
+                if text:
+                    state = json.loads(text)
+                    if isinstance(state, dict):
+                        self._preloaded_state = state
+            except Exception:
+                self._preloaded_state = None
+        return self._preloaded_state
+
+    @property
+    def ld_json(self) -> List:
+        if self._ld_json is None:
+            self._ld_json = _ld_json_blocks(self.soup, self.tree)
+        return self._ld_json
+
+
+def _ld_json_blocks(soup, tree) -> List:
+    if soup is not None:
+        texts = [ld.string or ld.text or '{}' for ld in soup.select('script[type="application/ld+json"]')]
+    else:
+        texts = [t or '{}' for t in fastparse.ld_json_texts(tree)]
+    blocks: List = []
+    for text in texts:
+        try:
+            blocks.append(json.loads(text))
+        except Exception:
+            continue
+    return blocks
+
+
 def _extract_listing_items(html: str) -> List[Dict]:
-    soup = BeautifulSoup(html, "lxml")
+    return ListingPage(html).items
+
+
+def _listing_items_from_page(page: "ListingPage") -> List[Dict]:
+    if page.soup is not None:
+        items = _listing_dom_items_soup(page.soup)
+    else:
+        items = fastparse.listing_dom_items(page.tree)
+    if items:
+        return items
+    items = _items_from_preloaded_state(page.preloaded_state)
+    if items:
+        return items
+    return _items_from_ld_json(page.ld_json)
+
+
+def _listing_dom_items_soup(soup) -> List[Dict]:
     items: List[Dict] = []
 
     for li in soup.select("li.ui-search-layout__item"):
@@ -473,13 +601,13 @@ def _extract_listing_items(html: str) -> List[Dict]:
             "rating_count": None,
         })
 
-    if items:
-        return items
+    return items
+
 
+def _items_from_preloaded_state(state: Optional[Dict]) -> List[Dict]:
+    items: List[Dict] = []
     try:
-        script = soup.select_one('script#__PRELOADED_STATE__')
-        if script and script.text:
-            state = json.loads(script.text)
+        if state:
             search = None
             if isinstance(state, dict):
                 search = state.get('pageStoreState', {}).get('search')
@@ -510,13 +638,13 @@ def _extract_listing_items(html: str) -> List[Dict]:
                     continue
     except Exception:
         pass
+    return items
 
-    if items:
-        return items
 
+def _items_from_ld_json(blocks: List) -> List[Dict]:
+    items: List[Dict] = []
     try:
-        for ld in soup.select('script[type="application/ld+json"]'):
-            data = json.loads(ld.string or ld.text or '{}')
+        for data in blocks:
             if isinstance(data, dict) and data.get('@type') in ('ItemList', 'SearchResultsPage'):
                 elements = data.get('itemListElement') or []
                 for el in elements:
@@ -563,16 +691,12 @@ def _parse_query_from_listado_url(url: str) -> Optional[str]:
     return None
 
 
-def _api_search_items(query: str, limit: int = 50) -> List[Dict]:
-    url = f"https://api.mercadolibre.com/sites/MCO/search?q={requests.utils.quote(query)}&limit={limit}"
+def _api_items_from_json(body: str) -> List[Dict]:
+    """
+    Convierte la respuesta JSON de la API pública de búsqueda en ítems de listado.
+    """
     try:
-        hdrs = _headers()
-        hdrs["Accept"] = "application/json"
-        hdrs["Origin"] = "https://listado.mercadolibre.com.co"
-        resp = requests.get(url, headers=hdrs, timeout=20)
-        if resp.status_code != 200:
-            return []
-        data = resp.json()
+        data = json.loads(body)
         results = data.get('results', [])
         items: List[Dict] = []
         for it in results:
@@ -594,6 +718,20 @@ def _api_search_items(query: str, limit: int = 50) -> List[Dict]:
     except Exception:
         return []
 
+
+def _api_search_items(query: str, limit: int = 50, timeout: float = 20) -> List[Dict]:
+    url = f"https://api.mercadolibre.com/sites/MCO/search?q={requests.utils.quote(query)}&limit={limit}"
+    try:
+        hdrs = _headers()
+        hdrs["Accept"] = "application/json"
+        hdrs["Origin"] = "https://listado.mercadolibre.com.co"
+        resp = _limited_get(url, hdrs, timeout)
+        if resp is None or resp.status_code != 200:
+            return []
+        return _api_items_from_json(resp.text)
+    except Exception:
+        return []
+
 def _is_product_url(u: Optional[str]) -> bool:
     if not u:
         return False
@@ -604,19 +742,52 @@ def _find_next_page(html: str) -> Optional[str]:
     """
     Encuentra el enlace a la siguiente página del listado.
     """
-    soup = BeautifulSoup(html, "lxml")
+    return ListingPage(html).next_url
+
+
+def _next_page_from_soup(soup) -> Optional[str]:
     next_btn = soup.select_one("li.andes-pagination__button--next a")
     if next_btn and next_btn.has_attr("href"):
         return next_btn["href"]
     return None
 
 
-def _extract_product_detail(html: str, base_url: Optional[str] = None) -> Dict:
+def _extract_product_detail(html: str, base_url: Optional[str] = None, backend: Optional[str] = None, deadline_ts: Optional[float] = None) -> Dict:
     """
     Extrae información del detalle del producto: descripción, vendidos, calificación.
+    Con deadline_ts el render de reseñas se acota al tiempo restante y se
+    omite si ya no alcanza.
     """
-    soup = BeautifulSoup(html, "lxml")
+    soup = None
+    tree = None
+    if (backend or PARSER_BACKEND) == "lxml":
+        tree = fastparse.parse_html(html)
+        detail = fastparse.product_detail_dom(tree)
+    else:
+        soup = BeautifulSoup(html, "lxml")
+        detail = _product_detail_dom_soup(soup)
+    reviews: List[Dict] = detail["reviews"]
+    if not reviews:
+        reviews = _reviews_from_ld_json(_ld_json_blocks(soup, tree))
+    deadline = Deadline(deadline_ts) if deadline_ts is not None else None
+    if base_url and len(reviews) < 10 and (deadline is None or deadline.remaining() >= REVIEWS_RENDER_MIN):
+        timeout_ms = 15000 if deadline is None else int(deadline.timeout(15) * 1000)
+        try:
+            more = _render_capture_reviews(base_url, timeout_ms=timeout_ms, max_reviews=60, deadline_ts=deadline_ts)
+            if more:
+                reviews.extend(more)
+        except Exception:
+            pass
+    return {
+        "description": detail["description"],
+        "sold": detail["sold"],
+        "detail_rating": detail["detail_rating"],
+        "detail_rating_count": detail["detail_rating_count"],
+        "reviews": reviews[:60],
+    }
 
+
+def _product_detail_dom_soup(soup) -> Dict:
     # Descripción
     description = None
     desc_node = soup.select_one("div.ui-pdp-description__content") or soup.select_one("p.ui-pdp-description__content")
@@ -701,173 +872,400 @@ def _extract_product_detail(html: str, base_url: Optional[str] = None) -> Dict:
                 })
         except Exception:
             continue
-    if not reviews:
-        try:
-            for ld in soup.select('script[type="application/ld+json"]'):
-                data = json.loads(ld.string or ld.text or '{}')
-                if isinstance(data, dict):
-                    rlist = data.get("review")
-                    if isinstance(rlist, list):
-                        for rv in rlist:
-                            try:
-                                title = rv.get("name")
-                                body = rv.get("reviewBody")
-                                rate = None
-                                rt = rv.get("reviewRating") or {}
-                                if isinstance(rt, dict):
-                                    rate = int(rt.get("ratingValue") or 0) or None
-                                date = rv.get("datePublished")
-                                if body or title:
-                                    reviews.append({
-                                        "title": title,
-                                        "content": body,
-                                        "rate": rate,
-                                        "date": date,
-                                    })
-                            except Exception:
-                                continue
-        except Exception:
-            pass
-    if base_url and len(reviews) < 10:
-        try:
-            more = _render_capture_reviews(base_url, timeout_ms=15000, max_reviews=60)
-            if more:
-                reviews.extend(more)
-        except Exception:
-            pass
     return {
         "description": description,
         "sold": sold,
         "detail_rating": rating,
         "detail_rating_count": rating_count,
-        "reviews": reviews[:60],
+        "reviews": reviews,
     }
 
 
-def scrape_listing(keyword: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None) -> List[Dict]:
+def _reviews_from_ld_json(blocks: List) -> List[Dict]:
+    reviews: List[Dict] = []
+    try:
+        for data in blocks:
+            if isinstance(data, dict):
+                rlist = data.get("review")
+                if isinstance(rlist, list):
+                    for rv in rlist:
+                        try:
+                            title = rv.get("name")
+                            body = rv.get("reviewBody")
+                            rate = None
+                            rt = rv.get("reviewRating") or {}
+                            if isinstance(rt, dict):
+                                rate = int(rt.get("ratingValue") or 0) or None
+                            date = rv.get("datePublished")
+                            if body or title:
+                                reviews.append({
+                                    "title": title,
+                                    "content": body,
+                                    "rate": rate,
+                                    "date": date,
+                                })
+                        except Exception:
+                            continue
+    except Exception:
+        pass
+    return reviews
+
+
+def _fetch_detail(product: Product, deadline_ts: float) -> Optional[Product]:
+    """
+    Descarga y parsea el detalle de un producto. Devuelve None si se alcanzó el deadline.
+    """
+    url = product.url
+    if not url:
+        return product
+    deadline = Deadline(deadline_ts)
+    if deadline.expired():
+        return None
+    try:
+        timeout = deadline.timeout(5)
+        # Si la respuesta tarda más de HEDGE_AFTER se lanza una copia y gana la primera;
+        # cada intento toma su propio cupo del host en el limitador
+        fetched = hedged(lambda: _request_timed(url, timeout=timeout), HEDGE_AFTER, timeout, accept=lambda r: r[0] is not None)
+        detail_html, final_url, fetched_at = fetched or (None, None, None)
+        if detail_html:
+            product.apply_detail(_extract_product_detail(detail_html, final_url or url, deadline_ts=deadline_ts), final_url, fetched_at)
+    except Exception:
+        pass
+    return product
+
+
+def _accept(product: Product, seen_urls: set) -> bool:
+    """
+    Solo pasan productos con URL de artículo y título, sin repetir URL.
+    """
+    u = product.url
+    if not (_is_product_url(u) and product.title):
+        return False
+    if isinstance(u, str):
+        if u in seen_urls:
+            return False
+        seen_urls.add(u)
+    return True
+
+
+def _same_rating(listed, stored) -> bool:
+    # La calificación guardada suele venir del detalle; se tolera el redondeo del listado
+    if listed is None or stored is None:
+        return True
+    try:
+        return abs(float(listed) - float(stored)) <= 0.05
+    except (TypeError, ValueError):
+        return listed == stored
+
+
+def _reusable_details(listing_items: List[Dict], known: Optional[KnownLookup]) -> Dict[str, Dict]:
+    """
+    Documentos guardados cuyo detalle puede reutilizarse: mismos LISTING_FIELDS
+    y calificación que el listado, y detalle descargado hace menos de DETAIL_TTL.
+    Los productos nuevos, modificados o vencidos no aparecen y se descargan.
+    """
+    if known is None:
+        return {}
+    urls = [it["url"] for it in listing_items if isinstance(it.get("url"), str)]
+    if not urls:
+        return {}
+    try:
+        docs = known(urls)
+    except Exception as e:
+        logging.warning("Recrawl incremental: no se pudo consultar lo guardado: %s", e)
+        return {}
+    now = time.time()
+    reusable: Dict[str, Dict] = {}
+    for it in listing_items:
+        doc = docs.get(it.get("url"))
+        if doc is None or not doc.get("detail_at") or now - doc["detail_at"] > DETAIL_TTL:
+            continue
+        if all(it.get(k) == doc.get(k) for k in LISTING_FIELDS) and _same_rating(it.get("rating"), doc.get("rating")):
+            reusable[it["url"]] = doc
+    return reusable
+
+
+def _iter_enriched(
+    listing_items: List[Dict],
+    seen_urls: set,
+    limit: int,
+    deadline_ts: float,
+    detail_workers: int = DETAIL_WORKERS,
+    known: Optional[KnownLookup] = None,
+) -> Iterator[Dict]:
+    """
+    Enriquece los ítems de una página de listado descargando sus detalles en paralelo
+    y los entrega uno a uno (como dict) en cuanto su detalle está parseado. Conserva
+    el orden del listado, deduplica por URL y se detiene tras `limit` ítems aceptados
+    o en el deadline. Con `known` (recrawl incremental) los productos sin cambios
+    reutilizan el detalle guardado en lugar de descargarlo.
+    """
+    if not listing_items or limit <= 0:
+        return
+    workers = max(1, min(detail_workers, len(listing_items)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    stored = _reusable_details(listing_items, known)
+    accepted = 0
+
+    def _submit(product: Product) -> Future:
+        doc = stored.get(product.url)
+        if doc is None:
+            return pool.submit(_fetch_detail, product, deadline_ts)
+        product.merge_stored(doc)
+        fut: Future = Future()
+        fut.set_result(product)
+        return fut
+
+    try:
+        # Ventana deslizante: solo hay `workers` detalles en vuelo por delante del consumidor
+        pending = (Product.from_dict(it) for it in listing_items)
+        window = []
+        for product in pending:
+            window.append(_submit(product))
+            if len(window) >= workers:
+                break
+        while window:
+            try:
+                product = window.pop(0).result(timeout=max(0.0, deadline_ts - time.time()) + 1)
+            except FutureTimeoutError:
+                break
+            nxt = next(pending, None)
+            if nxt is not None:
+                window.append(_submit(nxt))
+            if product is None:
+                break
+            if _accept(product, seen_urls):
+                accepted += 1
+                yield product.to_dict()
+            if accepted >= limit:
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _fetched_listing(url: str, html: str) -> "ListingPage":
+    """
+    Parsea un listado descargado con _request. Si no trae ítems (captcha,
+    bloqueo o página vacía) se quita de la caché para no servirlo durante
+    LISTING_TTL.
+    """
+    page = ListingPage(html)
+    if not page.items:
+        cache = get_cache()
+        if cache:
+            cache.delete(url)
+    return page
+
+
+def _titled_page(url: str, timeout: float) -> Optional["ListingPage"]:
+    html = _request(url, timeout=timeout)
+    page = _fetched_listing(url, html) if html else None
+    if page is not None and any(it.get("title") for it in page.items):
+        return page
+    return None
+
+
+def _rendered_page(url: str, timeout_ms: int) -> Optional["ListingPage"]:
+    html = _request_rendered(url, timeout_ms=timeout_ms)
+    page = ListingPage(html) if html else None
+    if page is not None and any(it.get("title") for it in page.items):
+        return page
+    return None
+
+
+def _discover_listing(keyword: str, candidates: List[str], deadline: Deadline, skip_listing: bool = False) -> Tuple[Optional[str], Optional[str], Any]:
+    """
+    Primera página del listado dentro de su presupuesto (DISCOVERY_SHARE del
+    tiempo restante). Primero se pide el candidato SSR preferido; los demás y
+    la API solo se lanzan en paralelo si falla o tarda más de RACE_STAGGER, y
+    gana el de mayor prioridad que responda (SSR antes que API); los fallbacks con
+    Playwright, que son caros, solo se intentan si ninguno sirvió. Las
+    estrategias que vienen fallando se saltan y los fallbacks se ordenan por
+    costo esperado (scraper.strategies).
+
+    Devuelve (estrategia, url, resultado): una página para "ssr:i" y
+    "rendered:i", ítems a enriquecer para "api", ítems ya completos para
+    "render_capture", o (None, None, None).
+    """
+    stats = get_strategy_stats()
+    budget = deadline.budget(DISCOVERY_SHARE)
+    timeout = max(1.0, min(20.0, budget))
+    ssr = {} if skip_listing else {f"ssr:{i}": cand for i, cand in enumerate(candidates)}
+    rendered = {} if skip_listing else {f"rendered:{i}": cand for i, cand in enumerate(candidates)}
+    plan = stats.plan(list(ssr) + ["api"] + list(rendered) + (["render_capture"] if candidates else []))
+    tasks: Dict[str, Callable] = {}
+    # En la carrera manda la prioridad fija (SSR antes que API); el plan solo descarta
+    for name in [n for n in list(ssr) + ["api"] if n in plan]:
+        if name == "api":
+            tasks[name] = stats.track(name, lambda: _api_search_items(keyword, timeout=timeout))
+        else:
+            tasks[name] = stats.track(name, lambda c=ssr[name]: _titled_page(c, timeout))
+    winner, result = race(tasks, budget, stagger=RACE_STAGGER)
+    if winner == "api":
+        return winner, None, result
+    if winner is not None:
+        return winner, ssr[winner], result
+
+    for name in [n for n in plan if n in rendered or n == "render_capture"]:
+        if name == "render_capture":
+            if deadline.remaining() < 1:
+                continue
+            items = stats.track(name, lambda: _render_capture_search(candidates[0], timeout_ms=int(deadline.timeout(15) * 1000)))()
+            if items:
+                return name, None, items
+            continue
+        if deadline.budget(DISCOVERY_SHARE) < 1:
+            continue
+        page = stats.track(name, lambda c=rendered[name]: _rendered_page(c, int(deadline.budget(DISCOVERY_SHARE, cap=12) * 1000)))()
+        if page is not None:
+            return name, rendered[name], page
+    return None, None, None
+
+
+def _fetch_listing_page(url: str, deadline: Deadline, rendered: bool = False) -> Optional["ListingPage"]:
+    html = _request(url, timeout=deadline.timeout(20))
+    if html:
+        return _fetched_listing(url, html)
+    if rendered:
+        html = _request_rendered(url, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline.deadline_ts)
+    return ListingPage(html) if html else None
+
+
+class _PagePrefetcher:
+    """
+    Descarga y parsea en un hilo las páginas siguientes del listado mientras
+    el consumidor enriquece la actual. Solo se adelanta una página cuando los
+    ítems ya parseados y sin consumir no cubren la demanda (así no se pide la
+    página 2 si la primera alcanza), y la cola acotada (SCRAPER_PAGE_PREFETCH)
+    mantiene la memoria constante. Las descargas pasan por el limitador por
+    host como cualquier otra.
+    """
+
+    def __init__(self, next_url: Optional[str], fetch: Callable[[str], Optional["ListingPage"]], pages_left: int, demand: Callable[[], int], deadline: Deadline, in_hand: int):
+        self._queue: "queue.Queue[Optional[Tuple[str, ListingPage]]]" = queue.Queue(maxsize=max(1, PAGE_PREFETCH))
+        self._cond = threading.Condition()
+        self._closed = False
+        # Ítems parseados que el consumidor todavía no terminó de procesar
+        self._ahead = in_hand
+        self._in_hand = in_hand
+        self._demand = demand
+        self._deadline = deadline
+        self._thread = threading.Thread(target=self._run, args=(next_url, fetch, pages_left), name="page-prefetch", daemon=True)
+        self._thread.start()
+
+    def _wanted(self) -> bool:
+        with self._cond:
+            while not self._closed and self._demand() - self._ahead <= 0:
+                self._cond.wait(0.5)
+            return not self._closed
+
+    def _put(self, item: Optional[Tuple[str, "ListingPage"]]) -> bool:
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, url: Optional[str], fetch: Callable[[str], Optional["ListingPage"]], pages_left: int) -> None:
+        try:
+            while url and pages_left > 0 and not self._deadline.expired() and self._wanted():
+                page = fetch(url)
+                if page is None:
+                    break
+                with self._cond:
+                    self._ahead += len(page.items)
+                if not self._put((url, page)):
+                    return
+                url = page.next_url
+                pages_left -= 1
+        except Exception as e:
+            logging.warning("Prefetch de página falló en %s: %s", url, e)
+        self._put(None)
+
+    def take(self) -> Optional[Tuple[str, "ListingPage"]]:
+        """
+        Siguiente (url, página); None si no hay más o se alcanzó el deadline.
+        """
+        with self._cond:
+            self._ahead -= self._in_hand
+            self._in_hand = 0
+            self._cond.notify_all()
+        try:
+            got = self._queue.get(timeout=self._deadline.remaining() + 1)
+        except queue.Empty:
+            return None
+        if got is not None:
+            self._in_hand = len(got[1].items)
+        return got
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def scrape_listing(keyword: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, on_page: Optional[Callable[[int], None]] = None, known: Optional[KnownLookup] = None) -> List[Dict]:
     """
     Recorre el listado de Mercado Libre para la palabra clave y devuelve
     una lista de dicts con la información de productos. Visita cada detalle
-    para enriquecer con descripción y métricas adicionales.
+    para enriquecer con descripción y métricas adicionales. El ritmo entre
+    páginas lo marca el limitador adaptativo por host (scraper.ratelimit);
+    per_page_delay y detail_delay se conservan por compatibilidad. Con
+    `known` (recrawl incremental) solo se descargan los detalles de productos
+    nuevos, modificados o vencidos.
+    """
+    return list(iter_scrape_listing(keyword, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, on_page=on_page, known=known))
+
+
+def iter_scrape_listing(keyword: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, on_page: Optional[Callable[[int], None]] = None, known: Optional[KnownLookup] = None) -> Iterator[Dict]:
+    """
+    Igual que scrape_listing, pero entrega cada producto en cuanto su detalle
+    está enriquecido (para respuestas en streaming).
     """
     start_ts = time.time()
     if deadline_ts is None:
         deadline_ts = start_ts + 55.0
+    deadline = Deadline(deadline_ts)
     candidates = build_search_candidates(keyword)
-    url = None
-    html = None
-    for cand in candidates:
-        html_try = _request(cand)
-        parsed = _extract_listing_items(html_try or "") if html_try else []
-        if not parsed:
-            html_try2 = _request_rendered(cand)
-            parsed = _extract_listing_items(html_try2 or "") if html_try2 else []
-            if parsed:
-                html_try = html_try2
-        if any(it.get("title") for it in parsed):
-            url = cand
-            html = html_try
-            break
+    # Con el circuito del listado abierto se va directo a la API
+    listing_open = bool(candidates) and get_limiter().is_open(candidates[0])
+    source, url, result = _discover_listing(keyword, candidates, deadline, skip_listing=listing_open)
     if url is None:
-        if candidates:
-            url_flow_items = scrape_listing_from_url(
-                candidates[-1],
-                max_pages=max_pages,
-                per_page_delay=per_page_delay,
-                detail_delay=detail_delay,
-                min_items=min_items,
-                deadline_ts=deadline_ts,
-            )
-            if url_flow_items:
-                return url_flow_items
-        api_items = _api_search_items(keyword)
-        if api_items:
-            enriched: List[Dict] = []
-            seen_urls = set()
-            for item in api_items:
-                if item.get("url"):
-                    try:
-                        if time.time() > deadline_ts:
-                            break
-                        detail_html, final_url = _request_with_url(item["url"], timeout=5)  # type: ignore[index]
-                        if detail_html:
-                            detail = _extract_product_detail(detail_html, final_url or item.get("url"))
-                            item.update(detail)
-                            if final_url:
-                                item["url"] = final_url
-                    except Exception:
-                        pass
-                item["rating"] = item.get("detail_rating") or item.get("rating")
-                item["rating_count"] = item.get("detail_rating_count") or item.get("rating_count")
-                item.pop("detail_rating", None)
-                item.pop("detail_rating_count", None)
-                if _is_product_url(item.get("url")) and item.get("title"):
-                    u = item.get("url")
-                    if isinstance(u, str) and u in seen_urls:
-                        continue
-                    if isinstance(u, str):
-                        seen_urls.add(u)
-                    enriched.append(item)
-                if len(enriched) >= min_items:
-                    break
-            return enriched[:min_items]
-        render_items = _render_capture_search(candidates[0]) if candidates else []
-        if render_items:
-            return render_items
-        return []
-    all_items: List[Dict] = []
+        if source == "api":
+            yield from _iter_enriched(result, set(), min_items, deadline_ts, detail_workers, known)
+        elif source == "render_capture":
+            yield from result
+        return
+    page = result
     seen_urls = set()
+    emitted = 0
 
     pages_scraped = 0
-    next_url = url
-    while next_url and pages_scraped < max_pages:
-        if pages_scraped > 0:
-            html = _request(next_url)
-            if not html:
-                break
-
-        listing_items = _extract_listing_items(html)
-        if not listing_items and pages_scraped == 0:
-            html2 = _request_rendered(next_url)
-            if html2:
-                listing_items = _extract_listing_items(html2)
-                html = html2
-        for item in listing_items:
-            # Enriquecer con detalle si hay URL
-            if item.get("url"):
-                if time.time() > deadline_ts:
+    # La página siguiente se descarga mientras se enriquece la actual
+    prefetch = _PagePrefetcher(page.next_url, lambda u: _fetch_listing_page(u, deadline), max_pages - 1, lambda: min_items - emitted, deadline, len(page.items))
+    try:
+        while pages_scraped < max_pages and not deadline.expired():
+            if pages_scraped > 0:
+                got = prefetch.take()
+                if got is None:
                     break
-                detail_html, final_url = _request_with_url(item["url"], timeout=5)
-                if detail_html:
-                    detail = _extract_product_detail(detail_html, final_url or item.get("url"))
-                    item.update(detail)
-                    if final_url:
-                        item["url"] = final_url
-
-            # Normalizar rating/amount (preferir detalle si existe)
-            item["rating"] = item.get("detail_rating") or item.get("rating")
-            item["rating_count"] = item.get("detail_rating_count") or item.get("rating_count")
-            item.pop("detail_rating", None)
-            item.pop("detail_rating_count", None)
-
-            if _is_product_url(item.get("url")) and item.get("title"):
-                if item["url"] in seen_urls:
-                    continue
-                seen_urls.add(item["url"])
-                all_items.append(item)
-            if len(all_items) >= min_items:
-                break
+                _, page = got
 
-        pages_scraped += 1
-        next_url = _find_next_page(html)
+            # Enriquecer con detalle (en paralelo) si hay URL
+            for item in _iter_enriched(page.items, seen_urls, min_items - emitted, deadline_ts, detail_workers, known):
+                emitted += 1
+                yield item
 
-        if next_url:
-            if time.time() + per_page_delay < deadline_ts:
-                time.sleep(per_page_delay + random.uniform(0, 0.5))
-        if len(all_items) >= min_items:
-            break
+            pages_scraped += 1
+            if on_page is not None:
+                on_page(pages_scraped)
 
-    return all_items[:min_items]
+            if emitted >= min_items:
+                break
+    finally:
+        prefetch.close()
 
 
 def save_results_to_json(results: List[Dict], keyword: str, out_path: str) -> str:
@@ -877,7 +1275,7 @@ def save_results_to_json(results: List[Dict], keyword: str, out_path: str) -> st
     data = {
         "keyword": keyword,
         "count": len(results),
-        "items": results,
+        "items": as_dicts(results),
     }
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
@@ -889,7 +1287,7 @@ def send_results_to_java(results: List[Dict], keyword: str, java_base_url: str,
     payload = {
         "keyword": keyword,
         "count": len(results),
-        "items": results,
+        "items": as_dicts(results),
     }
     headers = {"Content-Type": "application/json"}
     if token:
@@ -897,7 +1295,7 @@ def send_results_to_java(results: List[Dict], keyword: str, java_base_url: str,
     delay = 1.0
     for _ in range(retries):
         try:
-            resp = requests.post(url, json=payload, headers=headers, timeout=timeout)
+            resp = get_session().post(url, json=payload, headers=headers, timeout=timeout)
             logging.info("POST %s status=%s count=%s", url, resp.status_code, len(results))
             if 200 <= resp.status_code < 300:
                 return True
@@ -909,93 +1307,102 @@ def send_results_to_java(results: List[Dict], keyword: str, java_base_url: str,
     return False
 
 
-def scrape_listing_from_url(url: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None) -> List[Dict]:
+def scrape_listing_from_url(url: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, on_page: Optional[Callable[[int], None]] = None, known: Optional[KnownLookup] = None) -> List[Dict]:
+    return list(iter_scrape_listing_from_url(url, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, on_page=on_page, known=known))
+
+
+def iter_scrape_listing_from_url(url: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, on_page: Optional[Callable[[int], None]] = None, known: Optional[KnownLookup] = None) -> Iterator[Dict]:
+    """
+    Igual que scrape_listing_from_url, pero entrega cada producto en cuanto
+    su detalle está enriquecido (para respuestas en streaming).
+    """
     start_ts = time.time()
     if deadline_ts is None:
         deadline_ts = start_ts + 55.0
+    # Todas las descargas y los fallbacks por palabra clave comparten este deadline
+    deadline = Deadline(deadline_ts)
     q_direct = _parse_query_from_listado_url(url)
     if q_direct:
-        items_direct = scrape_listing(q_direct, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts)
-        if items_direct:
-            return items_direct
-    html = _request(url)
-    if not html:
-        html = _request_rendered(url)
-        if not html:
-            return []
-    prim_items = _extract_listing_items(html)
-    if not prim_items:
+        found = 0
+        for item in iter_scrape_listing(q_direct, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, on_page=on_page, known=known):
+            found += 1
+            yield item
+        if found:
+            return
+    if deadline.expired():
+        return
+    page = _fetch_listing_page(url, deadline, rendered=True)
+    if page is None:
+        return
+    if not page.items:
         q0 = _parse_query_from_listado_url(url)
-        if q0:
-            alt_items = scrape_listing(q0, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay)
-            if alt_items:
-                return alt_items
-    all_items: List[Dict] = []
+        if q0 and not deadline.expired():
+            found = 0
+            for item in iter_scrape_listing(q0, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, on_page=on_page, known=known):
+                found += 1
+                yield item
+            if found:
+                return
     seen_urls = set()
+    emitted = 0
     pages_scraped = 0
     next_url = url
-    while next_url and pages_scraped < max_pages:
-        if pages_scraped > 0:
-            html = _request(next_url)
-            if not html:
-                html = _request_rendered(next_url)
-                if not html:
-                    break
-        listing_items = _extract_listing_items(html)
-        if not listing_items and pages_scraped == 0:
-            html2 = _request_rendered(next_url)
-            if html2:
-                listing_items = _extract_listing_items(html2)
-                html = html2
-        # Si no hay resultados, intenta canonicalizar con el slug y usar candidatos SSR
-        if not listing_items and pages_scraped == 0:
-            q = _parse_query_from_listado_url(next_url)
-            if q:
-                for cand in build_search_candidates(q):
-                    html_try = _request(cand) or _request_rendered(cand)
-                    if not html_try:
-                        continue
-                    parsed = _extract_listing_items(html_try)
-                    if parsed:
-                        next_url = cand
-                        html = html_try
-                        listing_items = parsed
-                        break
-                if not listing_items:
-                    # Fallback final: usar flujo por palabra clave completo
-                    return scrape_listing(q, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay)
-        if not listing_items:
-            q = _parse_query_from_listado_url(next_url)
-            if q:
-                listing_items = _api_search_items(q)
-        if not listing_items:
-            listing_items = _render_capture_search(next_url)
-        for item in listing_items:
-            if item.get("url"):
-                if time.time() > deadline_ts:
+    prefetch: Optional[_PagePrefetcher] = None
+    try:
+        while next_url and pages_scraped < max_pages and not deadline.expired():
+            if pages_scraped > 0:
+                got = prefetch.take()
+                if got is None:
                     break
-                detail_html, final_url = _request_with_url(item["url"], timeout=5)
-                if detail_html:
-                    detail = _extract_product_detail(detail_html, final_url or item.get("url"))
-                    item.update(detail)
-                    if final_url:
-                        item["url"] = final_url
-            item["rating"] = item.get("detail_rating") or item.get("rating")
-            item["rating_count"] = item.get("detail_rating_count") or item.get("rating_count")
-            item.pop("detail_rating", None)
-            item.pop("detail_rating_count", None)
-            if _is_product_url(item.get("url")) and item.get("title"):
-                if item["url"] in seen_urls:
-                    continue
-                seen_urls.add(item["url"])
-                all_items.append(item)
-            if len(all_items) >= min_items:
+                next_url, page = got
+            listing_items = page.items
+            if not listing_items and pages_scraped == 0:
+                html2 = _request_rendered(next_url, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline_ts)
+                if html2:
+                    page = ListingPage(html2)
+                    listing_items = page.items
+            # Si no hay resultados, intenta canonicalizar con el slug y usar candidatos SSR
+            if not listing_items and pages_scraped == 0:
+                q = _parse_query_from_listado_url(next_url)
+                if q:
+                    for cand in build_search_candidates(q):
+                        if deadline.expired():
+                            break
+                        html_try = _request(cand, timeout=deadline.timeout(20))
+                        if html_try:
+                            parsed_page = _fetched_listing(cand, html_try)
+                        else:
+                            html_try = _request_rendered(cand, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline_ts)
+                            if not html_try:
+                                continue
+                            parsed_page = ListingPage(html_try)
+                        if parsed_page.items:
+                            next_url = cand
+                            page = parsed_page
+                            listing_items = parsed_page.items
+                            break
+                    if not listing_items:
+                        # Fallback final: usar flujo por palabra clave completo
+                        if not deadline.expired():
+                            yield from iter_scrape_listing(q, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items - emitted, deadline_ts=deadline_ts, detail_workers=detail_workers, on_page=on_page, known=known)
+                        return
+            if not listing_items:
+                q = _parse_query_from_listado_url(next_url)
+                if q:
+                    listing_items = _api_search_items(q, timeout=deadline.timeout(20))
+            if not listing_items and not deadline.expired():
+                listing_items = _render_capture_search(next_url, int(deadline.timeout(15) * 1000), deadline_ts)
+            if prefetch is None:
+                # Desde aquí la página siguiente se descarga mientras se enriquece la actual
+                prefetch = _PagePrefetcher(page.next_url, lambda u: _fetch_listing_page(u, deadline, rendered=True), max_pages - 1, lambda: min_items - emitted, deadline, len(listing_items))
+            for item in _iter_enriched(listing_items, seen_urls, min_items - emitted, deadline_ts, detail_workers, known):
+                emitted += 1
+                yield item
+            pages_scraped += 1
+            if on_page is not None:
+                on_page(pages_scraped)
+            if emitted >= min_items:
                 break
-        pages_scraped += 1
-        next_url = _find_next_page(html)
-        if next_url:
-            if time.time() + per_page_delay < deadline_ts:
-                time.sleep(per_page_delay + random.uniform(0, 0.5))
-        if len(all_items) >= min_items:
-            break
-    return all_items[:min_items]
\ No newline at end of file
+    finally:
+        if prefetch is not None:
+            prefetch.close()
@@ -0,0 +1,473 @@
+"""
+Versión asyncio del scraper de Mercado Libre.
+
+Reutiliza los parsers y la cascada de estrategias de mercadolibre.py, pero
+las descargas usan httpx.AsyncClient y los turnos del limitador por host se
+esperan con asyncio.sleep, de modo que un solo worker de uvicorn puede
+atender muchas búsquedas a la vez.
+El parseo (CPU) y los fallbacks con Playwright (síncronos) se ejecutan en hilos.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from .mercadolibre import (
+    DETAIL_WORKERS,
+    MIN_REQUEST_TIME,
+    PAGE_PREFETCH,
+    KnownLookup,
+    ListingPage,
+    _accept,
+    _api_items_from_json,
+    _extract_product_detail,
+    _fetched_listing,
+    _headers,
+    _is_product_url,
+    _parse_query_from_listado_url,
+    _render_capture_search,
+    _rendered_page,
+    _reusable_details,
+    _request_rendered,
+    _retry_wait,
+    build_search_candidates,
+)
+from .cache import get_cache, ttl_for
+from .models import Product
+from .ratelimit import MAX_THROTTLE_WAIT, THROTTLE_STATUS, get_limiter
+from .scheduler import DISCOVERY_SHARE, HEDGE_AFTER, RACE_STAGGER, Deadline, hedged_async, race_async
+from .session import POOL_MAXSIZE, RETRY_STATUS, RETRY_TOTAL
+from .strategies import get_strategy_stats
+
+
+# Cliente HTTP ligado a cada event loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE * 4, max_keepalive_connections=POOL_MAXSIZE),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_client() -> None:
+    """
+    Cierra el cliente HTTP del loop actual (llamar al apagar la app).
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _request_with_url_async(url: str, timeout: int = 20, headers: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], Optional[str]]:
+    html, final_url, _ = await _request_timed_async(url, timeout=timeout, headers=headers)
+    return html, final_url
+
+
+async def _request_timed_async(url: str, timeout: float = 20, headers: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], Optional[str], Optional[float]]:
+    """
+    Equivalente async de _request_with_url: caché en disco, turno y cupo en
+    el limitador del host (compartidos con el scraper síncrono) y reintentos
+    con backoff en 5xx, todo dentro de timeout. Devuelve además la fecha del
+    contenido, como _request_timed.
+    """
+    cache = get_cache() if headers is None else None
+    entry = await asyncio.to_thread(cache.get, url) if cache else None
+    if entry and entry.age() < ttl_for(_is_product_url(url)):
+        return entry.body, entry.final_url, entry.stored_at
+    hdrs = headers or _headers()
+    if entry:
+        hdrs.update(entry.validators())
+    limiter = get_limiter()
+    end = time.monotonic() + timeout
+    for attempt in range(RETRY_TOTAL + 1):
+        left = end - time.monotonic()
+        if left <= 0:
+            return None, None, None
+        wait = limiter.reserve(url, max_wait=min(MAX_THROTTLE_WAIT, max(0.0, left - MIN_REQUEST_TIME)))
+        if wait is None:
+            # Circuito del host abierto o turno fuera del timeout: falla rápido
+            return None, None, None
+        if wait > 0:
+            await asyncio.sleep(wait)
+        resp = None
+        t0 = time.monotonic()
+        try:
+            async with limiter.aslot(url, timeout=max(0.0, end - t0)) as acquired:
+                if not acquired:
+                    # Sin cupo dentro del plazo: la descarga falla sin tocar la red
+                    return None, None, None
+                t0 = time.monotonic()
+                resp = await _client().get(url, headers=hdrs, timeout=max(MIN_REQUEST_TIME, end - t0))
+        except httpx.HTTPError:
+            pass
+        if resp is None:
+            limiter.observe(url, None, time.monotonic() - t0)
+        else:
+            limiter.observe(url, resp.status_code, time.monotonic() - t0, resp.headers.get("Retry-After"))
+            if resp.status_code == 304 and entry:
+                await asyncio.to_thread(cache.touch, url)
+                return entry.body, entry.final_url, time.time()
+            if resp.status_code == 200:
+                if cache:
+                    await asyncio.to_thread(cache.put, url, resp.text, str(resp.url), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+                return resp.text, str(resp.url), time.time()
+            if resp.status_code in THROTTLE_STATUS:
+                # El limitador ya redujo el ritmo y espacia el próximo turno
+                continue
+            if resp.status_code not in RETRY_STATUS:
+                return None, None, None
+        if attempt < RETRY_TOTAL:
+            await asyncio.sleep(min(_retry_wait(resp, attempt), max(0.0, end - time.monotonic())))
+    return None, None, None
+
+
+async def _request_async(url: str, timeout: int = 20) -> Optional[str]:
+    html, _ = await _request_with_url_async(url, timeout=timeout)
+    return html
+
+
+async def _api_search_items_async(query: str, limit: int = 50, timeout: float = 20) -> List[Dict]:
+    url = f"https://api.mercadolibre.com/sites/MCO/search?q={quote(query)}&limit={limit}"
+    hdrs = _headers()
+    hdrs["Accept"] = "application/json"
+    hdrs["Origin"] = "https://listado.mercadolibre.com.co"
+    body, _ = await _request_with_url_async(url, timeout=timeout, headers=hdrs)
+    if not body:
+        return []
+    return _api_items_from_json(body)
+
+
+async def _fetch_detail_async(product: Product, deadline_ts: float, workers: asyncio.Semaphore) -> Optional[Product]:
+    url = product.url
+    if not url:
+        return product
+    deadline = Deadline(deadline_ts)
+    async with workers:
+        if deadline.expired():
+            return None
+        try:
+            timeout = deadline.timeout(5)
+            # Cada intento toma su propio cupo del host en el limitador
+            fetched = await hedged_async(lambda: _request_timed_async(url, timeout=timeout), HEDGE_AFTER, timeout, accept=lambda r: r[0] is not None)
+            detail_html, final_url, fetched_at = fetched or (None, None, None)
+            if detail_html:
+                detail = await asyncio.to_thread(_extract_product_detail, detail_html, final_url or url, None, deadline_ts)
+                product.apply_detail(detail, final_url, fetched_at)
+        except Exception:
+            pass
+    return product
+
+
+async def _detail_or_stored_async(product: Product, stored: Dict[str, Dict], deadline_ts: float, workers: asyncio.Semaphore) -> Optional[Product]:
+    doc = stored.get(product.url)
+    if doc is None:
+        return await _fetch_detail_async(product, deadline_ts, workers)
+    product.merge_stored(doc)
+    return product
+
+
+async def _iter_enriched_async(
+    listing_items: List[Dict],
+    seen_urls: set,
+    limit: int,
+    deadline_ts: float,
+    detail_workers: int = DETAIL_WORKERS,
+    known: Optional[KnownLookup] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Equivalente async de _iter_enriched: detalles concurrentes, entrega en orden.
+    """
+    if not listing_items or limit <= 0:
+        return
+    workers = asyncio.Semaphore(max(1, detail_workers))
+    stored = await asyncio.to_thread(_reusable_details, listing_items, known) if known is not None else {}
+    tasks = [asyncio.ensure_future(_detail_or_stored_async(Product.from_dict(it), stored, deadline_ts, workers)) for it in listing_items]
+    accepted = 0
+    try:
+        for task in tasks:
+            try:
+                product = await asyncio.wait_for(asyncio.shield(task), max(0.0, deadline_ts - time.time()) + 1)
+            except asyncio.TimeoutError:
+                break
+            if product is None:
+                break
+            if _accept(product, seen_urls):
+                accepted += 1
+                yield product.to_dict()
+            if accepted >= limit:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _titled_page_async(url: str, timeout: float) -> Optional[ListingPage]:
+    html = await _request_async(url, timeout=timeout)
+    page = await asyncio.to_thread(_fetched_listing, url, html) if html else None
+    if page is not None and any(it.get("title") for it in page.items):
+        return page
+    return None
+
+
+async def _discover_listing_async(keyword: str, candidates: List[str], deadline: Deadline, skip_listing: bool = False) -> Tuple[Optional[str], Optional[str], Any]:
+    """
+    Equivalente async de _discover_listing; las estrategias perdedoras se cancelan.
+    """
+    stats = get_strategy_stats()
+    budget = deadline.budget(DISCOVERY_SHARE)
+    timeout = max(1.0, min(20.0, budget))
+    ssr = {} if skip_listing else {f"ssr:{i}": cand for i, cand in enumerate(candidates)}
+    rendered = {} if skip_listing else {f"rendered:{i}": cand for i, cand in enumerate(candidates)}
+    plan = stats.plan(list(ssr) + ["api"] + list(rendered) + (["render_capture"] if candidates else []))
+    tasks = {}
+    # En la carrera manda la prioridad fija (SSR antes que API); el plan solo descarta
+    for name in [n for n in list(ssr) + ["api"] if n in plan]:
+        if name == "api":
+            tasks[name] = stats.track_async(name, lambda: _api_search_items_async(keyword, timeout=timeout))
+        else:
+            tasks[name] = stats.track_async(name, lambda c=ssr[name]: _titled_page_async(c, timeout))
+    winner, result = await race_async(tasks, budget, stagger=RACE_STAGGER)
+    if winner == "api":
+        return winner, None, result
+    if winner is not None:
+        return winner, ssr[winner], result
+
+    for name in [n for n in plan if n in rendered or n == "render_capture"]:
+        if name == "render_capture":
+            if deadline.remaining() < 1:
+                continue
+            items = await asyncio.to_thread(stats.track(name, lambda: _render_capture_search(candidates[0], int(deadline.timeout(15) * 1000))))
+            if items:
+                return name, None, items
+            continue
+        if deadline.budget(DISCOVERY_SHARE) < 1:
+            continue
+        page = await asyncio.to_thread(stats.track(name, lambda c=rendered[name]: _rendered_page(c, int(deadline.budget(DISCOVERY_SHARE, cap=12) * 1000))))
+        if page is not None:
+            return name, rendered[name], page
+    return None, None, None
+
+
+async def _fetch_listing_page_async(url: str, deadline: Deadline, rendered: bool = False) -> Optional[ListingPage]:
+    html = await _request_async(url, timeout=deadline.timeout(20))
+    if html:
+        return await asyncio.to_thread(_fetched_listing, url, html)
+    if rendered:
+        html = await asyncio.to_thread(_request_rendered, url, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline.deadline_ts)
+    return await asyncio.to_thread(ListingPage, html) if html else None
+
+
+class _AsyncPagePrefetcher:
+    """
+    Equivalente async de _PagePrefetcher: una tarea descarga la página
+    siguiente mientras se enriquece la actual, con la misma regla de demanda
+    y una asyncio.Queue acotada.
+    """
+
+    def __init__(self, next_url: Optional[str], fetch: Callable[[str], Awaitable[Optional[ListingPage]]], pages_left: int, demand: Callable[[], int], deadline: Deadline, in_hand: int):
+        self._queue: "asyncio.Queue[Optional[Tuple[str, ListingPage]]]" = asyncio.Queue(maxsize=max(1, PAGE_PREFETCH))
+        self._consumed = asyncio.Event()
+        self._ahead = in_hand
+        self._in_hand = in_hand
+        self._demand = demand
+        self._deadline = deadline
+        self._task = asyncio.ensure_future(self._run(next_url, fetch, pages_left))
+
+    async def _run(self, url: Optional[str], fetch: Callable[[str], Awaitable[Optional[ListingPage]]], pages_left: int) -> None:
+        try:
+            while url and pages_left > 0 and not self._deadline.expired():
+                while self._demand() - self._ahead <= 0:
+                    self._consumed.clear()
+                    await self._consumed.wait()
+                page = await fetch(url)
+                if page is None:
+                    break
+                self._ahead += len(page.items)
+                await self._queue.put((url, page))
+                url = page.next_url
+                pages_left -= 1
+        except Exception as e:
+            logging.warning("Prefetch de página falló en %s: %s", url, e)
+        await self._queue.put(None)
+
+    async def take(self) -> Optional[Tuple[str, ListingPage]]:
+        self._ahead -= self._in_hand
+        self._in_hand = 0
+        self._consumed.set()
+        try:
+            got = await asyncio.wait_for(self._queue.get(), self._deadline.remaining() + 1)
+        except asyncio.TimeoutError:
+            return None
+        if got is not None:
+            self._in_hand = len(got[1].items)
+        return got
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+async def scrape_listing_async(keyword: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, known: Optional[KnownLookup] = None) -> List[Dict]:
+    """
+    Versión async de scrape_listing con la misma cascada de estrategias.
+    """
+    return [item async for item in iter_scrape_listing_async(keyword, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, known=known)]
+
+
+async def iter_scrape_listing_async(keyword: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, known: Optional[KnownLookup] = None) -> AsyncIterator[Dict]:
+    """
+    Versión async de iter_scrape_listing: entrega cada producto al enriquecerlo.
+    """
+    start_ts = time.time()
+    if deadline_ts is None:
+        deadline_ts = start_ts + 55.0
+    deadline = Deadline(deadline_ts)
+    candidates = build_search_candidates(keyword)
+    # Con el circuito del listado abierto se va directo a la API
+    listing_open = bool(candidates) and get_limiter().is_open(candidates[0])
+    source, url, result = await _discover_listing_async(keyword, candidates, deadline, skip_listing=listing_open)
+    if url is None:
+        if source == "api":
+            async for item in _iter_enriched_async(result, set(), min_items, deadline_ts, detail_workers, known):
+                yield item
+        elif source == "render_capture":
+            for item in result:
+                yield item
+        return
+    page = result
+    seen_urls = set()
+    emitted = 0
+
+    pages_scraped = 0
+    # La página siguiente se descarga mientras se enriquece la actual
+    prefetch = _AsyncPagePrefetcher(page.next_url, lambda u: _fetch_listing_page_async(u, deadline), max_pages - 1, lambda: min_items - emitted, deadline, len(page.items))
+    try:
+        while pages_scraped < max_pages and not deadline.expired():
+            if pages_scraped > 0:
+                got = await prefetch.take()
+                if got is None:
+                    break
+                _, page = got
+
+            async for item in _iter_enriched_async(page.items, seen_urls, min_items - emitted, deadline_ts, detail_workers, known):
+                emitted += 1
+                yield item
+
+            pages_scraped += 1
+
+            if emitted >= min_items:
+                break
+    finally:
+        prefetch.close()
+
+
+async def scrape_listing_from_url_async(url: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, known: Optional[KnownLookup] = None) -> List[Dict]:
+    """
+    Versión async de scrape_listing_from_url.
+    """
+    return [item async for item in iter_scrape_listing_from_url_async(url, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, known=known)]
+
+
+async def iter_scrape_listing_from_url_async(url: str, max_pages: int = 10, per_page_delay: float = 1.5, detail_delay: float = 1.0, min_items: int = 15, deadline_ts: Optional[float] = None, detail_workers: int = DETAIL_WORKERS, known: Optional[KnownLookup] = None) -> AsyncIterator[Dict]:
+    """
+    Versión async de iter_scrape_listing_from_url.
+    """
+    start_ts = time.time()
+    if deadline_ts is None:
+        deadline_ts = start_ts + 55.0
+    # Todas las descargas y los fallbacks por palabra clave comparten este deadline
+    deadline = Deadline(deadline_ts)
+    q_direct = _parse_query_from_listado_url(url)
+    if q_direct:
+        found = 0
+        async for item in iter_scrape_listing_async(q_direct, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, known=known):
+            found += 1
+            yield item
+        if found:
+            return
+    if deadline.expired():
+        return
+    page = await _fetch_listing_page_async(url, deadline, rendered=True)
+    if page is None:
+        return
+    if not page.items:
+        q0 = _parse_query_from_listado_url(url)
+        if q0 and not deadline.expired():
+            found = 0
+            async for item in iter_scrape_listing_async(q0, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items, deadline_ts=deadline_ts, detail_workers=detail_workers, known=known):
+                found += 1
+                yield item
+            if found:
+                return
+    seen_urls = set()
+    emitted = 0
+    pages_scraped = 0
+    next_url = url
+    prefetch: Optional[_AsyncPagePrefetcher] = None
+    try:
+        while next_url and pages_scraped < max_pages and not deadline.expired():
+            if pages_scraped > 0:
+                got = await prefetch.take()
+                if got is None:
+                    break
+                next_url, page = got
+            listing_items = page.items
+            if not listing_items and pages_scraped == 0:
+                html2 = await asyncio.to_thread(_request_rendered, next_url, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline_ts)
+                if html2:
+                    page = await asyncio.to_thread(ListingPage, html2)
+                    listing_items = page.items
+            # Si no hay resultados, intenta canonicalizar con el slug y usar candidatos SSR
+            if not listing_items and pages_scraped == 0:
+                q = _parse_query_from_listado_url(next_url)
+                if q:
+                    for cand in build_search_candidates(q):
+                        if deadline.expired():
+                            break
+                        html_try = await _request_async(cand, timeout=deadline.timeout(20))
+                        if html_try:
+                            parsed_page = await asyncio.to_thread(_fetched_listing, cand, html_try)
+                        else:
+                            html_try = await asyncio.to_thread(_request_rendered, cand, timeout_ms=int(deadline.timeout(12) * 1000), deadline_ts=deadline_ts)
+                            if not html_try:
+                                continue
+                            parsed_page = await asyncio.to_thread(ListingPage, html_try)
+                        if parsed_page.items:
+                            next_url = cand
+                            page = parsed_page
+                            listing_items = parsed_page.items
+                            break
+                    if not listing_items:
+                        # Fallback final: usar flujo por palabra clave completo
+                        if not deadline.expired():
+                            async for item in iter_scrape_listing_async(q, max_pages=max_pages, per_page_delay=per_page_delay, detail_delay=detail_delay, min_items=min_items - emitted, deadline_ts=deadline_ts, detail_workers=detail_workers, known=known):
+                                yield item
+                        return
+            if not listing_items:
+                q = _parse_query_from_listado_url(next_url)
+                if q:
+                    listing_items = await _api_search_items_async(q, timeout=deadline.timeout(20))
+            if not listing_items and not deadline.expired():
+                listing_items = await asyncio.to_thread(_render_capture_search, next_url, int(deadline.timeout(15) * 1000), deadline_ts)
+            if prefetch is None:
+                # Desde aquí la página siguiente se descarga mientras se enriquece la actual
+                prefetch = _AsyncPagePrefetcher(page.next_url, lambda u: _fetch_listing_page_async(u, deadline, rendered=True), max_pages - 1, lambda: min_items - emitted, deadline, len(listing_items))
+            async for item in _iter_enriched_async(listing_items, seen_urls, min_items - emitted, deadline_ts, detail_workers, known):
+                emitted += 1
+                yield item
+            pages_scraped += 1
+            if emitted >= min_items:
+                break
+    finally:
+        if prefetch is not None:
+            prefetch.close()
@@ -0,0 +1,174 @@
+"""
+Modelo tipado de productos y reseñas.
+
+Dentro del scraper los ítems viajan como Product/Review (dataclasses con
+__slots__) y se convierten a dict solo en los bordes: la salida de los
+iteradores de scraping, MongoDB, JSON y el envío al backend Java.
+ProductBatch es la forma columnar (arreglos numpy, una pasada) que usa el
+análisis.
+"""
+import time
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+
+@dataclass(slots=True)
+class Review:
+    title: Optional[str] = None
+    content: Optional[str] = None
+    rate: Optional[int] = None
+    date: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Review":
+        return cls(title=d.get("title"), content=d.get("content"), rate=d.get("rate"), date=d.get("date"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"title": self.title, "content": self.content, "rate": self.rate, "date": self.date}
+
+
+@dataclass(slots=True)
+class Product:
+    title: Optional[str] = None
+    url: Optional[str] = None
+    image: Optional[str] = None
+    price: Optional[float] = None
+    discount_price: Optional[float] = None
+    rating: Optional[float] = None
+    rating_count: Optional[int] = None
+    description: Optional[str] = None
+    sold: Optional[int] = None
+    reviews: List[Review] = field(default_factory=list)
+    # Si se aplicó el detalle; sin él, to_dict no incluye description/sold/reviews
+    detailed: bool = False
+    # Momento (epoch) en que se descargó el detalle aplicado
+    detail_at: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Product":
+        """
+        Producto a partir de un ítem de listado (o de un documento ya enriquecido).
+        Los valores se conservan tal cual para no alterar el item_hash.
+        """
+        detailed = "description" in d or "sold" in d or "reviews" in d
+        return cls(
+            title=d.get("title"),
+            url=d.get("url"),
+            image=d.get("image"),
+            price=d.get("price"),
+            discount_price=d.get("discount_price"),
+            rating=d.get("rating"),
+            rating_count=d.get("rating_count"),
+            description=d.get("description"),
+            sold=d.get("sold"),
+            reviews=[Review.from_dict(r) for r in d.get("reviews") or []],
+            detailed=detailed,
+            detail_at=d.get("detail_at"),
+        )
+
+    def apply_detail(self, detail: Dict[str, Any], final_url: Optional[str] = None, fetched_at: Optional[float] = None) -> None:
+        """
+        Incorpora lo extraído del detalle; la calificación del detalle tiene prioridad.
+        fetched_at es cuándo se descargó la página (la fecha de la caché si vino
+        de ahí); sin ella se toma la actual.
+        """
+        self.description = detail.get("description")
+        self.sold = detail.get("sold")
+        self.reviews = [Review.from_dict(r) for r in detail.get("reviews") or []]
+        self.rating = detail.get("detail_rating") or self.rating
+        self.rating_count = detail.get("detail_rating_count") or self.rating_count
+        self.detailed = True
+        self.detail_at = fetched_at if fetched_at is not None else time.time()
+        if final_url:
+            self.url = final_url
+
+    def merge_stored(self, doc: Dict[str, Any]) -> None:
+        """
+        Reutiliza el detalle de un documento ya guardado (recrawl incremental)
+        en lugar de descargarlo; conserva la fecha de esa descarga.
+        """
+        self.description = doc.get("description")
+        self.sold = doc.get("sold")
+        self.reviews = [Review.from_dict(r) for r in doc.get("reviews") or []]
+        if doc.get("rating") is not None:
+            self.rating = doc["rating"]
+        if doc.get("rating_count") is not None:
+            self.rating_count = doc["rating_count"]
+        self.detailed = True
+        self.detail_at = doc.get("detail_at")
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "title": self.title,
+            "url": self.url,
+            "image": self.image,
+            "price": self.price,
+            "discount_price": self.discount_price,
+            "rating": self.rating,
+            "rating_count": self.rating_count,
+        }
+        if self.detailed:
+            d["description"] = self.description
+            d["sold"] = self.sold
+            d["reviews"] = [r.to_dict() for r in self.reviews]
+            if self.detail_at is not None:
+                d["detail_at"] = self.detail_at
+        return d
+
+
+def as_dicts(items: Iterable[Union[Product, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Conversión de borde: Product a dict; los dicts pasan sin copiarse.
+    """
+    return [it.to_dict() if isinstance(it, Product) else it for it in items]
+
+
+def _numeric(values: List[Any]) -> np.ndarray:
+    # Igual que pd.to_numeric(errors="coerce") sobre la columna de un DataFrame
+    import pandas as pd
+
+    return pd.to_numeric(np.array(values, dtype=object), errors="coerce").astype(float, copy=False)
+
+
+@dataclass
+class ProductBatch:
+    """
+    Lote de productos en columnas: campos numéricos como float (NaN si faltan
+    o no son numéricos) y las reseñas aplanadas con el índice de su producto.
+    """
+    title: List[Any]
+    url: List[Any]
+    price: np.ndarray
+    discount_price: np.ndarray
+    rating: np.ndarray
+    rating_count: np.ndarray
+    sold: np.ndarray
+    review_item: np.ndarray
+    review_rate: np.ndarray
+    reviews: List[Dict[str, Any]]
+
+    def __len__(self) -> int:
+        return len(self.title)
+
+    @classmethod
+    def from_items(cls, items: Iterable[Union[Product, Dict[str, Any]]]) -> "ProductBatch":
+        rows = as_dicts(items)
+        per_item = [r.get("reviews") or [] for r in rows]
+        flat = list(chain.from_iterable(per_item))
+        lengths = np.fromiter((len(revs) for revs in per_item), dtype=np.int64, count=len(per_item))
+        rates = [rv.get("rate") for rv in flat]
+        return cls(
+            title=[r.get("title") for r in rows],
+            url=[r.get("url") for r in rows],
+            price=_numeric([r.get("price") for r in rows]),
+            discount_price=_numeric([r.get("discount_price") for r in rows]),
+            rating=_numeric([r.get("rating") for r in rows]),
+            rating_count=_numeric([r.get("rating_count") for r in rows]),
+            sold=_numeric([r.get("sold") for r in rows]),
+            review_item=np.repeat(np.arange(len(rows), dtype=np.int64), lengths),
+            review_rate=np.array([int(r) if isinstance(r, (int, float)) else np.nan for r in rates], dtype=float),
+            reviews=flat,
+        )
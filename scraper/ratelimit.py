@@ -0,0 +1,256 @@
+"""
+Límites compartidos por todas las descargas del proceso.
+
+Un semáforo por host evita concentrar la carga en un solo dominio y uno
+global acota las peticiones HTTP simultáneas, de modo que varias búsquedas
+en paralelo (p. ej. un lote de palabras clave) se reparten el mismo
+presupuesto de conexiones en lugar de sumar cada una el suyo.
+
+Además cada host (listado, articulo, www, api.mercadolibre.com) tiene un
+token bucket cuyo ritmo se adapta (AIMD): sube de a poco con cada respuesta
+buena, baja a la mitad ante 403/429 y un 10% si las respuestas se vuelven
+lentas. Tras varios fallos seguidos se abre el circuito del host: las
+peticiones fallan de inmediato durante un enfriamiento creciente y luego una
+sola petición de prueba decide si se cierra. Lo usan tanto el scraper
+síncrono como el async (reserve devuelve cuánto esperar, sin dormir).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+from .session import POOL_MAXSIZE
+
+
+# Peticiones simultáneas en todo el proceso y por host
+GLOBAL_LIMIT = int(os.environ.get("SCRAPER_GLOBAL_LIMIT", str(POOL_MAXSIZE)))
+HOST_LIMIT = int(os.environ.get("SCRAPER_HOST_LIMIT", "8"))
+
+# Ritmo por host (peticiones/s): inicial, mínimo, máximo y ráfaga permitida
+HOST_RATE = float(os.environ.get("SCRAPER_HOST_RATE", "2"))
+HOST_RATE_MIN = float(os.environ.get("SCRAPER_HOST_RATE_MIN", "0.2"))
+HOST_RATE_MAX = float(os.environ.get("SCRAPER_HOST_RATE_MAX", "10"))
+HOST_BURST = float(os.environ.get("SCRAPER_HOST_BURST", "4"))
+# AIMD: suma por respuesta buena, factor ante 403/429 y latencia que cuenta como lenta
+RATE_INCREASE = float(os.environ.get("SCRAPER_RATE_INCREASE", "0.1"))
+RATE_DECREASE = float(os.environ.get("SCRAPER_RATE_DECREASE", "0.5"))
+SLOW_LATENCY = float(os.environ.get("SCRAPER_SLOW_LATENCY", "5"))
+# Espera máxima por un turno; si el host está más atrasado se falla de inmediato
+MAX_THROTTLE_WAIT = float(os.environ.get("SCRAPER_MAX_THROTTLE_WAIT", "20"))
+# Circuit breaker: fallos seguidos para abrir y enfriamiento (se duplica en cada apertura)
+BREAKER_THRESHOLD = int(os.environ.get("SCRAPER_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("SCRAPER_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = float(os.environ.get("SCRAPER_BREAKER_MAX_COOLDOWN", "600"))
+
+THROTTLE_STATUS = (403, 429)
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    if value and value.strip().isdigit():
+        return float(value.strip())
+    return None
+
+
+class HostThrottle:
+    def __init__(self, host: str, rate: float = HOST_RATE, burst: float = HOST_BURST):
+        self.host = host
+        self.rate = min(max(rate, HOST_RATE_MIN), HOST_RATE_MAX)
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._failures = 0
+        self._trips = 0
+        self._open_until = 0.0
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return time.monotonic() < self._open_until
+
+    def reserve(self, max_wait: Optional[float] = MAX_THROTTLE_WAIT) -> Optional[float]:
+        """
+        Reserva un turno y devuelve los segundos a esperar antes de la petición,
+        o None si el circuito está abierto o la espera superaría max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            probing = False
+            if self._open_until:
+                if now < self._open_until:
+                    return None
+                # Semiabierto: una sola petición de prueba a la vez
+                if self._probe_at is not None and now - self._probe_at < MAX_THROTTLE_WAIT + 60:
+                    return None
+                self._probe_at = now
+                probing = True
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                if probing:
+                    self._probe_at = None
+                return None
+            self._tokens -= 1
+            return wait
+
+    def observe(self, status: Optional[int], latency: float, retry_after: Optional[str] = None) -> None:
+        """
+        Ajusta el ritmo según la respuesta (status None = error de red) y
+        abre o cierra el circuito.
+        """
+        wait_hint = _retry_after(retry_after)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            throttled = status in THROTTLE_STATUS
+            failed = throttled or status is None or status >= 500
+            if throttled:
+                self.rate = max(HOST_RATE_MIN, self.rate * RATE_DECREASE)
+                # Sin ráfagas tras un rechazo; con Retry-After el próximo turno se corre
+                self._tokens = min(self._tokens, 0.0)
+                if wait_hint:
+                    self._tokens = min(self._tokens, -wait_hint * self.rate)
+            elif not failed:
+                if latency > SLOW_LATENCY:
+                    self.rate = max(HOST_RATE_MIN, self.rate * 0.9)
+                else:
+                    self.rate = min(HOST_RATE_MAX, self.rate + RATE_INCREASE)
+            if failed:
+                self._failures += 1
+                if self._probe_at is not None or self._failures >= BREAKER_THRESHOLD:
+                    cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_COOLDOWN * 2 ** self._trips)
+                    if wait_hint:
+                        cooldown = max(cooldown, wait_hint)
+                    self._open_until = now + cooldown
+                    self._trips += 1
+                    self._failures = 0
+                    logging.warning("Circuito abierto para %s durante %.0fs (status=%s)", self.host, cooldown, status)
+            else:
+                self._failures = 0
+                if self._open_until:
+                    logging.info("Circuito cerrado para %s", self.host)
+                    self._open_until = 0.0
+                    self._trips = 0
+            self._probe_at = None
+
+
+class FetchLimiter:
+    def __init__(self, global_limit: int = GLOBAL_LIMIT, host_limit: int = HOST_LIMIT):
+        self.global_limit = max(1, global_limit)
+        self.host_limit = max(1, host_limit)
+        self._global = threading.BoundedSemaphore(self.global_limit)
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._throttles: Dict[str, HostThrottle] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.BoundedSemaphore(self.host_limit)
+        return sem
+
+    def throttle(self, url: str) -> HostThrottle:
+        host = (urlparse(url).hostname or "").lower()
+        with self._lock:
+            th = self._throttles.get(host)
+            if th is None:
+                th = self._throttles[host] = HostThrottle(host)
+        return th
+
+    def reserve(self, url: str, max_wait: Optional[float] = MAX_THROTTLE_WAIT) -> Optional[float]:
+        return self.throttle(url).reserve(max_wait)
+
+    def observe(self, url: str, status: Optional[int], latency: float, retry_after: Optional[str] = None) -> None:
+        self.throttle(url).observe(status, latency, retry_after)
+
+    def is_open(self, url: str) -> bool:
+        return self.throttle(url).is_open()
+
+    @contextmanager
+    def slot(self, url: str, timeout: Optional[float] = None) -> Iterator[bool]:
+        """
+        Reserva un cupo del host y uno global mientras dura la petición. El del
+        host se toma primero para que las esperas por un host ocupado no
+        retengan cupos globales que otros hosts podrían usar. Con timeout, si
+        no consigue ambos cupos en ese plazo entrega False sin retener ninguno
+        y la descarga debe fallar.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        host_sem = self._host((urlparse(url).hostname or "").lower())
+        if not _acquire_until(host_sem, end):
+            yield False
+            return
+        try:
+            if not _acquire_until(self._global, end):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                self._global.release()
+        finally:
+            host_sem.release()
+
+    @asynccontextmanager
+    async def aslot(self, url: str, timeout: Optional[float] = None) -> AsyncIterator[bool]:
+        """
+        Equivalente async de slot sobre los mismos semáforos, de modo que las
+        descargas async y las síncronas comparten los cupos. Se sondea sin
+        bloquear el event loop.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        host_sem = self._host((urlparse(url).hostname or "").lower())
+        if not await _acquire(host_sem, end):
+            yield False
+            return
+        try:
+            if not await _acquire(self._global, end):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                self._global.release()
+        finally:
+            host_sem.release()
+
+
+def _acquire_until(sem: threading.BoundedSemaphore, end: Optional[float]) -> bool:
+    if end is None:
+        return sem.acquire()
+    return sem.acquire(timeout=max(0.0, end - time.monotonic()))
+
+
+async def _acquire(sem: threading.BoundedSemaphore, end: Optional[float] = None) -> bool:
+    delay = 0.005
+    while not sem.acquire(blocking=False):
+        if end is not None and time.monotonic() >= end:
+            return False
+        await asyncio.sleep(delay if end is None else min(delay, max(0.0, end - time.monotonic())))
+        delay = min(delay * 2, 0.05)
+    return True
+
+
+_limiter: Optional[FetchLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> FetchLimiter:
+    """
+    Limitador compartido del proceso, creado de forma perezosa.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = FetchLimiter()
+    return _limiter
@@ -0,0 +1,273 @@
+"""
+Planificación con deadline para la cascada de estrategias del scraper.
+
+Deadline reparte el tiempo que queda entre etapas (cada estrategia recibe un
+presupuesto, no todo lo restante), race() corre estrategias baratas en
+paralelo (la preferida sola al principio) y se queda con la de mayor
+prioridad que funcione, y hedged()
+duplica una descarga lenta y usa la primera respuesta. Hay versiones para
+hilos y para asyncio.
+
+Un hilo no se puede interrumpir: ahí la cancelación consiste en dejar de
+esperar sus resultados y en que cada descarga use como timeout el presupuesto
+que le queda. En asyncio las tareas perdedoras se cancelan.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .ratelimit import GLOBAL_LIMIT
+
+
+# Hilos para las estrategias de race() y para las descargas de hedged(), en pools separados
+# para que un lote lleno de detalles no deje sin hilos al descubrimiento del listado. Cada
+# descarga en vuelo puede tener una copia, así que el de hedging se dimensiona desde el
+# límite global del limitador
+SCHEDULER_WORKERS = int(os.environ.get("SCRAPER_SCHEDULER_WORKERS", "64"))
+HEDGE_WORKERS = int(os.environ.get("SCRAPER_HEDGE_WORKERS", str(2 * GLOBAL_LIMIT)))
+# Fracción del tiempo restante para encontrar la primera página; el resto queda para los detalles
+DISCOVERY_SHARE = float(os.environ.get("SCRAPER_DISCOVERY_SHARE", "0.5"))
+# Espera extra por una estrategia preferida cuando otra de menor prioridad ya respondió
+RACE_GRACE = float(os.environ.get("SCRAPER_RACE_GRACE", "3"))
+# Segundos que corre sola la estrategia preferida antes de lanzar las demás (0 las lanza juntas)
+RACE_STAGGER = float(os.environ.get("SCRAPER_RACE_STAGGER", "1.5"))
+# Segundos tras los que una descarga de detalle se duplica (0 desactiva el hedging)
+HEDGE_AFTER = float(os.environ.get("SCRAPER_HEDGE_AFTER", "2.5"))
+
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pool_lock = threading.Lock()
+
+
+def _executor(kind: str) -> ThreadPoolExecutor:
+    """
+    Pool de hilos "race" o "hedge", creado de forma perezosa.
+    """
+    pool = _pools.get(kind)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(kind)
+            if pool is None:
+                size = HEDGE_WORKERS if kind == "hedge" else SCHEDULER_WORKERS
+                pool = _pools[kind] = ThreadPoolExecutor(max_workers=max(2, size), thread_name_prefix=f"sched-{kind}")
+    return pool
+
+
+class Deadline:
+    def __init__(self, deadline_ts: float):
+        self.deadline_ts = deadline_ts
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline_ts - time.time())
+
+    def expired(self) -> bool:
+        return time.time() >= self.deadline_ts
+
+    def budget(self, share: float = 1.0, cap: Optional[float] = None) -> float:
+        """
+        Parte del tiempo restante para una etapa, opcionalmente acotada por cap.
+        """
+        b = self.remaining() * share
+        return min(b, cap) if cap is not None else b
+
+    def timeout(self, cap: float, floor: float = 1.0) -> float:
+        """
+        Timeout de una petición: lo que queda hasta el deadline, entre floor y cap.
+        """
+        return max(floor, min(cap, self.remaining()))
+
+
+def _result(fut: Future) -> Any:
+    try:
+        return fut.result()
+    except Exception as e:
+        logging.debug("Estrategia falló: %s", e)
+        return None
+
+
+def race(
+    tasks: Dict[str, Callable[[], Any]],
+    timeout: float,
+    accept: Callable[[Any], bool] = bool,
+    grace: float = RACE_GRACE,
+    stagger: float = 0.0,
+) -> Tuple[Optional[str], Any]:
+    """
+    Ejecuta las estrategias en paralelo y devuelve (nombre, resultado) de la
+    primera aceptada en orden de prioridad (el orden del dict). Si solo hay
+    resultado de una de menor prioridad, se espera a las preferidas como
+    mucho `grace` segundos más. Con stagger > 0 la preferida corre sola y las
+    demás se lanzan si falla o si tarda más de stagger segundos. (None, None)
+    si ninguna sirve a tiempo.
+    """
+    names = list(tasks)
+    held = names[1:] if stagger > 0 else []
+    futures = {name: _executor("race").submit(tasks[name]) for name in names if name not in held}
+    end = time.time() + max(0.0, timeout)
+    launch_at = time.time() + stagger
+    fallback_end: Optional[float] = None
+    try:
+        while True:
+            pending = []
+            fallback = None
+            for name, fut in futures.items():
+                if not fut.done():
+                    pending.append(fut)
+                    continue
+                res = _result(fut)
+                if accept(res):
+                    if not pending:
+                        return name, res
+                    if fallback is None:
+                        fallback = (name, res)
+            now = time.time()
+            if held and now < end and (not pending or now >= launch_at):
+                # La preferida falló o se demora: entran las demás
+                futures.update((name, _executor("race").submit(tasks[name])) for name in held)
+                held = []
+                continue
+            if not pending:
+                return None, None
+            if fallback is not None:
+                if fallback_end is None:
+                    fallback_end = min(end, now + grace)
+                if now >= fallback_end:
+                    return fallback
+            if now >= end:
+                return None, None
+            limit = (fallback_end if fallback_end is not None else end) - now
+            if held:
+                limit = min(limit, launch_at - now)
+            wait(pending, timeout=limit, return_when=FIRST_COMPLETED)
+    finally:
+        for fut in futures.values():
+            fut.cancel()
+
+
+def hedged(
+    fn: Callable[[], Any],
+    hedge_after: float,
+    timeout: float,
+    accept: Callable[[Any], bool] = lambda r: r is not None,
+) -> Any:
+    """
+    Ejecuta fn() y, si no terminó en hedge_after segundos, lanza una copia;
+    devuelve el primer resultado aceptado o None al vencer timeout.
+    """
+    end = time.time() + max(0.0, timeout)
+    first = _executor("hedge").submit(fn)
+    futures = [first]
+    try:
+        if 0 < hedge_after < timeout:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                futures.append(_executor("hedge").submit(fn))
+        try:
+            for fut in as_completed(futures, timeout=max(0.0, end - time.time())):
+                res = _result(fut)
+                if accept(res):
+                    return res
+        except FutureTimeoutError:
+            pass
+        return None
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+async def _aresult(task: "asyncio.Task") -> Any:
+    try:
+        return task.result()
+    except Exception as e:
+        logging.debug("Estrategia falló: %s", e)
+        return None
+
+
+async def race_async(
+    tasks: Dict[str, Callable[[], Awaitable[Any]]],
+    timeout: float,
+    accept: Callable[[Any], bool] = bool,
+    grace: float = RACE_GRACE,
+    stagger: float = 0.0,
+) -> Tuple[Optional[str], Any]:
+    """
+    Equivalente async de race; las estrategias que no ganan se cancelan.
+    """
+    names = list(tasks)
+    held = names[1:] if stagger > 0 else []
+    running = {name: asyncio.ensure_future(tasks[name]()) for name in names if name not in held}
+    loop = asyncio.get_running_loop()
+    end = loop.time() + max(0.0, timeout)
+    launch_at = loop.time() + stagger
+    fallback_end: Optional[float] = None
+    try:
+        while True:
+            pending = []
+            fallback = None
+            for name, task in running.items():
+                if not task.done():
+                    pending.append(task)
+                    continue
+                res = await _aresult(task)
+                if accept(res):
+                    if not pending:
+                        return name, res
+                    if fallback is None:
+                        fallback = (name, res)
+            now = loop.time()
+            if held and now < end and (not pending or now >= launch_at):
+                running.update((name, asyncio.ensure_future(tasks[name]())) for name in held)
+                held = []
+                continue
+            if not pending:
+                return None, None
+            if fallback is not None:
+                if fallback_end is None:
+                    fallback_end = min(end, now + grace)
+                if now >= fallback_end:
+                    return fallback
+            if now >= end:
+                return None, None
+            limit = (fallback_end if fallback_end is not None else end) - now
+            if held:
+                limit = min(limit, launch_at - now)
+            await asyncio.wait(pending, timeout=limit, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in running.values():
+            task.cancel()
+
+
+async def hedged_async(
+    fn: Callable[[], Awaitable[Any]],
+    hedge_after: float,
+    timeout: float,
+    accept: Callable[[Any], bool] = lambda r: r is not None,
+) -> Any:
+    """
+    Equivalente async de hedged; la copia perdedora se cancela.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + max(0.0, timeout)
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        if 0 < hedge_after < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                tasks.append(asyncio.ensure_future(fn()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, end - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                res = await _aresult(task)
+                if accept(res):
+                    return res
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,95 @@
+"""
+Sesión HTTP compartida del scraper.
+
+Todas las descargas (listados, detalles, API y envío a Java) usan un único
+requests.Session con pool de conexiones keep-alive por host. Los reintentos
+con backoff en 5xx los hace el scraper dentro del plazo de cada descarga
+(_limited_get); urllib3 no reintenta conexiones ni lecturas.
+"""
+import os
+import threading
+from typing import Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Cantidad de hosts con pool propio y conexiones reutilizables por host
+POOL_HOSTS = int(os.environ.get("SCRAPER_POOL_HOSTS", "10"))
+POOL_MAXSIZE = int(os.environ.get("SCRAPER_POOL_MAXSIZE", "16"))
+# Política de reintentos del scraper: 3 reintentos => 4 intentos, espera backoff * 2^n
+# (respeta Retry-After), siempre dentro del timeout de la descarga.
+# 403/429 los maneja el limitador por host (scraper.ratelimit)
+RETRY_TOTAL = int(os.environ.get("SCRAPER_RETRIES", "3"))
+RETRY_BACKOFF = float(os.environ.get("SCRAPER_RETRY_BACKOFF", "1.0"))
+RETRY_STATUS = (500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def build_retry(status: int = 0, backoff: float = RETRY_BACKOFF, statuses: Iterable[int] = RETRY_STATUS) -> Retry:
+    """
+    Construye la política de urllib3. Nunca reintenta conexiones ni lecturas:
+    urllib3 no conoce el plazo de la descarga y un timeout se multiplicaría
+    por los intentos y sus esperas. Los 5xx solo se reintentan aquí si
+    status > 0 (por defecto los reintenta _limited_get, acotado al plazo).
+    Solo métodos idempotentes; devuelve la última respuesta si se agotan.
+    """
+    return Retry(
+        total=status,
+        connect=0,
+        read=0,
+        status=status,
+        backoff_factor=backoff,
+        status_forcelist=tuple(statuses),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def _build_session(pool_hosts: int, pool_maxsize: int, retry: Retry) -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, max_retries=retry)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def get_session() -> requests.Session:
+    """
+    Devuelve la sesión compartida del proceso, creándola de forma perezosa.
+    El pool de urllib3 es seguro entre hilos; los headers se pasan por petición.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(POOL_HOSTS, POOL_MAXSIZE, build_retry())
+    return _session
+
+
+def configure_session(pool_hosts: int = POOL_HOSTS, pool_maxsize: int = POOL_MAXSIZE, retries: int = 0, backoff: float = RETRY_BACKOFF) -> requests.Session:
+    """
+    Reemplaza la sesión compartida con otro tamaño de pool o política de reintentos.
+    retries son reintentos de 5xx en urllib3, sin plazo: solo para clientes
+    que no pasan por _limited_get.
+    """
+    global _session
+    with _session_lock:
+        old = _session
+        _session = _build_session(pool_hosts, pool_maxsize, build_retry(retries, backoff))
+    if old is not None:
+        old.close()
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        old = _session
+        _session = None
+    if old is not None:
+        old.close()
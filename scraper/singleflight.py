@@ -0,0 +1,116 @@
+"""
+Coalescencia de búsquedas idénticas concurrentes (single-flight).
+
+Mientras una búsqueda está en vuelo, las llamadas con la misma clave esperan
+su resultado en lugar de repetir el scrape. Hay una versión para hilos
+(SingleFlight) y otra para asyncio (AsyncSingleFlight); ninguna guarda el
+resultado una vez terminada la llamada original.
+"""
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .cache import normalize_url
+
+
+def flight_key(target: str, max_pages: Optional[int] = None, min_items: Optional[int] = None, incremental: bool = False) -> str:
+    """
+    Clave normalizada para (palabra clave o URL, max_pages, min_items). Un
+    scrape incremental devuelve detalles guardados, así que no se comparte
+    con uno completo.
+    """
+    target = (target or "").strip()
+    if target.lower().startswith(("http://", "https://")):
+        norm = normalize_url(target)
+    else:
+        norm = " ".join(target.lower().split())
+    key = f"{norm}|{max_pages}|{min_items}"
+    return key + "|incremental" if incremental else key
+
+
+def _share(result: Any) -> Any:
+    # Cada llamador recibe su propia lista para que pueda modificarla sin afectar al resto
+    return list(result) if isinstance(result, list) else result
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Ejecuta fn() una sola vez por clave entre los hilos concurrentes y
+        devuelve (o relanza) el mismo resultado a todos.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _share(call.result)
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return _share(call.result)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        # Futures ligados a cada event loop
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Equivalente async de SingleFlight.do. La corrutina compartida corre en su
+        propia tarea, así que cancelar a un llamador no cancela a los demás.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        fut = calls.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fn())
+            calls[key] = fut
+
+            def _done(f: asyncio.Future) -> None:
+                if calls.get(key) is f:
+                    calls.pop(key, None)
+                # Evita el aviso "exception was never retrieved" si nadie quedó esperando
+                if not f.cancelled():
+                    f.exception()
+
+            fut.add_done_callback(_done)
+        return _share(await asyncio.shield(fut))
+
+    def in_flight(self) -> int:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return 0
+        return len(self._calls.get(loop, {}))
+
+
+search_flight = SingleFlight()
+search_flight_async = AsyncSingleFlight()
@@ -0,0 +1,177 @@
+"""
+Memoria de resultados de las estrategias de búsqueda del listado.
+
+Cada estrategia de la cascada (candidatos SSR, render de esos candidatos,
+API y captura con Playwright) registra si sirvió y cuánto tardó; se guarda
+una media móvil exponencial (EWMA) de la tasa de éxito y de la latencia.
+Con eso la cascada descarta las estrategias que vienen fallando y ordena los
+fallbacks secuenciales por costo esperado (latencia / tasa de éxito). Una
+estrategia descartada se vuelve a probar de vez en cuando (al azar o si hace
+mucho que no se intenta) para detectar que se recuperó.
+
+Las estadísticas son del proceso; si SCRAPER_STRATEGY_STATS apunta a un
+archivo se cargan al iniciar y se guardan periódicamente.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# Peso de la última observación en la media móvil
+STRATEGY_ALPHA = float(os.environ.get("SCRAPER_STRATEGY_ALPHA", "0.2"))
+# Tasa de éxito bajo la cual una estrategia se salta, y muestras necesarias para decidirlo
+STRATEGY_MIN_RATE = float(os.environ.get("SCRAPER_STRATEGY_MIN_RATE", "0.1"))
+STRATEGY_MIN_SAMPLES = int(os.environ.get("SCRAPER_STRATEGY_MIN_SAMPLES", "5"))
+# Probabilidad de probar igual una estrategia descartada, y segundos tras los que se prueba siempre
+STRATEGY_PROBE = float(os.environ.get("SCRAPER_STRATEGY_PROBE", "0.1"))
+STRATEGY_PROBE_INTERVAL = float(os.environ.get("SCRAPER_STRATEGY_PROBE_INTERVAL", "300"))
+# Archivo JSON opcional para conservar las estadísticas entre reinicios
+STRATEGY_STATS_PATH = os.environ.get("SCRAPER_STRATEGY_STATS", "")
+STRATEGY_SAVE_INTERVAL = float(os.environ.get("SCRAPER_STRATEGY_SAVE_INTERVAL", "30"))
+
+
+class _Stat:
+    __slots__ = ("rate", "latency", "samples", "last_ts")
+
+    def __init__(self, rate: float = 1.0, latency: float = 0.0, samples: int = 0, last_ts: float = 0.0):
+        # Sin datos se asume que la estrategia funciona (orden por defecto de la cascada)
+        self.rate = rate
+        self.latency = latency
+        self.samples = samples
+        self.last_ts = last_ts
+
+
+class StrategyStats:
+    def __init__(self, path: Optional[str] = STRATEGY_STATS_PATH):
+        self.path = path or None
+        self._stats: Dict[str, _Stat] = {}
+        self._lock = threading.Lock()
+        self._saved_at = time.time()
+        self._dirty = False
+        if self.path:
+            self._load()
+
+    def record(self, name: str, ok: bool, latency: float) -> None:
+        with self._lock:
+            st = self._stats.get(name)
+            if st is None:
+                st = self._stats[name] = _Stat(rate=1.0 if ok else 0.0, latency=latency)
+            else:
+                st.rate += STRATEGY_ALPHA * ((1.0 if ok else 0.0) - st.rate)
+                st.latency += STRATEGY_ALPHA * (latency - st.latency)
+            st.samples += 1
+            st.last_ts = time.time()
+            self._dirty = True
+            save = self.path and time.time() - self._saved_at >= STRATEGY_SAVE_INTERVAL
+        if save:
+            self.save()
+
+    def _dead(self, st: Optional[_Stat]) -> bool:
+        return st is not None and st.samples >= STRATEGY_MIN_SAMPLES and st.rate < STRATEGY_MIN_RATE
+
+    def plan(self, names: List[str]) -> List[str]:
+        """
+        Estrategias a intentar, en orden. Se quitan las que vienen fallando
+        (salvo cuando toca sondearlas) y el resto se ordena por costo
+        esperado; sin datos se conserva el orden recibido. Si todas vienen
+        fallando se devuelven todas.
+        """
+        now = time.time()
+        with self._lock:
+            stats = {n: self._stats.get(n) for n in names}
+        keep = []
+        for n in names:
+            st = stats[n]
+            if not self._dead(st) or random.random() < STRATEGY_PROBE or now - st.last_ts >= STRATEGY_PROBE_INTERVAL:
+                keep.append(n)
+        if not keep:
+            keep = list(names)
+        keep.sort(key=lambda n: stats[n].latency / max(stats[n].rate, 0.01) if stats[n] is not None else 0.0)
+        return keep
+
+    def track(self, name: str, fn: Callable[[], Any], ok: Callable[[Any], bool] = bool) -> Callable[[], Any]:
+        """
+        Envuelve fn para registrar su resultado (una excepción cuenta como fallo).
+        """
+        def _run() -> Any:
+            t0 = time.monotonic()
+            res = None
+            try:
+                res = fn()
+                return res
+            finally:
+                self.record(name, bool(ok(res)), time.monotonic() - t0)
+        return _run
+
+    def track_async(self, name: str, fn: Callable[[], Awaitable[Any]], ok: Callable[[Any], bool] = bool) -> Callable[[], Awaitable[Any]]:
+        """
+        Equivalente async de track; una tarea cancelada no se registra.
+        """
+        async def _run() -> Any:
+            t0 = time.monotonic()
+            try:
+                res = await fn()
+            except Exception:
+                self.record(name, False, time.monotonic() - t0)
+                raise
+            self.record(name, bool(ok(res)), time.monotonic() - t0)
+            return res
+        return _run
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                n: {"rate": round(st.rate, 4), "latency": round(st.latency, 3), "samples": st.samples, "last_ts": st.last_ts}
+                for n, st in self._stats.items()
+            }
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for n, d in data.items():
+                self._stats[n] = _Stat(float(d["rate"]), float(d["latency"]), int(d["samples"]), float(d.get("last_ts") or 0.0))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("No se pudieron cargar las estadísticas de estrategias %s: %s", self.path, e)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._saved_at = time.time()
+        data = self.snapshot()
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.warning("No se pudieron guardar las estadísticas de estrategias %s: %s", self.path, e)
+
+
+_stats: Optional[StrategyStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_strategy_stats() -> StrategyStats:
+    """
+    Estadísticas compartidas del proceso, creadas de forma perezosa.
+    """
+    global _stats
+    if _stats is None:
+        with _stats_lock:
+            if _stats is None:
+                _stats = StrategyStats()
+    return _stats
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Los tests importan los módulos del proyecto (scraper, main) desde la raíz del repo
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
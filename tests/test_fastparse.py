@@ -0,0 +1,56 @@
+"""
+Paridad del backend lxml (scraper.fastparse) con el camino BeautifulSoup de
+mercadolibre.py sobre páginas guardadas: ambos deben devolver los mismos dicts.
+"""
+import os
+
+import pytest
+
+from scraper import mercadolibre as ml
+
+from conftest import FIXTURES
+
+
+def _load(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _listing(html: str, backend: str):
+    page = ml.ListingPage(html, backend=backend)
+    return page.items, page.next_url, page.preloaded_state, page.ld_json
+
+
+@pytest.mark.parametrize("name, expected_items", [
+    ("listado.html", 4),
+    ("listado_div.html", 2),
+    ("listado_ldjson.html", 2),
+    ("listado_preloaded.html", 2),
+])
+def test_listing_backends_match(name, expected_items):
+    html = _load(name)
+    bs4 = _listing(html, "bs4")
+    lxml = _listing(html, "lxml")
+    assert bs4 == lxml
+    assert len(bs4[0]) == expected_items
+
+
+def test_listing_next_page():
+    _, next_url, _, _ = _listing(_load("listado.html"), "lxml")
+    assert next_url == "https://listado.mercadolibre.com.co/audifonos-bluetooth_Desde_51_NoIndex_True"
+
+
+@pytest.mark.parametrize("name", ["detalle.html", "detalle_fallback.html"])
+def test_detail_backends_match(name):
+    html = _load(name)
+    # Sin base_url no se renderizan reseñas: solo cuenta el parseo
+    bs4 = ml._extract_product_detail(html, None, backend="bs4")
+    lxml = ml._extract_product_detail(html, None, backend="lxml")
+    assert bs4 == lxml
+    assert bs4["description"] and bs4["reviews"]
+
+
+@pytest.mark.parametrize("html", ["", "   ", "<html></html>", "no es html"])
+def test_empty_pages_match(html):
+    assert _listing(html, "bs4") == _listing(html, "lxml")
+    assert ml._extract_product_detail(html, None, backend="bs4") == ml._extract_product_detail(html, None, backend="lxml")
@@ -0,0 +1,123 @@
+"""
+Equivalencia de _stats_kernel (numpy sobre ProductBatch) con las funciones
+pandas de referencia: _summary, _histogram y _best_benefit.
+
+Única diferencia documentada: en empates de beneficio el kernel conserva el
+orden de llegada y sort_values no garantiza ninguno, así que con empates se
+compara el conjunto de ítems y se fija aparte el orden del kernel.
+"""
+import math
+
+import pytest
+
+import main
+from scraper.models import ProductBatch
+
+
+def _item(i, price, rating=None, discount_price=None):
+    return {
+        "title": f"Producto {i}",
+        "url": f"https://articulo.mercadolibre.com.co/MCO-{i}-_JM",
+        "price": price,
+        "rating": rating,
+        "discount_price": discount_price,
+    }
+
+
+def _reference(items, bins=30, top=20):
+    df = main.to_dataframe(items)
+    return {
+        "summary": main._summary(df),
+        "histogram_price": main._histogram(df["price"], bins=bins),
+        "best_benefit": main._best_benefit(df, top=top),
+    }
+
+
+def _approx(value):
+    if isinstance(value, dict):
+        return {k: _approx(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_approx(v) for v in value]
+    if isinstance(value, float) and math.isfinite(value):
+        return pytest.approx(value, rel=1e-12)
+    return value
+
+
+def _by_benefit(rows):
+    return sorted(rows, key=lambda r: (-r["benefit"], r["url"]))
+
+
+CASES = {
+    "variado": [
+        _item(0, 120000, 4.5, 150000),
+        _item(1, 89900.5, 4.8),
+        _item(2, "45.000", 3.9),
+        _item(3, 250000, None, 300000),
+        _item(4, 15000, 4.1),
+        _item(5, 999999, 5.0),
+        _item(6, 32000.25, "4,2"),
+        _item(7, 7800, 2.5, 9900),
+    ],
+    "precios_faltantes": [
+        _item(0, None, 4.0),
+        _item(1, float("nan"), 5.0),
+        _item(2, "sin precio", 3.0),
+        _item(3, 0, 4.5),
+        _item(4, 0, None),
+        _item(5, 50000, 4.0, 60000),
+        _item(6, 80000, None),
+        {"title": "Sin campos", "url": "https://articulo.mercadolibre.com.co/MCO-7-_JM"},
+    ],
+    "un_item": [_item(0, 35000, 4.2, 40000)],
+    "precio_constante": [_item(i, 50000, r) for i, r in enumerate([4.0, 3.5, 5.0, None])],
+    "precio_cero_constante": [_item(i, 0, 4.0) for i in range(3)],
+    "sin_precios": [_item(i, None, 4.0) for i in range(3)],
+    "vacio": [],
+}
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_summary_and_histogram_match(name):
+    items = CASES[name]
+    got = main._stats_kernel(ProductBatch.from_items(items), bins=30, top=20)
+    ref = _reference(items, bins=30, top=20)
+    assert got["summary"] == _approx(ref["summary"])
+    assert got["histogram_price"] == _approx(ref["histogram_price"])
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+@pytest.mark.parametrize("top", [1, 3, 20])
+def test_best_benefit_matches(name, top):
+    items = CASES[name]
+    got = main._stats_kernel(ProductBatch.from_items(items), top=top)["best_benefit"]
+    ref = _reference(items, top=top)["best_benefit"]
+    assert len(got) == len(ref)
+    # Con empates en el corte el conjunto puede diferir: se compara por beneficio
+    assert [r["benefit"] for r in got] == _approx([r["benefit"] for r in ref])
+    if len({r["benefit"] for r in got}) == len(got):
+        assert got == _approx(ref)
+
+
+@pytest.mark.parametrize("bins", [1, 5, 30])
+def test_histogram_bins(bins):
+    items = CASES["variado"]
+    got = main._stats_kernel(ProductBatch.from_items(items), bins=bins)["histogram_price"]
+    assert got == _approx(_reference(items, bins=bins)["histogram_price"])
+    assert sum(b["count"] for b in got) == 8
+
+
+def test_ties_keep_arrival_order():
+    # Mismo beneficio (rating / precio) en los ítems 0, 2 y 3
+    items = [
+        _item(0, 10000, 4.0),
+        _item(1, 10000, 5.0),
+        _item(2, 20000, 8.0),
+        _item(3, 5000, 2.0),
+        _item(4, 10000, 1.0),
+    ]
+    got = main._stats_kernel(ProductBatch.from_items(items), top=3)["best_benefit"]
+    assert [r["title"] for r in got] == ["Producto 1", "Producto 0", "Producto 2"]
+    full = main._stats_kernel(ProductBatch.from_items(items), top=20)["best_benefit"]
+    ref = _reference(items, top=20)["best_benefit"]
+    assert _by_benefit(full) == _approx(_by_benefit(ref))
+    assert [r["title"] for r in full] == ["Producto 1", "Producto 0", "Producto 2", "Producto 3", "Producto 4"]